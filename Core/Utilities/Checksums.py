@@ -0,0 +1,166 @@
+'''
+Verification of the md5 sums of the files of an installed application, used by L{TARsoft.check}.
+
+Files are read in chunks, and hashed by a pool of threads. The size, modification time and sum
+of the files found correct are recorded in a manifest next to them: the next verification only
+reads again the files whose size or modification time changed.
+
+L{MD5Reader} gets the sum of a stream while it's being used, e.g. unpacked.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from DIRAC                                                   import S_OK, S_ERROR, gLogger
+import os, hashlib, threading, Queue
+
+CHUNK_SIZE = 1048576
+
+def md5File(path, chunksize = CHUNK_SIZE):
+  """ The md5 sum of the file, read chunksize bytes at a time
+  """
+  checksum = hashlib.md5()
+  fileobj = open(path, 'rb')
+  try:
+    while True:
+      data = fileobj.read(chunksize)
+      if not data:
+        break
+      checksum.update(data)
+  finally:
+    fileobj.close()
+  return checksum.hexdigest()
+
+class MD5Reader(object):
+  """ Read only file object computing the md5 sum of what is read through it, e.g. to check a tar ball
+  while it's being unpacked
+  """
+  def __init__(self, fileobj):
+    self.fileobj = fileobj
+    self.checksum = hashlib.md5()
+    self.size = 0
+
+  def read(self, size = -1):
+    """ Read from the underlying file
+    """
+    data = self.fileobj.read(size)
+    self.checksum.update(data)
+    self.size += len(data)
+    return data
+
+  def readAll(self):
+    """ Read what is left, so that the sum is the one of the whole file
+    """
+    while self.read(CHUNK_SIZE):
+      pass
+
+  def hexdigest(self):
+    """ The md5 sum of what was read so far
+    """
+    return self.checksum.hexdigest()
+
+def readManifest(manifest):
+  """ Read the manifest: {relative path : (size, mtime, md5 sum)}, empty if it cannot be read
+  """
+  entries = {}
+  if not os.path.exists(manifest):
+    return entries
+  try:
+    mfile = open(manifest, 'r')
+    try:
+      for line in mfile:
+        md5sum, size, mtime, path = line.rstrip("\n").split(" ", 3)
+        entries[path] = (int(size), int(mtime), md5sum)
+    finally:
+      mfile.close()
+  except (IOError, ValueError), x:
+    gLogger.warn("Could not read the checksum manifest %s, ignoring it:" % manifest, str(x))
+    return {}
+  return entries
+
+def writeManifest(manifest, entries):
+  """ Write the manifest, replacing the previous one at once. Not being allowed to is not an error:
+  the files will only be hashed again next time.
+  """
+  tmpmanifest = "%s.%s" % (manifest, os.getpid())
+  try:
+    mfile = open(tmpmanifest, 'w')
+    try:
+      for path in sorted(entries.keys()):
+        size, mtime, md5sum = entries[path]
+        mfile.write("%s %s %s %s\n" % (md5sum, size, mtime, path))
+    finally:
+      mfile.close()
+    os.rename(tmpmanifest, manifest)
+  except (IOError, OSError), x:
+    gLogger.verbose("Could not write the checksum manifest %s:" % manifest, str(x))
+    if os.path.exists(tmpmanifest):
+      os.remove(tmpmanifest)
+
+def verifyChecksums(basefolder, expected, manifest = '', nbthreads = 4):
+  """ Check the files of basefolder against their expected md5 sums ({relative path : md5 sum}).
+  When a manifest file is given, the files it lists with unchanged size and modification time
+  are not read, and it is updated with those found correct.
+  Returns S_OK with the number of files hashed, S_ERROR at the first missing or corrupted file.
+  """
+  entries = {}
+  if manifest:
+    entries = readManifest(manifest)
+  verified = {}
+  tohash = Queue.Queue()
+  for path, md5sum in expected.items():
+    fullpath = os.path.join(basefolder, path)
+    if not os.path.exists(fullpath):
+      gLogger.error("File missing :", fullpath)
+      return S_ERROR("Incomplete install: The file %s is missing" % fullpath)
+    stat = os.stat(fullpath)
+    signature = (stat.st_size, int(stat.st_mtime))
+    if entries.get(path) == signature + (md5sum,):
+      verified[path] = entries[path]
+    else:
+      tohash.put((path, signature))
+  nbhashed = tohash.qsize()
+  state = {'Failed' : None}
+  lock = threading.Lock()
+
+  def worker():
+    """ Hash the files until there is none left, or one was found wrong
+    """
+    while not state['Failed']:
+      try:
+        path, signature = tohash.get_nowait()
+      except Queue.Empty:
+        return
+      fullpath = os.path.join(basefolder, path)
+      try:
+        fmd5 = md5File(fullpath)
+      except IOError, x:
+        gLogger.error("Failed to compute md5 sum of %s:" % fullpath, str(x))
+        state['Failed'] = S_ERROR("Failed to compute md5 sum")
+        return
+      lock.acquire()
+      try:
+        if fmd5 != expected[path]:
+          gLogger.error("File has wrong checksum :", fullpath)
+          gLogger.error("Found %s, expected %s" % (fmd5, expected[path]))
+          state['Failed'] = S_ERROR("Corrupted install: File %s has a wrong sum" % fullpath)
+          return
+        verified[path] = signature + (fmd5,)
+      finally:
+        lock.release()
+
+  threads = []
+  for dummy in range(max(1, min(nbthreads, nbhashed))):
+    thread = threading.Thread(target = worker)
+    thread.setDaemon(True)
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  if state['Failed']:
+    return state['Failed']
+  if manifest and nbhashed:
+    writeManifest(manifest, verified)
+  gLogger.verbose("Checked %s files, %s of them were hashed" % (len(expected), nbhashed))
+  return S_OK(nbhashed)
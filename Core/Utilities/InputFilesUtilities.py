@@ -7,11 +7,38 @@ For any input file, try to determine from the FC the number of events / luminosi
 from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
 import os
 
-from DIRAC import gLogger
+from DIRAC import gLogger, S_OK
 
-def getNumberOfevents(inputfile):
-  """ Find from the FileCatalog the number of events in a file
+def _getFileMetadata(fc, lfn, metacache):
+  """ Get the user meta data of the file, from the metacache if it's there
   """
+  files = metacache.setdefault('Files', {})
+  if files.has_key(lfn):
+    return S_OK(files[lfn])
+  res = fc.getFileUserMetadata(lfn)
+  if res['OK']:
+    files[lfn] = res['Value']
+  return res
+
+def _getDirectoryMetadata(fc, path, metacache):
+  """ Get the meta data of the directory, from the metacache if it's there
+  """
+  directories = metacache.setdefault('Directories', {})
+  if directories.has_key(path):
+    return S_OK(directories[path])
+  res = fc.getDirectoryMetadata(path)
+  if res['OK']:
+    directories[path] = res['Value']
+  return res
+
+def getNumberOfevents(inputfile, metacache = None):
+  """ Find from the FileCatalog the number of events in a file. 
+  
+  The meta data obtained from the catalog are kept in the metacache dictionary: when the same dictionary
+  is given to the next calls (e.g. through the workflow_commons), the catalog is not queried again.
+  """
+  if metacache is None:
+    metacache = {}
 
   files = inputfile
   flist = {}
@@ -36,7 +63,7 @@ def getNumberOfevents(inputfile):
     found_lumi = False
 
     if len(files) == 1:
-      res = fc.getFileUserMetadata(files[0])
+      res = _getFileMetadata(fc, files[0], metacache)
       if not res['OK']:
         gLogger.verbose("Failed to get meta data")
         continue
@@ -51,7 +78,7 @@ def getNumberOfevents(inputfile):
       if found_nbevts: 
         continue
         
-    res = fc.getDirectoryMetadata(path)
+    res = _getDirectoryMetadata(fc, path, metacache)
     if res['OK']:   
       tags = res['Value']
       if tags.has_key("NumberOfEvents") and not found_nbevts:
@@ -67,7 +94,7 @@ def getNumberOfevents(inputfile):
         continue
       
     for myfile in files:
-      res = fc.getFileUserMetadata(myfile)
+      res = _getFileMetadata(fc, myfile, metacache)
       if not res['OK']:
         continue
       tags = res['Value']
@@ -86,3 +113,33 @@ def getNumberOfevents(inputfile):
     del others['Luminosity']
   nbevts['AdditionalMeta'] = others
   return nbevts
+
+def getNumberOfEventsPerFile(lfns, metacache = None):
+  """ Find from the FileCatalog the number of events in each file: the directory meta data is used 
+  when defined (one call per directory), the file meta data otherwise. Returns a dictionary {lfn : nbevts},
+  files whose number of events is unknown are not in it. See L{getNumberOfevents} for the metacache.
+  """
+  if metacache is None:
+    metacache = {}
+  flist = {}
+  for lfn in lfns:
+    if not lfn:
+      continue
+    flist.setdefault(os.path.dirname(lfn), []).append(lfn)
+
+  fc = FileCatalogClient()
+  nbevts = {}
+  for path, files in flist.items():
+    res = _getDirectoryMetadata(fc, path, metacache)
+    if res['OK'] and res['Value'].has_key("NumberOfEvents"):
+      for lfn in files:
+        nbevts[lfn] = int(res['Value']["NumberOfEvents"])
+      continue
+    for lfn in files:
+      res = _getFileMetadata(fc, lfn, metacache)
+      if not res['OK']:
+        gLogger.verbose("Failed to get meta data of %s" % lfn)
+        continue
+      if res['Value'].has_key("NumberOfEvents"):
+        nbevts[lfn] = int(res['Value']["NumberOfEvents"])
+  return nbevts
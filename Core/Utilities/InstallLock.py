@@ -0,0 +1,133 @@
+'''
+Lock of the installation of an application in a software area, shared by the jobs of a node
+(or of all the nodes using the same shared area).
+
+The lock is an fcntl.flock on a lock file: the jobs waiting for it sleep in the kernel instead
+of polling, and it's released by the system when its holder dies, so it never needs to be taken
+away from a job that is only slow. The holder writes its host and PID in the lock file, and
+empties it when it's done: the next holder finding it not empty knows the installation was
+interrupted.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from ILCDIRAC.Core.Utilities.TransferPacer                  import disableWatchdogCPUCheck, enableWatchdogCPUCheck
+from DIRAC                                                   import S_OK, S_ERROR, gLogger
+import os, fcntl, errno, socket, time, threading
+
+##The watchdog flag is one file for the whole job: it's only put back when no thread is waiting anymore
+_waiting = [0]
+_waitingLock = threading.Lock()
+
+def _startWaiting():
+  """ Count a thread waiting for a lock, the first one disables the CPU check of the watchdog
+  """
+  _waitingLock.acquire()
+  try:
+    _waiting[0] += 1
+    if _waiting[0] == 1:
+      disableWatchdogCPUCheck()
+  finally:
+    _waitingLock.release()
+
+def _stopWaiting():
+  """ The thread got the lock (or failed to), the last one waiting enables the CPU check again
+  """
+  _waitingLock.acquire()
+  try:
+    _waiting[0] -= 1
+    if not _waiting[0]:
+      enableWatchdogCPUCheck()
+  finally:
+    _waitingLock.release()
+
+class InstallLock(object):
+  """ Exclusive lock of the installation of an application
+  """
+  def __init__(self, lockname):
+    self.lockname = lockname
+    self.lockfile = None
+    self.log = gLogger.getSubLogger("InstallLock")
+
+  def getHolder(self):
+    """ What the current or last holder wrote in the lock file: host, PID and time, empty if none
+    """
+    try:
+      lockfile = open(self.lockname, 'r')
+      try:
+        return lockfile.read().strip()
+      finally:
+        lockfile.close()
+    except IOError:
+      return ''
+
+  def acquire(self):
+    """ Get the lock, waiting as long as another job has it.
+    Returns S_OK(True) if the previous holder did not finish, meaning its installation has to be redone.
+    """
+    while True:
+      try:
+        lockfile = open(self.lockname, 'a+')
+      except IOError, x:
+        self.log.error("Failed creating lock")
+        return S_ERROR("Not allowed to write here: IOError %s" % (str(x)))
+      try:
+        try:
+          fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, x:
+          if x.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+          self.log.info("Waiting for the installation done by %s" % (self.getHolder() or "another job"))
+          ##Not using CPU while waiting is expected
+          _startWaiting()
+          start = time.time()
+          try:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+          finally:
+            _stopWaiting()
+          self.log.info("Got the lock %s after %.0f seconds" % (self.lockname, time.time() - start))
+      except IOError, x:
+        lockfile.close()
+        self.log.error("Failed locking %s:" % self.lockname, str(x))
+        return S_ERROR("Failed to lock: %s" % str(x))
+      ##The previous holder removes the file when done: if so, this lock is on a file nobody else will look at
+      try:
+        stillthere = os.fstat(lockfile.fileno()).st_ino == os.stat(self.lockname).st_ino
+      except OSError:
+        stillthere = False
+      if stillthere:
+        break
+      lockfile.close()
+
+    lockfile.seek(0)
+    previous = lockfile.read().strip()
+    interrupted = bool(previous)
+    if interrupted:
+      self.log.warn("The installation done by %s did not finish, it will be redone" % previous)
+    lockfile.seek(0)
+    lockfile.truncate()
+    lockfile.write("%s %s %s\n" % (socket.gethostname(), os.getpid(), time.strftime("%Y-%m-%d %H:%M:%S")))
+    lockfile.flush()
+    self.lockfile = lockfile
+    return S_OK(interrupted)
+
+  def release(self):
+    """ Remove the lock file and release the lock, the installation is done (successful or not)
+    """
+    if not self.lockfile:
+      return S_OK()
+    try:
+      try:
+        os.unlink(self.lockname)
+      except OSError, x:
+        self.log.error("Failed cleaning lock: OSError", "%s" % (str(x)))
+        ##Else the next one would think this installation was interrupted
+        self.lockfile.seek(0)
+        self.lockfile.truncate()
+    finally:
+      fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_UN)
+      self.lockfile.close()
+      self.lockfile = None
+    return S_OK()
@@ -0,0 +1,98 @@
+'''
+Capture of the output of the applications run by the workflow modules, see L{ModuleBase.redirectLogOutput}.
+
+The callback is called for every line the application prints, so it has to be cheap: the log file
+is kept open (and buffered) until L{LogCapture.close}, the event strings are compiled once in a
+single regular expression, and only the last lines of the standard error are kept.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+import re, sys, threading, collections
+
+class LogCapture(object):
+  """ Write the application output in the log file, print the lines matching the event strings
+  """
+  def __init__(self, logfile, eventstring = None, excludeAllButEventString = False, parser = None, 
+               maxErrorLines = 1000):
+    """ eventstring is the list of patterns of the lines to print. An empty list means all the lines
+    are printed, a list with an empty first element that none is. With excludeAllButEventString,
+    only the lines that are printed go in the log file. All the lines are given to the parser
+    (a L{LogParser}), if any.
+    """
+    self.logfile = logfile
+    self.eventstring = eventstring
+    self.excludeAllButEventString = excludeAllButEventString
+    self.parser = parser
+    if type(eventstring) == type(' '):
+      eventstring = [eventstring]
+    if eventstring is None:
+      eventstring = ['']
+    self.printAll = not len(eventstring)
+    self.filter = None
+    if len(eventstring) and len(eventstring[0]):
+      self.filter = re.compile("|".join(["(?:%s)" % pattern for pattern in eventstring]))
+    self.handle = None
+    self.stdError = collections.deque([], maxErrorLines)
+    self.lines = 0
+    self.bytes = 0
+    self.errorLines = 0
+    self.lock = threading.Lock()
+
+  def isFor(self, logfile, eventstring, excludeAllButEventString, parser):
+    """ Check if this capture was created with these parameters
+    """
+    return self.logfile == logfile and self.eventstring is eventstring and self.parser is parser and \
+           self.excludeAllButEventString == excludeAllButEventString
+
+  def write(self, fd, message):
+    """ Treat one message of the application, fd is 0 for stdout and 1 for stderr
+    """
+    self.lock.acquire()
+    try:
+      if message:
+        self.lines += 1
+        self.bytes += len(message) + 1
+        if self.parser:
+          self.parser.parse(message)
+        selected = self.printAll or (self.filter is not None and self.filter.search(message))
+        if selected:
+          sys.stdout.flush()
+          print message
+        if self.logfile and (selected or not self.excludeAllButEventString):
+          if not self.handle:
+            self.handle = open(self.logfile, 'a')
+          self.handle.write(message + '\n')
+      if fd == 1:
+        self.errorLines += 1
+        self.stdError.append(message)
+    finally:
+      self.lock.release()
+
+  def getStdError(self):
+    """ The last lines of the standard error
+    """
+    return "\n".join(self.stdError)
+
+  def clearStdError(self):
+    """ Forget the standard error, e.g. before running a new application
+    """
+    self.stdError.clear()
+
+  def close(self):
+    """ Flush and close the log file. It is reopened if more output comes.
+    """
+    self.lock.acquire()
+    try:
+      if self.handle:
+        self.handle.close()
+        self.handle = None
+    finally:
+      self.lock.release()
+
+  def getStatistics(self):
+    """ Counters of what was captured
+    """
+    return {'Lines' : self.lines, 'Bytes' : self.bytes, 'ErrorLines' : self.errorLines}
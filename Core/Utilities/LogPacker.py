@@ -0,0 +1,143 @@
+'''
+Pack the log files of a job in a single compressed tar archive.
+
+The files are streamed into the archive, without being copied first. The ones bigger than
+the size limit are truncated: their beginning and their end are kept, which is where the
+interesting parts of a log are.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from DIRAC                                                   import S_OK, S_ERROR, gLogger
+from distutils.spawn                                         import find_executable
+import os, tarfile, subprocess
+
+class TruncatedFile(object):
+  """ Read only view of a file made of its first and last bytes, with a note in between
+  saying how much was dropped. Has what tarfile needs: size and read().
+  """
+  def __init__(self, path, sizelimit):
+    self.fileobj = open(path, 'rb')
+    filesize = os.fstat(self.fileobj.fileno()).st_size
+    headsize = sizelimit / 2
+    tailsize = sizelimit - headsize
+    marker = "\n\n[... %s bytes truncated ...]\n\n" % (filesize - headsize - tailsize)
+    self.segments = [(0, headsize), marker, (filesize - tailsize, tailsize)]
+    self.size = headsize + len(marker) + tailsize
+
+  def read(self, size = -1):
+    """ Read at most size bytes, everything if size is negative
+    """
+    data = []
+    left = size
+    while self.segments and left:
+      segment = self.segments.pop(0)
+      if isinstance(segment, str):
+        chunk = segment
+        if left > 0:
+          chunk = segment[:left]
+          if len(segment) > left:
+            self.segments.insert(0, segment[left:])
+      else:
+        offset, length = segment
+        nbytes = length
+        if left > 0:
+          nbytes = min(left, length)
+        self.fileobj.seek(offset)
+        chunk = self.fileobj.read(nbytes)
+        ##Keep the announced size even if the file changed meanwhile
+        chunk += ' ' * (nbytes - len(chunk))
+        if nbytes < length:
+          self.segments.insert(0, (offset + nbytes, length - nbytes))
+      data.append(chunk)
+      if left > 0:
+        left -= len(chunk)
+    return "".join(data)
+
+  def close(self):
+    """ Close the underlying file
+    """
+    self.fileobj.close()
+
+def getLogCompression(compression):
+  """ Get the compression that can be used: xz needs the xz executable, gz is always possible
+  """
+  if compression == 'xz' and find_executable('xz'):
+    return 'xz'
+  if compression != 'gz':
+    gLogger.warn("Compression %s not available, using gz" % compression)
+  return 'gz'
+
+def _openFile(tar, path, sizelimit):
+  """ Get the tar header of the file and the file object to stream, truncated if bigger than sizelimit.
+  Raises IOError or OSError if the file cannot be read, before anything is written in the archive.
+  """
+  tarinfo = tar.gettarinfo(path, os.path.basename(path))
+  ##Logs have to be readable by the web server
+  tarinfo.mode |= 0444
+  if sizelimit and tarinfo.size > sizelimit:
+    fileobj = TruncatedFile(path, sizelimit)
+    tarinfo.size = fileobj.size
+  else:
+    fileobj = open(path, 'rb')
+  return tarinfo, fileobj
+
+def packLogFiles(files, archive, compression = 'gz', sizelimit = 0, notruncate = ('.root',)):
+  """ Write the files in the archive, compressed with gz or xz (see L{getLogCompression}).
+  Files above sizelimit bytes are truncated, except those ending with one of the notruncate
+  extensions, which are skipped. Returns S_OK with the list of Truncated and Skipped files.
+  """
+  result = {'Truncated' : [], 'Skipped' : []}
+  proc = None
+  output = None
+  tar = None
+  try:
+    if compression == 'xz':
+      output = open(archive, 'wb')
+      proc = subprocess.Popen(['xz', '-c'], stdin = subprocess.PIPE, stdout = output)
+      tar = tarfile.open(fileobj = proc.stdin, mode = 'w|')
+    else:
+      tar = tarfile.open(archive, 'w:gz')
+    for path in files:
+      ##A file that vanished or cannot be read does not prevent from getting the others
+      try:
+        if sizelimit and os.path.getsize(path) > sizelimit and path.endswith(notruncate):
+          gLogger.warn('Log file found to be greater than maximum of %s bytes' % sizelimit, path)
+          result['Skipped'].append(path)
+          continue
+        tarinfo, fileobj = _openFile(tar, path, sizelimit)
+      except (IOError, OSError), x:
+        gLogger.warn('Could not read log file %s, skipping it:' % path, str(x))
+        result['Skipped'].append(path)
+        continue
+      try:
+        tar.addfile(tarinfo, fileobj)
+      finally:
+        fileobj.close()
+      if isinstance(fileobj, TruncatedFile):
+        gLogger.info('Log file %s truncated to %s bytes' % (path, sizelimit))
+        result['Truncated'].append(path)
+    tar.close()
+  except (IOError, OSError, tarfile.TarError), x:
+    if proc:
+      proc.stdin.close()
+      proc.wait()
+      output.close()
+    elif tar:
+      try:
+        tar.close()
+      except (IOError, OSError, tarfile.TarError):
+        pass
+    ##Better no archive than a truncated one
+    if os.path.exists(archive):
+      os.remove(archive)
+    return S_ERROR("Could not create %s: %s" % (archive, str(x)))
+  if proc:
+    proc.stdin.close()
+    status = proc.wait()
+    output.close()
+    if status:
+      return S_ERROR("xz failed with status %s" % status)
+  return S_OK(result)
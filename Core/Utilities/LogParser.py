@@ -0,0 +1,50 @@
+'''
+Extraction of information from the logs of the applications, while they run.
+
+A L{LogParser} is given to L{ModuleBase} (logParser attribute) before running the application:
+each line of output is then passed to it by L{ModuleBase.redirectLogOutput}, so the log does
+not need to be read again once the application is done.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+import re
+
+class LogParser(object):
+  """ Apply a table of rules to the lines of a log. The rules are a list of (pattern, action): for
+  each line, the action of the first rule whose pattern matches is called with the match object
+  (match.string is the line) and the results dictionary. When an action returns True, the parsing
+  stops and the following lines are ignored.
+  """
+  def __init__(self, rules, results = None):
+    self.rules = [(re.compile(pattern), action) for pattern, action in rules]
+    ##Most lines match nothing, one search is enough to know it
+    self.prefilter = re.compile("|".join(["(?:%s)" % pattern for pattern, dummy_action in rules]))
+    self.results = results
+    if self.results is None:
+      self.results = {}
+    self.done = False
+
+  def parse(self, line):
+    """ Apply the rules to the line
+    """
+    if self.done or not self.prefilter.search(line):
+      return
+    for regex, action in self.rules:
+      match = regex.search(line)
+      if match:
+        self.done = bool(action(match, self.results))
+        return
+
+  def parseFile(self, path):
+    """ Apply the rules to all the lines of an existing log
+    """
+    logfile = open(path, 'r')
+    try:
+      for line in logfile:
+        self.parse(line.rstrip())
+    finally:
+      logfile.close()
+    return self.results
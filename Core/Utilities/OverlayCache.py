@@ -0,0 +1,196 @@
+'''
+Node local cache of the overlay files, shared between the jobs running on the same node
+(or on the same shared file system).
+
+Files are stored under a key computed from the LFN and its catalog checksum, so a file that
+was produced again is never confused with its older version. The cache is bounded in size,
+the least recently used files are removed first. All the modifications of the cache are done
+under an exclusive flock, and files are put in place with a rename, so concurrent jobs can
+use it safely. Only files matching their catalog checksum (see L{checkFile}) should be stored.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from DIRAC.ConfigurationSystem.Client.Helpers.Operations     import Operations
+from DIRAC                                                   import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities.Adler                              import fileAdler, compareAdler
+from ILCDIRAC.Core.Utilities.Checksums                       import md5File
+import os, shutil, fcntl, hashlib, threading
+
+def checkFile(localfile, checksum, checksumtype = 'Adler32'):
+  """ Check that the local file has the checksum given by the catalog, adler32 or md5 
+  """
+  if not checksum:
+    return S_ERROR("No checksum to compare to")
+  try:
+    if checksumtype.upper() in ('MD5', 'MD'):
+      found = md5File(localfile)
+      good = found == checksum.lower()
+    else:
+      found = fileAdler(localfile)
+      good = bool(found) and compareAdler(found, checksum)
+  except (IOError, OSError), x:
+    return S_ERROR("Could not compute the checksum of %s: %s" % (localfile, str(x)))
+  if not good:
+    return S_ERROR("Checksum of %s is %s, the catalog says %s" % (localfile, found, checksum))
+  return S_OK()
+
+class OverlayCache(object):
+  """ Content addressed cache of files, keyed by LFN and checksum
+  """
+  def __init__(self, path, maxsize):
+    """ maxsize is in bytes
+    """
+    self.path = path
+    self.maxsize = maxsize
+    self.log = gLogger.getSubLogger("OverlayCache")
+    self.lockfile = os.path.join(self.path, ".lock")
+    self.hits = 0
+    self.misses = 0
+    ##The jobs use the cache from several threads: protects the counters
+    self.statsLock = threading.Lock()
+
+  def _key(self, lfn, checksum):
+    """ Location of the file in the cache
+    """
+    key = hashlib.sha1("%s:%s" % (lfn, checksum)).hexdigest()
+    return os.path.join(self.path, key[:2], key, os.path.basename(lfn))
+
+  def _lock(self):
+    """ Get the exclusive lock of the cache, returns the open lock file
+    """
+    if not os.path.isdir(self.path):
+      try:
+        os.makedirs(self.path)
+      except OSError:
+        ##Another job did it in the mean time
+        if not os.path.isdir(self.path):
+          raise
+    lock = open(self.lockfile, 'a')
+    fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+    return lock
+
+  def _unlock(self, lock):
+    """ Release the lock obtained with L{_lock}
+    """
+    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    lock.close()
+
+  def get(self, lfn, checksum, destination):
+    """ Put the cached version of the lfn at destination, hard linked if possible, copied otherwise:
+    a link to the cache would break if another job evicts the file.
+    Returns S_OK(True) on a hit, S_OK(False) on a miss.
+    """
+    if not checksum:
+      return S_OK(False)
+    cached = self._key(lfn, checksum)
+    try:
+      ##Mark it as recently used
+      os.utime(cached, None)
+      try:
+        os.link(cached, destination)
+      except OSError:
+        tmpfile = "%s.%s.tmp" % (destination, os.getpid())
+        try:
+          shutil.copy2(cached, tmpfile)
+          os.rename(tmpfile, destination)
+        except (IOError, OSError):
+          if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+          raise
+    except (IOError, OSError):
+      ##Not there, or evicted in between
+      self._count(False)
+      return S_OK(False)
+    self._count(True)
+    self.log.verbose("Got %s from the cache" % lfn)
+    return S_OK(True)
+
+  def _count(self, hit):
+    """ Count a hit or a miss
+    """
+    self.statsLock.acquire()
+    try:
+      if hit:
+        self.hits += 1
+      else:
+        self.misses += 1
+    finally:
+      self.statsLock.release()
+
+  def put(self, lfn, checksum, localfile):
+    """ Store the localfile in the cache, then make room if needed
+    """
+    if not checksum:
+      return S_OK()
+    cached = self._key(lfn, checksum)
+    try:
+      lock = self._lock()
+    except (IOError, OSError), x:
+      return S_ERROR("Could not lock the cache: %s" % str(x))
+    try:
+      try:
+        if os.path.exists(cached):
+          return S_OK()
+        if not os.path.isdir(os.path.dirname(cached)):
+          os.makedirs(os.path.dirname(cached))
+        tmpfile = "%s.%s.tmp" % (cached, os.getpid())
+        try:
+          os.link(localfile, tmpfile)
+        except OSError:
+          shutil.copy2(localfile, tmpfile)
+        os.rename(tmpfile, cached)
+        self._evict()
+      except (IOError, OSError), x:
+        return S_ERROR("Could not store %s in the cache: %s" % (lfn, str(x)))
+    finally:
+      self._unlock(lock)
+    return S_OK()
+
+  def _evict(self):
+    """ Remove the least recently used files until the cache fits in maxsize. Called with the lock held.
+    """
+    entries = []
+    total = 0
+    for dirpath, dummy_dirnames, filenames in os.walk(self.path):
+      for filename in filenames:
+        fullpath = os.path.join(dirpath, filename)
+        if fullpath == self.lockfile:
+          continue
+        try:
+          stat = os.stat(fullpath)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, fullpath))
+        total += stat.st_size
+    if total <= self.maxsize:
+      return
+    entries.sort()
+    for dummy_mtime, size, fullpath in entries:
+      if total <= self.maxsize:
+        break
+      self.log.verbose("Evicting %s" % fullpath)
+      try:
+        os.unlink(fullpath)
+        os.rmdir(os.path.dirname(fullpath))
+      except OSError:
+        pass
+      total -= size
+
+def getOverlayCache(site):
+  """ Get the L{OverlayCache} configured for the site, or None if the cache is not enabled.
+  The cache is enabled by setting /Overlay/Cache/Path (or /Overlay/Sites/<site>/CachePath), its
+  size in GB is given by /Overlay/Cache/MaxSize (or /Overlay/Sites/<site>/CacheMaxSize).
+  """
+  ops = Operations()
+  path = ops.getValue("/Overlay/Cache/Path", "")
+  path = ops.getValue("/Overlay/Sites/%s/CachePath" % site, path)
+  if not path:
+    return None
+  maxsize = ops.getValue("/Overlay/Cache/MaxSize", 50)
+  maxsize = ops.getValue("/Overlay/Sites/%s/CacheMaxSize" % site, maxsize)
+  path = os.path.expandvars(path)
+  gLogger.info("Using overlay cache in %s, limited to %s GB" % (path, maxsize))
+  return OverlayCache(path, int(maxsize * 1024 * 1024 * 1024))
@@ -0,0 +1,96 @@
+'''
+Index of the errors found in the logs of the production jobs, used by dirac-ilc-get-prod-log:
+the job log archives are extracted, and the L{ERROR_SIGNATURES} are counted in each of them.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from ILCDIRAC.Core.Utilities.LogParser                      import LogParser
+import os, tarfile, subprocess
+
+##What is looked for in the logs: (signature, pattern). The first group, if any, is added to the signature,
+##the other groups must not capture
+ERROR_SIGNATURES = [('Exit code', r'Status after the application execution is ([1-9]\d*)'),
+                    ('Exited with status', r'[Ee]xited [Ww]ith [Ss]tatus ([1-9]\d*)'),
+                    ('Fatal error', r'Fatal error'),
+                    ('PYSTOP', r'PYSTOP'),
+                    ('No matrix element available', r'No matrix element available'),
+                    ('Floating point exception', r'Floating point exception'),
+                    ('Segmentation fault', r'[Ss]egmentation (?:fault|violation)'),
+                    ('Out of memory', r'std::bad_alloc|Out of memory'),
+                    ('Python exception', r'^Traceback \(most recent call last\)'),
+                    ('Failed to upload', r'Failed [Tt]o [Uu]pload'),
+                    ('Not enough events', r'Not enough events')]
+
+def _signatureRule(name):
+  """ Action of the L{LogParser} rule of a signature: count it
+  """
+  def count(match, results):
+    signature = name
+    if match.groups() and match.group(1):
+      signature = "%s %s" % (name, match.group(1))
+    results[signature] = results.get(signature, 0) + 1
+  return count
+
+def getSignatureParser():
+  """ The parser finding the L{ERROR_SIGNATURES}
+  """
+  return LogParser([(pattern, _signatureRule(name)) for name, pattern in ERROR_SIGNATURES])
+
+def extractAndIndex(localfile, outputdir):
+  """ Extract the log archive in outputdir/<job>, reading it as a stream, and look for the error
+  signatures in the files it contains. Files that are not archives are only indexed.
+  Returns the signatures found, with the number of times they were seen.
+  """
+  parser = getSignatureParser()
+  if not localfile.endswith(('.tar', '.gz', '.tgz', '.xz', '.bz2')):
+    parser.parseFile(localfile)
+    return parser.results
+  jobdir = os.path.join(outputdir, os.path.basename(localfile).split(".")[0])
+  if not os.path.isdir(jobdir):
+    os.makedirs(jobdir)
+  proc = None
+  if localfile.endswith('.xz'):
+    proc = subprocess.Popen(['xz', '-dc', localfile], stdout = subprocess.PIPE)
+    tar = tarfile.open(fileobj = proc.stdout, mode = 'r|')
+  else:
+    tar = tarfile.open(localfile, 'r|*')
+  try:
+    for member in tar:
+      if not member.isfile():
+        continue
+      src = tar.extractfile(member)
+      dst = open(os.path.join(jobdir, os.path.basename(member.name)), 'w')
+      while True:
+        line = src.readline()
+        if not line:
+          break
+        dst.write(line)
+        parser.parse(line.rstrip())
+      dst.close()
+  finally:
+    tar.close()
+    if proc:
+      proc.stdout.close()
+      proc.wait()
+  return parser.results
+
+def writeIndex(index, indexfile):
+  """ One line per file and signature: file, signature, number of occurrences, tab separated
+  """
+  of = open(indexfile, 'w')
+  for lfn in sorted(index.keys()):
+    for signature, count in sorted(index[lfn].items()):
+      of.write("%s\t%s\t%s\n" % (os.path.basename(lfn), signature, count))
+  of.close()
+
+def rankSignatures(index):
+  """ The signatures, with the number of files they appear in, most frequent first
+  """
+  ranking = {}
+  for signatures in index.values():
+    for signature in signatures.keys():
+      ranking[signature] = ranking.get(signature, 0) + 1
+  return sorted(ranking.items(), key = lambda item: item[1], reverse = True)
@@ -0,0 +1,81 @@
+'''
+Registration of the meta data and ancestors of many files at once, used by the RegisterOutputData modules.
+
+Everything is sent in as few calls as possible, and only what failed is sent again.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+def _setMetadata(fc, metadict):
+  """ Set the meta data of all the paths of metadict ({path : {meta : value}}), returns the failed ones
+  with the reason. Uses the bulk call when the catalog supports it, one call per path otherwise.
+  """
+  res = fc.setMetadataBulk(metadict)
+  if res['OK']:
+    return res['Value']['Failed']
+  gLogger.verbose("Bulk meta data registration not possible, registering one by one:", res['Message'])
+  failed = {}
+  for path, meta in metadict.items():
+    res = fc.setMetadata(path, meta)
+    if not res['OK']:
+      failed[path] = res['Message']
+  return failed
+
+def registerMetadata(fc, metadict, retries = 2):
+  """ Set the meta data given in metadict ({path : {meta : value}}), retrying the failed paths.
+  Returns S_OK with the Successful paths and the Failed ones with the reason.
+  """
+  toregister = metadict
+  failed = {}
+  for dummy_attempt in range(retries + 1):
+    if not toregister:
+      break
+    failed = _setMetadata(fc, toregister)
+    toregister = dict([(path, metadict[path]) for path in failed.keys()])
+  successful = [path for path in metadict.keys() if not failed.has_key(path)]
+  return S_OK({'Successful' : successful, 'Failed' : failed})
+
+def registerAncestors(fc, ancestordict, retries = 2):
+  """ Register the ancestors given in ancestordict ({lfn : [ancestors]}), retrying the failed files.
+  Returns S_OK with the Successful files and the Failed ones with the reason.
+  """
+  toregister = ancestordict
+  failed = {}
+  for dummy_attempt in range(retries + 1):
+    if not toregister:
+      break
+    res = fc.addFileAncestors(dict([(lfn, {'Ancestors' : ancestors}) for lfn, ancestors in toregister.items()]))
+    if not res['OK']:
+      failed = dict([(lfn, res['Message']) for lfn in toregister.keys()])
+    else:
+      failed = res['Value']['Failed']
+    toregister = dict([(lfn, ancestordict[lfn]) for lfn in failed.keys()])
+  successful = [lfn for lfn in ancestordict.keys() if not failed.has_key(lfn)]
+  return S_OK({'Successful' : successful, 'Failed' : failed})
+
+def registerFiles(fc, metadict, ancestordict, log = gLogger):
+  """ Register the meta data and the ancestors of the output files of a job, as done by
+  the RegisterOutputData modules. Returns S_ERROR if any file could not be registered.
+  """
+  res = registerMetadata(fc, metadict)
+  if not res['OK']:
+    return res
+  for path in res['Value']['Successful']:
+    log.info("Registered %s with tags %s" % (path, metadict[path]))
+  if res['Value']['Failed']:
+    for path, message in res['Value']['Failed'].items():
+      log.error('Could not register metadata for %s' % path, message)
+    return S_ERROR('Could not register metadata of %s files' % len(res['Value']['Failed']))
+
+  res = registerAncestors(fc, ancestordict)
+  if not res['OK']:
+    return res
+  if res['Value']['Failed']:
+    for lfn, message in res['Value']['Failed'].items():
+      log.error('Registration of Ancestors for %s failed' % lfn, message)
+    return S_ERROR('Registration of Ancestors failed for %s files' % len(res['Value']['Failed']))
+  return S_OK()
@@ -11,6 +11,42 @@ Works recursively
 from DIRAC import gLogger
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations            import Operations
 
+def _getDependencies(ops, sysconfig, appli, appversion):
+  """ The direct dependencies of the application, as defined in the CS: list of (app, version)
+  """
+  deps = ops.getSections('/AvailableTarBalls/%s/%s/%s/Dependencies' % (sysconfig, appli, 
+                                                                       appversion), '')
+  depslist = []
+  if deps['OK']:
+    for dep in deps['Value']:
+      vers = ops.getValue('/AvailableTarBalls/%s/%s/%s/Dependencies/%s/version' % (sysconfig, appli, 
+                                                                                    appversion, dep), '')
+      if not vers:
+        gLogger.error("Retrieving dependency version for %s failed, skipping to next !" % (dep))
+        continue
+      gLogger.verbose("Found dependency %s %s" % (dep, vers))
+      depslist.append((dep, vers))
+  else:
+    gLogger.verbose("Could not find any dependency for %s %s, ignoring" % (appli, appversion))
+  return depslist
+
+def getDependencyGraph(sysconfig, appli, appversion):
+  """ Get all the dependencies of the application, looking each of them up only once
+  
+  Uses same parameters as L{resolveDeps}.
+  @return: dictionary {(app, version) : [(app, version) of its direct dependencies]}, including the application
+  """
+  ops = Operations()
+  graph = {}
+  todo = [(appli, appversion)]
+  while todo:
+    node = todo.pop()
+    if graph.has_key(node):
+      continue
+    graph[node] = _getDependencies(ops, sysconfig, node[0], node[1])
+    todo.extend(graph[node])
+  return graph
+
 def resolveDeps(sysconfig, appli, appversion):
   """ Resolve the dependencies
   
@@ -21,32 +57,20 @@ def resolveDeps(sysconfig, appli, appversion):
   @param appversion: application version
   @type appversion: string
   
-  @return: array of dictionaries
+  @return: array of dictionaries, each dependency appearing once
   """
-  ops = Operations()
-  deps = ops.getSections('/AvailableTarBalls/%s/%s/%s/Dependencies' % (sysconfig, appli, 
-                                                                       appversion), '')
+  graph = getDependencyGraph(sysconfig, appli, appversion)
   depsarray = []
-  if deps['OK']:
-    for dep in deps['Value']:
-      vers = ops.getValue('/AvailableTarBalls/%s/%s/%s/Dependencies/%s/version' % (sysconfig, appli, 
-                                                                                    appversion, dep), '')
-      depvers = ''
-      if vers:
-        depvers = vers
-      else:
-        gLogger.error("Retrieving dependency version for %s failed, skipping to next !" % (dep))
+  seen = set([(appli, appversion)])
+  def walk(node):
+    for dep in graph[node]:
+      if dep in seen:
         continue
-      gLogger.verbose("Found dependency %s %s" % (dep, depvers))
-      depdict = {}
-      depdict["app"] = dep
-      depdict["version"] = depvers
-      depsarray.append(depdict)
+      seen.add(dep)
+      depsarray.append({"app" : dep[0], "version" : dep[1]})
       ##resolve recursive dependencies
-      depsofdeps = resolveDeps(sysconfig, dep, depvers)
-      depsarray.extend(depsofdeps)
-  else:
-    gLogger.verbose("Could not find any dependency for %s %s, ignoring" % (appli, appversion))
+      walk(dep)
+  walk((appli, appversion))
   return depsarray
 
 def resolveDepsTar(sysconfig, appli, appversion):
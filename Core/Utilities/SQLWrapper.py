@@ -7,6 +7,10 @@ Based on Jan Engels bash script
 
 Called from ILCDIRAC.Workflow.Modules.MokkaAnalysis
 
+Setting up the DB from the dump takes minutes, so once done, the data directory is stored as a
+snapshot in the software area, per Mokka version and dump file checksum. The next jobs only
+unpack it in their own directory and start the server.
+
 @author: Przemyslaw Majewski and Stephane Poss
 @since: Feb 1, 2010
 '''
@@ -16,18 +20,25 @@ from DIRAC.Core.Utilities.Subprocess import shellCall, Subprocess
 from ILCDIRAC.Core.Utilities.PrepareLibs import removeLibc
 from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation  import LocalArea, SharedArea
 
-import os, sys, tempfile, threading, time, shutil
+import os, sys, tempfile, threading, time, shutil, socket, tarfile
+
+try:
+  from hashlib import md5
+except ImportError:
+  from md5 import md5
 
 EXECUTION_RESULT = {}
 
 class SQLWrapper:
-  def __init__(self, softwareDir = './', mokkaDBroot = ''):
+  def __init__(self, softwareDir = './', mokkaDBroot = '', mokkaVersion = ''):
     """Set initial variables
     
     @param softwareDir: path to the location of the software installation
     @type softwareDir: string
     @param mokkaDBroot: path to the place where the DB will live
     @type mokkaDBroot: string
+    @param mokkaVersion: version of Mokka, part of the name of the DB snapshot
+    @type mokkaVersion: string
     
     """
     self.MokkaDumpFile = ""
@@ -46,6 +57,15 @@ class SQLWrapper:
     
     self.mysqlInstalDir = ''  
     
+    self.mokkaVersion = mokkaVersion
+    ##Where the snapshots of the DB are looked for, and stored: the first area where it's possible
+    self.snapshotDirs = [os.path.join(softwareDir, 'MokkaDBSnapshots')]
+    localSnapshotDir = os.path.join(LocalArea(), 'MokkaDBSnapshots')
+    if not localSnapshotDir in self.snapshotDirs:
+      self.snapshotDirs.append(localSnapshotDir)
+    self.safeOptions = ''
+    self.socketTimeout = 600
+    
     #mysqld threading
     self.bufferLimit = 10485760   
     self.maxPeekLines = 20
@@ -83,7 +103,7 @@ class SQLWrapper:
     except Exception, x:
       self.log.error("Exception error: %s" % (x))
       return S_ERROR("Exception error: %s" % (x))
-    self.MokkaDataDir = os.path.join(self.initialDir, "data")
+    self.MokkaDataDir = os.path.join(self.mokkaDBroot, "data")
     try:
       os.mkdir(self.MokkaDataDir)
     except Exception, x:
@@ -149,13 +169,105 @@ class SQLWrapper:
     os.environ['PATH'] = '%s/mysql4grid/bin:%s' % (self.softDir, os.environ['PATH'])
     self.exeEnv = dict( os.environ )
     
-    safe_options = "--no-defaults --skip-networking --socket=%s/mysql.sock --datadir=%s --basedir=%s/mysql4grid --pid-file=%s/mysql.pid --log-error=%s --log=%s" % (self.MokkaTMPDir, 
-                                                                                                                                                                     self.MokkaDataDir, 
-                                                                                                                                                                     self.softDir,
-                                                                                                                                                                     self.MokkaTMPDir,
-                                                                                                                                                                     self.stdError,
-                                                                                                                                                                     self.applicationLog)
-    comm = "mysql_install_db %s" % (safe_options) 
+    self.safeOptions = "--no-defaults --skip-networking --socket=%s/mysql.sock --datadir=%s --basedir=%s/mysql4grid --pid-file=%s/mysql.pid --log-error=%s --log=%s" % (self.MokkaTMPDir, 
+                                                                                                                                                                          self.MokkaDataDir, 
+                                                                                                                                                                          self.softDir,
+                                                                                                                                                                          self.MokkaTMPDir,
+                                                                                                                                                                          self.stdError,
+                                                                                                                                                                          self.applicationLog)
+    snapshotName = self.getSnapshotName()
+    for snapshotDir in self.snapshotDirs:
+      snapshot = os.path.join(snapshotDir, snapshotName)
+      if not os.path.exists(snapshot):
+        continue
+      res = self.restoreSnapshot(snapshot)
+      if not res['OK']:
+        self.log.warn("Could not use the DB snapshot %s, setting up the DB from the dump:" % snapshot, res['Message'])
+        break
+      res = self.startServer()
+      os.chdir(self.initialDir)
+      if not res['OK']:
+        return res
+      return S_OK('OK')
+
+    res = self.installDB()
+    if not res['OK']:
+      os.chdir(self.initialDir)
+      return res
+    res = self.makeSnapshot(snapshotName)
+    os.chdir(self.initialDir)
+    if not res['OK']:
+      return res
+    return S_OK('OK')
+
+  def getSnapshotName(self):
+    """ The name of the snapshot of the DB: the Mokka version and the checksum of the dump file
+    """
+    checksum = md5()
+    dumpfile = open(self.MokkaDumpFile, 'rb')
+    try:
+      while True:
+        data = dumpfile.read(1048576)
+        if not data:
+          break
+        checksum.update(data)
+    finally:
+      dumpfile.close()
+    return "MokkaDB_%s_%s.tar.gz" % (self.mokkaVersion, checksum.hexdigest())
+
+  def restoreSnapshot(self, snapshot):
+    """ Unpack the snapshot as data directory
+    """
+    self.log.info("Using the DB snapshot", snapshot)
+    try:
+      tar = tarfile.open(snapshot, 'r:gz')
+      try:
+        tar.extractall(self.mokkaDBroot)
+      finally:
+        tar.close()
+    except (IOError, OSError, tarfile.TarError), x:
+      ##Leave an empty data dir for the setup from the dump
+      shutil.rmtree(self.MokkaDataDir, True)
+      os.mkdir(self.MokkaDataDir)
+      return S_ERROR(str(x))
+    return S_OK()
+
+  def makeSnapshot(self, snapshotName):
+    """ Store the data directory as snapshot, in the first area where it's possible.
+    The server is stopped meanwhile so that the data is consistent. Not being able to store the
+    snapshot is not an error, only the next jobs will set up the DB from the dump too.
+    """
+    res = self.stopServer()
+    if not res['OK']:
+      self.log.warn("Could not stop the server to store the DB snapshot:", res['Message'])
+      return S_OK()
+    errors = []
+    for snapshotDir in self.snapshotDirs:
+      tmpsnapshot = os.path.join(snapshotDir, "%s.%s" % (snapshotName, os.path.basename(self.mokkaDBroot)))
+      try:
+        if not os.path.isdir(snapshotDir):
+          os.makedirs(snapshotDir)
+        tar = tarfile.open(tmpsnapshot, 'w:gz')
+        try:
+          tar.add(self.MokkaDataDir, 'data')
+        finally:
+          tar.close()
+        ##Another job may do the same at the same time, whichever comes last is used
+        os.rename(tmpsnapshot, os.path.join(snapshotDir, snapshotName))
+        self.log.info("Stored the DB snapshot in", snapshotDir)
+        break
+      except (IOError, OSError, tarfile.TarError), x:
+        errors.append("%s: %s" % (snapshotDir, str(x)))
+        if os.path.exists(tmpsnapshot):
+          os.remove(tmpsnapshot)
+    if len(errors) == len(self.snapshotDirs):
+      self.log.warn("Could not store the DB snapshot:", ", ".join(errors))
+    return self.startServer()
+
+  def installDB(self):
+    """ Create the DB from the dump file
+    """
+    comm = "mysql_install_db %s" % (self.safeOptions) 
     self.log.verbose("Running %s" % comm)
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
         
@@ -175,36 +287,10 @@ class SQLWrapper:
       self.log.error( self.stdError )
       self.log.error('SQLwrapper Exited With Status %s' % (status))
  
-    ###Now run mysqld in thread
-    os.chdir("%s/mysql4grid" % (self.softDir))
-    
-    
-    self.log.verbose("Running mysqld_safe %s" % safe_options)
+    res = self.startServer()
+    if not res['OK']:
+      return res
 
-    spObject = Subprocess( timeout = False, bufferLimit = int( self.bufferLimit ) )
-    command = '%s/mysql4grid/bin/mysqld_safe %s' % (self.softDir, safe_options)
-    self.log.verbose( 'Execution command: %s' % ( command ) )
-        
-    exeThread = ExecutionThread( spObject, command, self.maxPeekLines, self.applicationLog, self.stdError, self.exeEnv )
-    exeThread.start()
-    time.sleep( 5 )
-    self.mysqldPID = spObject.getChildPID()
-       
-    #if not self.mysqldPID:
-        #return S_ERROR( 'MySQLd process could not start after 5 seconds' )
-    
-    self.log.verbose("MySQLd run with pid: %s" % self.mysqldPID)
-
-
-    ####Have to sleep for a while to let time for the socket to wake up
-    sleepComm = """
-while [ -z "$socket_grep" ] ; do
-    socket_grep=$(netstat -ln 2>/dev/null | grep "%s/mysql.sock")
-    echo -n .
-    sleep 1
-done 
-""" % (self.MokkaTMPDir)
-    self.result = shellCall(0, sleepComm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
     ###changing root pass
     mysqladmincomm = "mysqladmin --no-defaults -hlocalhost --socket=%s/mysql.sock -uroot password '%s'" % (self.MokkaTMPDir,
                                                                                                            self.rootpass)
@@ -250,13 +336,62 @@ done
       self.log.error( "==================================\n StdError:\n" )
       self.log.error( self.stdError )
       self.log.error('MySQL setup Exited With Status %s' % (status))
-      os.chdir(self.initialDir)
       return S_ERROR('MySQL setup Exited With Status %s' % (status))
-    # Still have to set the application status e.g. user job case.
-    #self.setApplicationStatus('mysql client %s Successful' %(self.applicationVersion))
-    os.chdir(self.initialDir)
-    #return S_OK('Mokka-wrapper %s Successful' %(self.applicationVersion))
-    return S_OK('OK')
+    return S_OK()
+
+  def startServer(self):
+    """ Run mysqld in a thread, and wait until it accepts connections
+    """
+    os.chdir("%s/mysql4grid" % (self.softDir))
+    
+    self.log.verbose("Running mysqld_safe %s" % self.safeOptions)
+
+    spObject = Subprocess( timeout = False, bufferLimit = int( self.bufferLimit ) )
+    command = '%s/mysql4grid/bin/mysqld_safe %s' % (self.softDir, self.safeOptions)
+    self.log.verbose( 'Execution command: %s' % ( command ) )
+        
+    exeThread = ExecutionThread( spObject, command, self.maxPeekLines, self.applicationLog, self.stdError, self.exeEnv )
+    exeThread.start()
+    if not self.waitForSocket(True):
+      return S_ERROR('MySQLd is not accepting connections after %s seconds' % self.socketTimeout)
+    self.mysqldPID = spObject.getChildPID()
+    self.log.verbose("MySQLd run with pid: %s" % self.mysqldPID)
+    return S_OK()
+
+  def stopServer(self):
+    """ Shut mysqld down, and wait until it's gone
+    """
+    MySQLcleanUpComm = "mysqladmin --no-defaults -hlocalhost --socket=%s/mysql.sock -uroot -p%s shutdown" % (self.MokkaTMPDir, self.rootpass)
+    self.result = shellCall(0, MySQLcleanUpComm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    if not self.result['OK']:
+      return self.result
+    status = self.result['Value'][0]
+    self.log.info( "Status after the shutdown execution is %s" % str( status ) )
+    if status != 0:
+      return S_ERROR('MySQL shutdown Exited With Status %s' % (status))
+    if not self.waitForSocket(False):
+      return S_ERROR('MySQLd is still accepting connections after %s seconds' % self.socketTimeout)
+    return S_OK()
+
+  def waitForSocket(self, up):
+    """ Wait until connecting to the server socket succeeds (up) or fails (not up), at most socketTimeout seconds.
+    """
+    socketPath = os.path.join(self.MokkaTMPDir, "mysql.sock")
+    start = time.time()
+    while time.time() - start < self.socketTimeout:
+      probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+        try:
+          probe.connect(socketPath)
+          accepting = True
+        except socket.error:
+          accepting = False
+      finally:
+        probe.close()
+      if accepting == up:
+        return True
+      time.sleep(0.2)
+    return False
     
     #############################################################################
   def mysqlCleanUp(self):
@@ -267,38 +402,13 @@ done
     currentdir = os.getcwd()
     os.chdir(os.path.join(self.softDir, "mysql4grid"))
     self.log.verbose('clean up db')
-    MySQLcleanUpComm = "mysqladmin --no-defaults -hlocalhost --socket=%s/mysql.sock -uroot -p%s shutdown" % (self.MokkaTMPDir, self.rootpass)
-            
-    self.result = shellCall(0, MySQLcleanUpComm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
-    
-    resultTuple = self.result['Value']
-
-    status = resultTuple[0]
-    self.log.info( "Status after the shutdown execution is %s" % str( status ) )
-    ##kill mysql
-    #mysqlkillcomm = "cat mysql.pid | kill -9 "#%(self.MokkaTMPDir)
-    #mysqlkillcomm = "kill -9 %s"%(self.mysqldPID)
-    #self.result = shellCall(0,mysqlkillcomm,callbackFunction=self.redirectLogOutput,bufferLimit=20971520)
-    
-    #resultTuple = self.result['Value']
-
-    ####Have to sleep for a while to let time for the socket to go away
-    sleepComm = """
-while [ -n "$socket_grep" ] ; do
-    socket_grep=$(netstat -ln 2>/dev/null | grep "%s/mysql.sock")
-    echo -n .
-    sleep 1
-done 
-""" % (self.MokkaTMPDir)
-    self.result = shellCall(0, sleepComm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    res = self.stopServer()
 
     os.chdir(currentdir)
 
-    status = resultTuple[0]
-    #self.log.info( "Status after the application execution is %s" % str( status ) )    
     failed = False
-    if status != 0:
-      self.log.error( "MySQL-cleanup execution completed with errors:" )
+    if not res['OK']:
+      self.log.error( "MySQL-cleanup execution completed with errors:", res['Message'] )
       failed = True
     else:
       self.log.info( "MySQL-cleanup execution completed successfully")
@@ -317,8 +427,8 @@ done
     if failed:
       self.log.error( "==================================\n StdError:\n" )
       self.log.error( self.stdError )
-      self.log.error('MySQL-cleanup Exited With Status %s' % (status))
-      return S_ERROR('MySQL-cleanup Exited With Status %s' % (status))
+      self.log.error('MySQL-cleanup failed: %s' % (res['Message']))
+      return S_ERROR('MySQL-cleanup failed: %s' % (res['Message']))
 
     return S_OK('OK')
     #############################################################################
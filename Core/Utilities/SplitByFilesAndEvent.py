@@ -1,66 +1,65 @@
 # $HeadURL$
 # $Id$
 '''
-Try some fancy splitting, DO NOT USE
+Splitting by number of events
 
-Based on Dirac.SplitByFiles idea, but doing the splitting by number of events
-Gives a list of dictionaries
+Based on Dirac.SplitByFiles idea, but doing the splitting by number of events:
+the files are walked once, keeping the offset in the current file, so the cost is
+linear in the number of files and of jobs. Gives a list of dictionaries.
 
 Created on Feb 10, 2010
 
 @author: sposs
 '''
 
-from ILCDIRAC.Core.Utilities.InputFilesUtilities import getNumberOfevents
+from ILCDIRAC.Core.Utilities.InputFilesUtilities import getNumberOfEventsPerFile
 from DIRAC import S_OK, S_ERROR
 
-def SplitByFilesAndEvents(listoffiles, evtsperjob):
-  """ Group the input files 
+def splitFilesByEvents(filesandevents, evtsperjob, maxfilesperjob = 0):
+  """ Group the (lfn, nbevts) items of filesandevents in jobs of evtsperjob events.
+  Each job is a dictionary with the 'files' to use, the event to 'startFrom' in the first file,
+  and the 'nbevts' to process. When maxfilesperjob is set, a job never uses more files than that,
+  so it can have less than evtsperjob events. The last job gets what remains.
   """
-  mylist = [] 
-  total_evts = 0
-  for files in listoffiles:
-    myfdict = {}
-    info =  getNumberOfevents([files])
-    if not "nbevts" in info:
-      return S_ERROR("The file %s does not have attached number of events, cannot split" % files)
-    myfdict['file'] = files
-    myfdict['nbevts'] = info['nbevts']
-    mylist.append(myfdict) 
-    total_evts += info['nbevts']
-
-  #nb_jobs = total_evts/evtsperjob
+  if evtsperjob < 1:
+    return S_ERROR("Number of events per job must be positive")
   joblist = []
-  jdict = {}
-  startfromevt = 0
-  cur_events = 0
-  for event in range(total_evts):
-    cur_events +=1
-    if not len(mylist):
-      break
-    item = mylist[0]
-    nb_evts_in_file = item['nbevts']
-
-    if cur_events == evtsperjob :
-      jdict['startFrom'] = startfromevt
-      if not 'files' in jdict:
-        jdict['files'] = []
-      jdict['files'].append(item['file'])
-      startfromevt = int(cur_events)
-      cur_events = 0
-      mylist.remove(item)
-      joblist.append(jdict)
-      continue
-    if cur_events > nb_evts_in_file:
-      if not 'files' in jdict:
-        jdict['files'] = []
-      jdict['files'].append(item['file'])
-      mylist.remove(item)
-      continue
-    #joblist.append(jdict)
-    #print "final jdict", jdict
+  job = None
+  for lfn, nbevts in filesandevents:
+    nbevts = int(nbevts)
+    if nbevts < 0:
+      return S_ERROR("The file %s has a negative number of events" % lfn)
+    pos = 0
+    while pos < nbevts:
+      if job and maxfilesperjob and len(job['files']) == maxfilesperjob and job['files'][-1] != lfn:
+        joblist.append(job)
+        job = None
+      if not job:
+        job = {'files' : [], 'startFrom' : pos, 'nbevts' : 0}
+      if not len(job['files']) or job['files'][-1] != lfn:
+        job['files'].append(lfn)
+      used = min(nbevts - pos, evtsperjob - job['nbevts'])
+      job['nbevts'] += used
+      pos += used
+      if job['nbevts'] == evtsperjob:
+        joblist.append(job)
+        job = None
+  if job:
+    joblist.append(job)
   return S_OK(joblist)
 
+def SplitByFilesAndEvents(listoffiles, evtsperjob, maxfilesperjob = 0):
+  """ Group the input files: get the number of events of the files from the catalog, 
+  then call L{splitFilesByEvents}
+  """
+  nbevts = getNumberOfEventsPerFile(listoffiles)
+  filesandevents = []
+  for lfn in listoffiles:
+    if not nbevts.has_key(lfn):
+      return S_ERROR("The file %s does not have attached number of events, cannot split" % lfn)
+    filesandevents.append((lfn, nbevts[lfn]))
+  return splitFilesByEvents(filesandevents, evtsperjob, maxfilesperjob)
+
 if __name__=="__main__":
   from DIRAC.Core.Base import Script
   Script.parseCommandLine()
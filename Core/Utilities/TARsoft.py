@@ -1,81 +1,22 @@
 '''
 Function to download and untar the applications, called from CombinedSoftwareInstallation
 
-Also installs all dependencies for the applications
+Also installs all dependencies for the applications: those that do not depend on each other
+are downloaded and unpacked at the same time.
 
 @since:  Apr 7, 2010
 
 @author: Stephane Poss
 '''
 from DIRAC import gLogger, S_OK, S_ERROR
-from ILCDIRAC.Core.Utilities.ResolveDependencies            import resolveDeps
+from ILCDIRAC.Core.Utilities.ResolveDependencies            import getDependencyGraph
 from ILCDIRAC.Core.Utilities.PrepareLibs                    import removeLibc
+from ILCDIRAC.Core.Utilities.Checksums                      import md5File, verifyChecksums, MD5Reader
 from DIRAC.DataManagementSystem.Client.ReplicaManager       import ReplicaManager
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations    import Operations
-from ILCDIRAC.Core.Utilities.WasteCPU                       import WasteCPUCycles
-import os, urllib, tarfile, subprocess, shutil, time
+from ILCDIRAC.Core.Utilities.InstallLock                    import InstallLock
+import os, urllib, tarfile, subprocess, shutil, threading, Queue, tempfile
 from tarfile import TarError
-try:
-  import hashlib as md5
-except:
-  import md5
-
-def createLock(lockname):
-  """ Need to lock the area to prevent 2 jobs to write in the same area
-  """
-  try:
-    lock = file(lockname,"w")
-    lock.write("Locking this directory\n")
-    lock.close()
-  except IOError as e:
-    gLogger.error("Failed creating lock")
-    return S_ERROR("Not allowed to write here: IOError %s" % (str(e)))
-  return S_OK()
-
-def checkLockAge(lockname):
-  """ Check if there is a lock, and in that case deal with it, potentially remove it after n minutes
-  """
-  overwrite = False
-  count = 0
-  while (1):
-    if not os.path.exists(lockname):
-      break
-    count += 1
-    gLogger.warn("Will wait one minute before proceeding")
-    res = WasteCPUCycles(60)
-    if not res['OK']:
-      continue
-    last_touch = time.time()
-    try:
-      stat = os.stat(lockname)
-      last_touch = stat.st_atime
-    except Exception, x:
-      gLogger.warn("File not available: %s %s, assume removed" % (Exception, str(x))) 
-      break
-    loc_time = time.time()
-    if loc_time-last_touch > 30*60: ##this is where I say the file is too old to still be valid (30 minutes)
-      gLogger.info("File is %s seconds old" % loc_time-last_touch)
-      overwrite = True
-      res = clearLock(lockname)
-      if res['OK']:
-        break
-    if count > 60: #We have been waiting for 60 minutes, something is wrong, kill it
-      gLogger.error("Seems file stat is wrong, assume buggy, will fail installation")
-      #overwrite = True
-      res = clearLock(lockname)
-      return S_ERROR("Buggy lock, removed: %s" % res['OK'])
-      
-  return S_OK(overwrite)
-  
-def clearLock(lockname):
-  """ And we need to clear the lock once the operation is done
-  """
-  try:
-    os.unlink(lockname)
-  except OSError as e:
-    gLogger.error("Failed cleaning lock: OSError", "%s" % (str(e)))
-    return S_ERROR("Failed to clear lock: %s" % (str(e)) )
-  return S_OK()
 
 def deleteOld(folder_name):
   """ Remove directories
@@ -96,8 +37,23 @@ def deleteOld(folder_name):
     gLogger.error("Oh Oh, something was not right, the directory %s is still here" % folder_name) 
   return S_OK()
 
-def downloadFile(TarBallURL, app_tar, folder_name):
-  """ Get the file locally.
+def mergeTree(source, destination):
+  """ Move the content of the source directory in the destination one, file by file: what is in 
+  destination and not in source is kept, what is in both is replaced.
+  """
+  for dirpath, dirnames, filenames in os.walk(source):
+    target = os.path.normpath(os.path.join(destination, os.path.relpath(dirpath, source)))
+    if not os.path.isdir(target):
+      os.makedirs(target)
+    ##Links to directories are not walked into, they are moved like files
+    links = [name for name in dirnames if os.path.islink(os.path.join(dirpath, name))]
+    for name in links:
+      dirnames.remove(name)
+    for name in filenames + links:
+      os.rename(os.path.join(dirpath, name), os.path.join(target, name))
+
+def downloadFile(TarBallURL, app_tar, folder_name, destination = '.'):
+  """ Get the file locally, in the destination directory.
   """
   #need to make sure the url ends with /, other wise concatenation below returns bad url
   if TarBallURL[-1] != "/":
@@ -109,13 +65,13 @@ def downloadFile(TarBallURL, app_tar, folder_name):
       gLogger.debug("Downloading software", '%s' % (folder_name))
       #Copy the file locally, don't try to read from remote, soooo slow
       #Use string conversion %s%s to set the address, makes the system more stable
-      urllib.urlretrieve("%s%s" % (TarBallURL, app_tar), app_tar_base)
+      urllib.urlretrieve("%s%s" % (TarBallURL, app_tar), os.path.join(destination, app_tar_base))
     except:
       gLogger.exception()
       return S_ERROR('Exception during url retrieve')
   else:
     rm = ReplicaManager()
-    resget = rm.getFile("%s%s" % (TarBallURL, app_tar))
+    resget = rm.getFile("%s%s" % (TarBallURL, app_tar), destinationDir = destination)
     if not resget['OK']:
       gLogger.error("File could not be downloaded from the grid")
       return resget
@@ -127,7 +83,7 @@ def tarMd5Check(app_tar_base, md5sum ):
   ##Tar ball is obtained, need to check its md5 sum
   tar_ball_md5 = ''
   try:
-    tar_ball_md5 = md5.md5(file(app_tar_base).read()).hexdigest()
+    tar_ball_md5 = md5File(app_tar_base)
   except:
     gLogger.error("Failed to get tar ball md5, try without")
     md5sum = ''
@@ -142,88 +98,141 @@ def TARinstall(app, config, area):
   curdir = os.getcwd()
   appName    = app[0].lower()
   appVersion = app[1]
-  deps = resolveDeps(config, appName, appVersion)
-  
-  for dep in deps:
-    depapp = []
-    depapp.append(dep["app"])
-    depapp.append(dep["version"])
-    gLogger.info("Installing dependency %s %s" % (dep["app"], dep["version"]))
-    
-    res = getTarBallLocation(depapp, config, area)
-    if not res['OK']:
-      gLogger.error("Could not install dependency %s %s: %s" % (dep["app"], dep["version"], res['Message']))
-      return S_ERROR('Failed to install software')
-    res_from_getTarBall = res['Value']
-    app_tar = res_from_getTarBall[0]
-    TarBallURL = res_from_getTarBall[1]
-    overwrite = res_from_getTarBall[2]
-    md5sum = res_from_getTarBall[3]
-    
-    res = install(depapp, app_tar, TarBallURL, overwrite, md5sum, area)
-    os.chdir(curdir)
-    if not res['OK']:
-      gLogger.error("Could not install dependency %s %s: %s" % (dep["app"], dep["version"], res['Message']))
-      return S_ERROR('Failed to install software')
-    res_from_install = res['Value']
-    
-    res = check(depapp, area, res_from_install)
-    os.chdir(curdir)
-    if not res['OK']:
-      gLogger.error("Failed to check dependency %s %s" % (dep["app"], dep["version"]))
-      return S_ERROR('Failed to check integrity of software')
-    res_from_check = res['Value']
-    
-    res = configure(depapp, area, res_from_check)
+  graph = getDependencyGraph(config, appName, appVersion)
+  res = getInstallOrder(graph, (appName, appVersion))
+  if not res['OK']:
+    gLogger.error("Could not install software %s %s: %s" % (appName, appVersion, res['Message']))
+    return S_ERROR('Failed to install software')
+  order = res['Value']
+
+  res = installGraph(graph, config, area)
+  os.chdir(curdir)
+  if not res['OK']:
+    return res
+  installed = res['Value']
+
+  ##The environment is shared, so the configuration is done one after the other, dependencies first
+  for node in order:
+    res = configure(list(node), area, installed[node])
     os.chdir(curdir)
     if not res['OK']:
-      gLogger.error("Failed to configure dependency %s %s" % (dep["app"], dep["version"]))
+      gLogger.error("Failed to configure software %s %s" % node)
       return S_ERROR('Failed to configure software')
-    
-    res = clean(area, res_from_install)
-    if not res['OK']:
-      gLogger.error("Failed to clean useless tar balls, deal with it: %s %s" % (dep["app"], dep["version"]))
-      
-    os.chdir(curdir)
-    gLogger.notice("Successfully installed %s %s in %s" % (dep["app"], dep["version"], area))
-    
+    gLogger.notice("Successfully installed %s %s in %s" % (node[0], node[1], area))
+  return S_OK()
+
+def getInstallOrder(graph, root):
+  """ Order the applications of the dependency graph (see L{getDependencyGraph}) so that each one comes after 
+  its dependencies, the root last. Fails if the dependencies are circular.
+  """
+  order = []
+  visiting = set()
+  def visit(node):
+    if node in order:
+      return S_OK()
+    if node in visiting:
+      return S_ERROR("Circular dependency on %s %s" % node)
+    visiting.add(node)
+    for dep in graph[node]:
+      res = visit(dep)
+      if not res['OK']:
+        return res
+    visiting.remove(node)
+    order.append(node)
+    return S_OK()
+  res = visit(root)
+  if not res['OK']:
+    return res
+  return S_OK(order)
+
+def installGraph(graph, config, area):
+  """ Install all the applications of the dependency graph with a pool of threads, whose size is given by 
+  Software/MaxInstallThreads. An application is installed once all its dependencies are. 
+  Returns S_OK with the result of L{check} per application. The graph must not have cycles.
+  """
+  nbthreads = max(1, min(Operations().getValue("Software/MaxInstallThreads", 4), len(graph)))
+  pending = {}
+  dependents = {}
+  ready = Queue.Queue()
+  for node, deps in graph.items():
+    pending[node] = len(set(deps))
+    for dep in set(deps):
+      dependents.setdefault(dep, []).append(node)
+    if not pending[node]:
+      ready.put(node)
+  state = {'Installed' : {}, 'Failed' : None}
+  lock = threading.Lock()
+
+  def worker():
+    """ Install the applications whose dependencies are there, until all are done or one failed
+    """
+    while True:
+      node = ready.get()
+      if node is None:
+        return
+      if state['Failed']:
+        continue
+      gLogger.info("Installing %s %s" % node)
+      try:
+        res = installApplication(list(node), config, area)
+      except Exception, x:
+        ##The other workers must be stopped too, or they would wait forever
+        gLogger.exception("Exception while installing %s %s" % node)
+        res = S_ERROR("Failed to install %s %s: %s" % (node[0], node[1], str(x)))
+      lock.acquire()
+      try:
+        if not res['OK']:
+          state['Failed'] = res
+        else:
+          state['Installed'][node] = res['Value']
+          for dependent in dependents.get(node, []):
+            pending[dependent] -= 1
+            if not pending[dependent]:
+              ready.put(dependent)
+        if state['Failed'] or len(state['Installed']) == len(graph):
+          for dummy in range(nbthreads):
+            ready.put(None)
+      finally:
+        lock.release()
+
+  threads = []
+  for dummy in range(nbthreads):
+    thread = threading.Thread(target = worker)
+    thread.setDaemon(True)
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  if state['Failed']:
+    return state['Failed']
+  return S_OK(state['Installed'])
+
+def installApplication(app, config, area):
+  """ Get, unpack and check one application. Does not change the current directory nor the environment,
+  so that several can be installed at the same time.
+  """
   res = getTarBallLocation(app, config, area)
   if not res['OK']:
-    gLogger.error("Could not install dependency %s %s: %s" % (appName, appVersion, res['Message']))
+    gLogger.error("Could not install %s %s: %s" % (app[0], app[1], res['Message']))
     return S_ERROR('Failed to install software')
-  res_from_getTarBall = res['Value']
-  app_tar = res_from_getTarBall[0]
-  TarBallURL = res_from_getTarBall[1]
-  overwrite = res_from_getTarBall[2]
-  md5sum = res_from_getTarBall[3]
+  app_tar, TarBallURL, overwrite, md5sum = res['Value']
 
   res = install(app, app_tar, TarBallURL, overwrite, md5sum, area)
-  os.chdir(curdir)
   if not res['OK']:
-    gLogger.error("Could not install software %s %s: %s" % (appName, appVersion, res['Message']))
+    gLogger.error("Could not install %s %s: %s" % (app[0], app[1], res['Message']))
     return S_ERROR('Failed to install software')
   res_from_install = res['Value']
   
   res = check(app, area, res_from_install)
-  os.chdir(curdir)
   if not res['OK']:
-    gLogger.error("Failed to check software %s %s" % (appName, appVersion))
+    gLogger.error("Failed to check %s %s" % (app[0], app[1]))
     return S_ERROR('Failed to check integrity of software')
   res_from_check = res['Value']
-    
-  res = configure(app, area, res_from_check)
-  os.chdir(curdir)
-  if not res['OK']:
-    gLogger.error("Failed to configure software %s %s" % (appName, appVersion))
-    return S_ERROR('Failed to configure software')
-  
+
   res = clean(area, res_from_install)
-  os.chdir(curdir)
   if not res['OK']:
-    gLogger.error("Failed to clean useless tar balls, deal with it")
-    return S_OK()
-  gLogger.notice("Successfully installed %s %s in %s" % (appName, appVersion, area))
-  return res
+    gLogger.error("Failed to clean useless tar balls, deal with it: %s %s" % (app[0], app[1]))
+  return S_OK(res_from_check)
 
 def getTarBallLocation(app, config, area):
   """ Get the tar ball location. 
@@ -247,8 +256,104 @@ def getTarBallLocation(app, config, area):
 
   return S_OK([app_tar, TarBallURL, overwrite, md5sum])
 
+def getAndExtract(TarBallURL, app_tar, folder_name, md5sum, area):
+  """ Get the tar ball and unpack it in the area, checking its md5 sum on the way. Tar balls from http 
+  are unpacked while they are downloaded, without being written to disk. The content is first unpacked in a 
+  staging directory, only moved in the area if the whole tar ball could be read and has the right sum.
+  Other files (the LCSIM jar) are only downloaded and checked.
+  """
+  app_tar_base = os.path.basename(app_tar)
+  app_tar_path = os.path.join(area, app_tar_base)
+  if not app_tar_base.endswith((".tgz", ".tar.gz", ".tar")):
+    res = downloadFile(TarBallURL, app_tar, folder_name, area)
+    if not res['OK']:
+      return res
+    ## Check that the file is there. Should never happen as download file catches the errors
+    if not os.path.exists(app_tar_path):
+      gLogger.error('Failed to download software','%s' % (folder_name))
+      return S_ERROR('Failed to download software')
+    res = tarMd5Check(app_tar_path, md5sum)
+    if not res['OK']:
+      try:#Remove file that we just got
+        os.unlink(app_tar_path)
+      except OSError:
+        gLogger.error("Failed to clean tar ball, something bad is happening")
+      return S_ERROR("MD5 check failed")
+    return S_OK()
+
+  if TarBallURL[-1] != "/":
+    TarBallURL += "/"
+  try:
+    staging = tempfile.mkdtemp('', '.%s.' % os.path.basename(folder_name), area)
+  except OSError as e:
+    return S_ERROR("Not allowed to write here: OSError %s" % (str(e)))
+  stream = None
+  downloaded = False
+  success = False
+  try:
+    try:
+      if TarBallURL.find("http://")>-1:
+        gLogger.debug("Downloading and unpacking software", '%s' % (folder_name))
+        stream = urllib.urlopen("%s%s" % (TarBallURL, app_tar))
+      else:
+        ##No way to stream from the grid, the tar ball is at least only read once
+        res = downloadFile(TarBallURL, app_tar, folder_name, area)
+        if not res['OK']:
+          return res
+        downloaded = True
+        stream = open(app_tar_path, 'rb')
+      reader = MD5Reader(stream)
+      app_tar_to_untar = tarfile.open(fileobj = reader, mode = 'r|*')
+      app_tar_to_untar.extractall(staging)
+      app_tar_to_untar.close()
+      ##What is after the end of the archive is in the sum too
+      reader.readAll()
+    except (IOError, OSError, TarError) as e:
+      gLogger.error("Could not extract tar ball %s because of %s" % (app_tar_base, str(e)))
+      return S_ERROR("Could not extract tar ball %s because of %s" % (app_tar_base, str(e)))
+    if md5sum and md5sum != reader.hexdigest():
+      gLogger.error('Hash does not correspond, found %s, expected %s' % (reader.hexdigest(), md5sum))
+      return S_ERROR("MD5 check failed")
+
+    ## The tar ball is fine, its content can be put in place
+    content = sorted(os.listdir(staging))
+    if folder_name.count("slic"):
+      ##The slic tar balls do not have the name of the folder: they must contain only one
+      if len(content) != 1 or not os.path.isdir(os.path.join(staging, content[0])):
+        gLogger.error("The slic tar ball %s should contain one directory, found:" % app_tar_base, 
+                      ", ".join(content))
+        return S_ERROR("Unexpected content of the tar ball %s" % app_tar_base)
+      targets = {content[0] : folder_name}
+    else:
+      targets = dict([(entry, entry) for entry in content])
+    for entry in content:
+      source = os.path.join(staging, entry)
+      target = os.path.join(area, targets[entry])
+      try:
+        if targets[entry] == folder_name:
+          ##Only the folder of the application is replaced, it's the one covered by the lock
+          if os.path.lexists(target):
+            deleteOld(target)
+          os.rename(source, target)
+        elif os.path.isdir(source) and not os.path.islink(source) and os.path.isdir(target):
+          ##Shared with other applications: add the files, like extracting in the area would
+          mergeTree(source, target)
+        else:
+          os.rename(source, target)
+      except OSError as e:
+        gLogger.error("Failed moving %s in place:" % entry, str(e))
+        return S_ERROR("Could not move %s in place" % entry)
+    success = True
+  finally:
+    if stream:
+      stream.close()
+    shutil.rmtree(staging, True)
+    if downloaded and not success and os.path.exists(app_tar_path):
+      os.unlink(app_tar_path)
+  return S_OK()
+
 def install(app, app_tar, TarBallURL, overwrite, md5sum, area):
-  """ Install the software
+  """ Install the software in the area. Does not change the current directory.
   """
   appName    = app[0]
   appVersion = app[1]
@@ -261,159 +366,100 @@ def install(app, app_tar, TarBallURL, overwrite, md5sum, area):
   app_tar_base = os.path.basename(app_tar)
 
   ###########################################
-  ###Go where the software is to be installed
-  os.chdir(area)
-  #We go back to the initial place at any return
+  ###Everything happens where the software is to be installed
+  folder_path = os.path.join(area, folder_name)
   ###########################################
   ##Handle the locking
-  lockname = folder_name+".lock"
-  #Make sure the lock is not too old, or wait until it's gone
-  res = checkLockAge(lockname)
-  if not res['OK']:
-    gLogger.error("Something uncool happened with the lock, will kill installation")
-    gLogger.error("Message: %s" % res['Message'])
-    return S_ERROR("Failed lock checks")
-  if res.has_key('Value'):
-    if res['Value']: #this means the lock file was very old, meaning that the installation failed elsewhere
-      overwrite = True
-
-  #Check if the application is here and not to be overwritten
-  if os.path.exists(folder_name):
-    appli_exists = True
-    if not overwrite:
-      gLogger.info("Folder or file %s found in %s, skipping install !" % (folder_name, area))
-      return S_OK([folder_name, app_tar_base])
-  
-  ## If we are here, it means the application was never installed OR its overwrite flag is true
-    
-  #Now lock the area
-  res = createLock(lockname)##This will fail if not allowed to write here
+  lockname = folder_path+".lock"
+  ##Nothing to wait for if the application is here and nobody is installing it, works where writing is not allowed
+  if os.path.exists(folder_path) and not overwrite and not os.path.exists(lockname):
+    gLogger.info("Folder or file %s found in %s, skipping install !" % (folder_name, area))
+    return S_OK([folder_name, app_tar_base])
+
+  #Now lock the application, waiting if another job is installing it
+  lock = InstallLock(lockname)
+  res = lock.acquire()##This will fail if not allowed to write here
   if not res['OK']:
     gLogger.error(res['Message'])
     return res
+  if res['Value']: #this means the installation failed elsewhere
+    overwrite = True
+  try:
+    #Check if the application is here (maybe installed by the job we waited for) and not to be overwritten
+    if os.path.exists(folder_path):
+      appli_exists = True
+      if not overwrite:
+        gLogger.info("Folder or file %s found in %s, skipping install !" % (folder_name, area))
+        return S_OK([folder_name, app_tar_base])
   
-  ## Cleanup old version in case it has to be overwritten (implies it's already here)
-  ## In particular the jar file of LCSIM
-  if appli_exists and overwrite:
-    gLogger.info("Overwriting %s found in %s" % (folder_name, area))
-    res = deleteOld(folder_name) 
-    if not res['OK']:#should be always OK for the time being
-      clearLock(lockname)
-      return res
-    ## Now application must have been removed
+    ## If we are here, it means the application was never installed OR its overwrite flag is true
+    
+    ## Cleanup old version in case it has to be overwritten (implies it's already here)
+    ## In particular the jar file of LCSIM
+    if appli_exists and overwrite:
+      gLogger.info("Overwriting %s found in %s" % (folder_name, area))
+      res = deleteOld(folder_path) 
+      if not res['OK']:#should be always OK for the time being
+        return res
+      ## Now application must have been removed
   
-  ## If here, the application DOES NOT exist locally: either it was here and the overwrite flag was false and 
-  ## we returned earlier, either it was here and the overwrite flag was true and it was removed, or finally it
-  ## was never here so here appli_exists=False always
+    ## If here, the application DOES NOT exist locally: either it was here and the overwrite flag was false and 
+    ## we returned earlier, either it was here and the overwrite flag was true and it was removed, or finally it
+    ## was never here so here appli_exists=False always
 
-  ## Now we can get the files and unpack them
+    ## Now we can get the files and unpack them
     
-  ## Downloading file from url
-  res = downloadFile(TarBallURL, app_tar, folder_name)
-  if not res['OK']:
-    clearLock(lockname)
-    return res
-  
-  ## Check that the tar ball is there. Should never happen as download file catches the errors
-  if not os.path.exists("%s/%s" % (os.getcwd(), app_tar_base)):
-    gLogger.error('Failed to download software','%s' % (folder_name))
-    clearLock(lockname)
-    return S_ERROR('Failed to download software')
-
-  ## Check that the downloaded file (or existing one) has the right checksum
-  res = tarMd5Check(app_tar_base, md5sum)
-  if not res['OK']:
-    gLogger.error("Will try getting the file again, who knows")
-    try:#Remove tar ball that we just got
-      os.unlink("%s/%s" % (os.getcwd(), app_tar_base))
-    except OSError:
-      gLogger.error("Failed to clean tar ball, something bad is happening")
-    ## Clean up existing stuff (if any, in particular the jar file)
-    res = deleteOld(folder_name)
-    if not res['OK']:#should be always OK for the time being
-      clearLock(lockname)
-      return res
-    res = downloadFile(TarBallURL, app_tar, folder_name)
-    if not res['OK']:
-      clearLock(lockname)
-      return res
-    res = tarMd5Check(app_tar_base, md5sum)
+    ## Downloading file from url, and unpacking it at the same time when possible
+    res = getAndExtract(TarBallURL, app_tar, folder_name, md5sum, area)
     if not res['OK']:
-      gLogger.error("Hash failed again, something is really wrong, cannot continue.")
-      clearLock(lockname)
-      return S_ERROR("MD5 check failed")
-  
+      gLogger.error("Will try getting the file again, who knows")
+      ## Clean up existing stuff (if any, in particular the jar file)
+      res = deleteOld(folder_path)
+      if not res['OK']:#should be always OK for the time being
+        return res
+      res = getAndExtract(TarBallURL, app_tar, folder_name, md5sum, area)
+      if not res['OK']:
+        gLogger.error("Failed again, something is really wrong, cannot continue.")
+        return res
 
-  if tarfile.is_tarfile(app_tar_base):##needed because LCSIM is jar file
-    app_tar_to_untar = tarfile.open(app_tar_base)
     try:
-      app_tar_to_untar.extractall()
-    except TarError as e:
-      gLogger.error("Could not extract tar ball %s because of %s, cannot continue !" % (app_tar_base, str(e)))
-      clearLock(lockname)
-      return S_ERROR("Could not extract tar ball %s because of %s, cannot continue !"%(app_tar_base, str(e)))
-    if folder_name.count("slic"):
-      slicname = folder_name
-      members = app_tar_to_untar.getmembers()
-      fileexample = members[0].name
-      basefolder = fileexample.split("/")[0]
-      try:
-        os.rename(basefolder, slicname)
-      except OSError as e:
-        gLogger.error("Failed renaming slic:", str(e))
-        clearLock(lockname)
-        return S_ERROR("Could not rename slic directory")
-  try:
-    dircontent = os.listdir(folder_name)
-    if not len(dircontent):
-      clearLock(lockname)
-      return S_ERROR("Folder %s is empty, considering install as failed" % folder_name)
-  except:
-    pass
-  
-  #Everything went fine, we try to clear the lock  
-  clearLock(lockname)
+      dircontent = os.listdir(folder_path)
+      if not len(dircontent):
+        return S_ERROR("Folder %s is empty, considering install as failed" % folder_name)
+    except:
+      pass
+  finally:
+    #Whatever happened, the next job can try
+    lock.release()
     
   return S_OK([folder_name, app_tar_base]) 
 
 def check(app, area, res_from_install):
-  """ Now that the tar ball is here, we need to check that all is there
+  """ Now that the tar ball is here, we need to check that all is there. Does not change the current directory.
   """
-  ###########################################
-  ###Go where the software is to be installed
-  os.chdir(area)
-  #We go back to the initial place either at the end of the installation or at any error
-  ###########################################
-  
-  basefolder = res_from_install[0]
+  basefolder = os.path.join(area, res_from_install[0])
   if os.path.isfile(basefolder):
     #This is the case of LCSIM that's a jar file
-    return S_OK([basefolder])
+    return S_OK([res_from_install[0]])
   
   if os.path.exists(os.path.join(basefolder,'md5_checksum.md5')):
+    expected = {}
     md5file = file(os.path.join(basefolder,'md5_checksum.md5'), 'r')
     for line in md5file:
       line = line.rstrip()
       md5sum, fin = line.split()
       if fin=='-' or fin.count("md5_checksum.md5"): continue
-      fin = os.path.join(basefolder, fin.replace("./",""))
-      if not os.path.exists(fin):
-        gLogger.error("File missing :", fin)
-        return S_ERROR("Incomplete install: The file %s is missing" % fin)
-      fmd5 = ''
-      try:
-        fmd5 = md5.md5(file(fin).read()).hexdigest()
-      except:
-        gLogger.error("Failed to compute md5 sum")
-        return S_ERROR("Failed to compute md5 sum")
-      if md5sum != fmd5:
-        gLogger.error("File has wrong checksum :", fin)
-        gLogger.error("Found %s, expected %s" % ( fmd5, md5sum ))
-        return S_ERROR("Corrupted install: File %s has a wrong sum" % fin)
+      expected[fin.replace("./","")] = md5sum
+    md5file.close()
+    ##Only the files that changed since the last check are read again
+    res = verifyChecksums(basefolder, expected, os.path.join(basefolder, '.md5_checksum.manifest'),
+                          Operations().getValue("Software/MaxChecksumThreads", 4))
+    if not res['OK']:
+      return res
   else:
     gLogger.warn("The application does not come with md5 checksum file:", app)
   
-  return S_OK([basefolder])
+  return S_OK([res_from_install[0]])
 
 def configure(app, area, res_from_check):
   """ Configure our applications: set the proper env variables
@@ -490,19 +536,14 @@ def configure(app, area, res_from_check):
   return S_OK()  
 
 def clean(area, res_from_install):
-  """ After install, clean the tar balls and go back to initial directory
+  """ After install, clean the tar balls. Does not change the current directory.
   """
-  ###########################################
-  ###Go where the software is to be installed
-  os.chdir(area)
-  #We go back to the initial place at the end
-  ###########################################
   app_tar_base = res_from_install[1]
   #remove now useless tar ball
-  if os.path.exists("%s/%s" % (os.getcwd(), app_tar_base)):
+  if os.path.exists(os.path.join(area, app_tar_base)):
     if app_tar_base.find(".jar") < 0:
       try:
-        os.unlink(app_tar_base)
+        os.unlink(os.path.join(area, app_tar_base))
       except OSError as e:
         gLogger.error("Could not remove tar ball:",str(e))
   return S_OK()
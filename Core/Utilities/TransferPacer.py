@@ -0,0 +1,91 @@
+'''
+Token bucket used to pace the access to the storage, e.g. when getting the overlay files.
+Replaces the CPU wasting of L{WasteCPU}: the job sleeps while the watchdog is told not to
+look at the CPU/wallclock ratio.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from DIRAC.ConfigurationSystem.Client.Helpers.Operations     import Operations
+from DIRAC                                                   import S_OK, S_ERROR, gLogger
+import os, time, threading
+
+WATCHDOG_FLAG = 'DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK'
+
+def disableWatchdogCPUCheck(workdir = ''):
+  """ Tell the watchdog that the job is waiting for I/O, so it should not check the CPU consumption.
+  The flag must be in the job directory (workdir), the current one by default.
+  """
+  flag = os.path.join(workdir or os.getcwd(), WATCHDOG_FLAG)
+  if not os.path.exists(flag):
+    f = file(flag, 'w')
+    f.write('Dont look at cpu')
+    f.close()
+
+def enableWatchdogCPUCheck(workdir = ''):
+  """ Resume the CPU consumption checks of the watchdog
+  """
+  flag = os.path.join(workdir or os.getcwd(), WATCHDOG_FLAG)
+  if os.path.exists(flag):
+    os.remove(flag)
+
+class TransferPacer(object):
+  """ Token bucket: a transfer consumes a token, tokens are given back at a given rate (per minute)
+  up to the burst size. When no token is available, sleep until there is one.
+  Can be shared between threads: the waiting ones are served one after the other.
+  The watchdog flag is put in workdir, the job directory.
+  """
+  def __init__(self, rate = 1., burst = 1, workdir = ''):
+    self.rate = float(rate)
+    self.burst = max(1., float(burst))
+    self.tokens = self.burst
+    self.last = time.time()
+    self.log = gLogger.getSubLogger("TransferPacer")
+    self.waited = 0.
+    self.lock = threading.Lock()
+    self.workdir = workdir
+
+  def _refill(self):
+    """ Put back the tokens accumulated since the last call
+    """
+    now = time.time()
+    self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate / 60.)
+    self.last = now
+
+  def wait(self, tokens = 1):
+    """ Block until the given number of tokens is available, and consume them.
+    A rate of 0 or less disables the pacing.
+    """
+    if self.rate <= 0:
+      return S_OK(0.)
+    if tokens > self.burst:
+      return S_ERROR("Cannot get %s tokens at once, burst is %s" % (tokens, self.burst))
+    self.lock.acquire()
+    try:
+      self._refill()
+      waited = 0.
+      if self.tokens < tokens:
+        waited = (tokens - self.tokens) * 60. / self.rate
+        self.log.verbose("Waiting %.1f seconds before next transfer" % waited)
+        disableWatchdogCPUCheck(self.workdir)
+        time.sleep(waited)
+        self._refill()
+      self.tokens -= tokens
+      self.waited += waited
+    finally:
+      self.lock.release()
+    return S_OK(waited)
+
+def getSitePacer(site, section = "/Overlay", workdir = ''):
+  """ Get the L{TransferPacer} configured for the site: TransferRate (transfers per minute)
+  and TransferBurst are taken from section/Sites/<site>, and default to the values in section.
+  """
+  ops = Operations()
+  rate = ops.getValue("%s/TransferRate" % section, 1.)
+  burst = ops.getValue("%s/TransferBurst" % section, 5)
+  rate = ops.getValue("%s/Sites/%s/TransferRate" % (section, site), rate)
+  burst = ops.getValue("%s/Sites/%s/TransferBurst" % (section, site), burst)
+  gLogger.verbose("Transfers at %s paced at %s per minute, burst of %s" % (site, rate, burst))
+  return TransferPacer(rate, burst, workdir)
@@ -0,0 +1,107 @@
+'''
+Upload of files to a storage element with a pool of threads. What was done is recorded in a
+manifest as it goes, so that an interrupted upload can be resumed without uploading again the
+files already there. Used by dirac-ilc-upload-gen-files.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from DIRAC.DataManagementSystem.Client.ReplicaManager       import ReplicaManager
+from DIRAC                                                   import gLogger
+import os, threading, Queue
+
+class UploadManifest(object):
+  """ State of each file (Uploaded, then Registered), appended to a file as the upload goes so that
+  an interrupted upload can be resumed
+  """
+  def __init__(self, path):
+    self.path = path
+    self.states = {}
+    complete = True
+    if os.path.exists(path):
+      mfile = open(path, 'r')
+      for line in mfile:
+        ##The last line may be incomplete if the upload was interrupted
+        complete = line.endswith("\n")
+        elems = line.split()
+        if len(elems) == 2 and complete:
+          self.states[elems[1]] = elems[0]
+      mfile.close()
+    self.mfile = open(path, 'a')
+    if not complete:
+      self.mfile.write("\n")
+    self.lock = threading.Lock()
+    
+  def getState(self, lfn):
+    """ The state of the file, empty if nothing was done
+    """
+    return self.states.get(lfn, '')
+  
+  def setState(self, lfn, state):
+    """ Record the new state of the file
+    """
+    self.lock.acquire()
+    try:
+      self.states[lfn] = state
+      self.mfile.write("%s %s\n" % (state, lfn))
+      self.mfile.flush()
+    finally:
+      self.lock.release()
+      
+  def close(self):
+    """ Close the manifest file
+    """
+    self.mfile.close()
+
+def getFilesToUpload(lfns, manifest, fc):
+  """ The files ({lfn : local file}) that still have to be uploaded: those not in the manifest, nor 
+  in the catalog. The files of an interrupted upload may be in the catalog without being in the manifest,
+  they are recorded as uploaded.
+  """
+  unknown = [lfn for lfn in lfns.keys() if not manifest.getState(lfn)]
+  if unknown:
+    res = fc.exists(unknown)
+    if not res['OK']:
+      gLogger.warn("Could not check which files are in the catalog:", res['Message'])
+    else:
+      for lfn, exists in res['Value']['Successful'].items():
+        if exists:
+          manifest.setState(lfn, 'Uploaded')
+  return dict([(lfn, localfile) for lfn, localfile in lfns.items() if not manifest.getState(lfn)])
+
+def uploadFiles(lfns, se, manifest, nbthreads):
+  """ Upload the files ({lfn : local file}) with a pool of threads, recording the uploaded ones in the manifest
+  """
+  todo = Queue.Queue()
+  for lfn in sorted(lfns.keys()):
+    todo.put(lfn)
+    
+  def worker():
+    """ Upload files until there is none left
+    """
+    rm = ReplicaManager()
+    while True:
+      try:
+        lfn = todo.get_nowait()
+      except Queue.Empty:
+        return
+      gLogger.notice("Uploading %s to" % lfns[lfn], lfn)
+      res = rm.putAndRegister(lfn, lfns[lfn], se)
+      if not res['OK']:
+        gLogger.error("Failed to upload %s:" % lfns[lfn], res['Message'])
+        continue
+      if res['Value']['Failed'].has_key(lfn):
+        gLogger.error("Failed to upload %s:" % lfns[lfn], res['Value']['Failed'][lfn])
+        continue
+      manifest.setState(lfn, 'Uploaded')
+    
+  threads = []
+  for dummy in range(max(1, min(nbthreads, len(lfns)))):
+    thread = threading.Thread(target = worker)
+    thread.setDaemon(True)
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
@@ -0,0 +1,93 @@
+'''
+Tests of L{InstallLock}, and of its use by L{TARsoft.install}: several jobs installing the same
+application in the same area at once.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from ILCDIRAC.Core.Utilities.InstallLock                    import InstallLock
+from ILCDIRAC.Core.Utilities.TransferPacer                  import WATCHDOG_FLAG
+from ILCDIRAC.Core.Utilities                                import TARsoft
+from DIRAC                                                   import S_OK
+import unittest, multiprocessing, tempfile, shutil, time, os
+
+NB_JOBS = 6
+
+def fakeGetAndExtract(TarBallURL, app_tar, folder_name, md5sum, area):
+  """ Stands for the download: slow enough for all the jobs to be there, and records each call
+  """
+  time.sleep(1)
+  folder = os.path.join(area, folder_name)
+  os.mkdir(folder)
+  open(os.path.join(folder, 'content'), 'w').close()
+  calls = open(os.path.join(area, 'extractions'), 'a')
+  calls.write("%s\n" % os.getpid())
+  calls.close()
+  return S_OK()
+
+def installJob(area, results):
+  """ What a job does
+  """
+  res = TARsoft.install(('app', '1'), 'app1.tgz', 'http://example.org/tarballs', False, '', area)
+  results.put(res)
+
+class InstallLockTestCase(unittest.TestCase):
+  """ Base class of the tests, everything happens in a temporary area
+  """
+  def setUp(self):
+    self.area = tempfile.mkdtemp()
+    self.cwd = os.getcwd()
+    ##The watchdog flag is written in the current directory
+    os.chdir(self.area)
+    self.getAndExtract = TARsoft.getAndExtract
+    TARsoft.getAndExtract = fakeGetAndExtract
+
+  def tearDown(self):
+    TARsoft.getAndExtract = self.getAndExtract
+    os.chdir(self.cwd)
+    shutil.rmtree(self.area, True)
+
+class ConcurrentInstallTest(InstallLockTestCase):
+  """ The jobs installing the same application
+  """
+  def test_oneInstaller(self):
+    """ Exactly one job installs the application, the others use it
+    """
+    results = multiprocessing.Queue()
+    jobs = [multiprocessing.Process(target = installJob, args = (self.area, results)) for dummy in range(NB_JOBS)]
+    for job in jobs:
+      job.start()
+    ress = [results.get(timeout = 60) for dummy in range(NB_JOBS)]
+    for job in jobs:
+      job.join()
+    for res in ress:
+      self.assertTrue(res['OK'], res.get('Message'))
+      self.assertEqual(res['Value'], ['app1', 'app1.tgz'])
+    extractions = open(os.path.join(self.area, 'extractions')).read().split()
+    self.assertEqual(len(extractions), 1)
+    self.assertFalse(os.path.exists(os.path.join(self.area, 'app1.lock')))
+    self.assertFalse(os.path.exists(os.path.join(self.area, WATCHDOG_FLAG)))
+
+  def test_interrupted(self):
+    """ A lock file left with a holder means the installation has to be redone
+    """
+    lockname = os.path.join(self.area, 'app1.lock')
+    lockfile = open(lockname, 'w')
+    lockfile.write("somehost 1234 2026-10-18 00:00:00\n")
+    lockfile.close()
+    os.mkdir(os.path.join(self.area, 'app1'))
+    lock = InstallLock(lockname)
+    res = lock.acquire()
+    self.assertTrue(res['OK'])
+    self.assertTrue(res['Value'])
+    lock.release()
+    self.assertFalse(os.path.exists(lockname))
+    res = TARsoft.install(('app', '1'), 'app1.tgz', 'http://example.org/tarballs', False, '', self.area)
+    self.assertTrue(res['OK'])
+    self.assertFalse(os.path.exists(os.path.join(self.area, 'extractions')))
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase(ConcurrentInstallTest)
+  testResult = unittest.TextTestRunner(verbosity = 2).run(suite)
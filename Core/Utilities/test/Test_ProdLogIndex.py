@@ -0,0 +1,77 @@
+'''
+Tests of L{ProdLogIndex}: extraction of job log archives and index of the errors found in them
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from ILCDIRAC.Core.Utilities.ProdLogIndex                   import extractAndIndex, rankSignatures, writeIndex
+import unittest, tempfile, shutil, tarfile, os
+
+JOB_LOGS = {'00001234_00000001' : {'Marlin.log' : "Processing event 1\nSegmentation fault\n",
+                                   'job.info' : "Status after the application execution is 139\n"},
+            '00001234_00000002' : {'Mokka.log' : "G4Exception\nsegmentation violation\nOut of memory\n"},
+            '00001234_00000003' : {'Marlin.log' : "All fine\n"}}
+
+class ProdLogIndexTest(unittest.TestCase):
+  """ Archives of the job logs written in a temporary directory
+  """
+  def setUp(self):
+    self.area = tempfile.mkdtemp()
+    self.outputdir = os.path.join(self.area, 'output')
+    os.mkdir(self.outputdir)
+
+  def tearDown(self):
+    shutil.rmtree(self.area, True)
+
+  def makeArchive(self, job):
+    """ The log archive of the job, like the ones made by UploadLogFile
+    """
+    jobdir = os.path.join(self.area, job)
+    os.mkdir(jobdir)
+    for name, content in JOB_LOGS[job].items():
+      open(os.path.join(jobdir, name), 'w').write(content)
+    archive = os.path.join(self.area, "%s.tar.gz" % job)
+    tar = tarfile.open(archive, 'w:gz')
+    tar.add(jobdir, job)
+    tar.close()
+    return archive
+
+  def test_extractAndIndex(self):
+    """ The files of the archive are extracted in a directory per job, the errors are counted
+    """
+    signatures = extractAndIndex(self.makeArchive('00001234_00000001'), self.outputdir)
+    self.assertEqual(signatures, {'Segmentation fault' : 1, 'Exit code 139' : 1})
+    for name, content in JOB_LOGS['00001234_00000001'].items():
+      extracted = os.path.join(self.outputdir, '00001234_00000001', name)
+      self.assertEqual(open(extracted).read(), content)
+    self.assertEqual(extractAndIndex(self.makeArchive('00001234_00000003'), self.outputdir), {})
+
+  def test_plainFile(self):
+    """ A file that is not an archive is only indexed
+    """
+    logfile = os.path.join(self.area, 'Mokka.log')
+    open(logfile, 'w').write(JOB_LOGS['00001234_00000002']['Mokka.log'])
+    self.assertEqual(extractAndIndex(logfile, self.outputdir), {'Segmentation fault' : 1, 'Out of memory' : 1})
+    self.assertEqual(os.listdir(self.outputdir), [])
+
+  def test_rankSignatures(self):
+    """ The signatures are ranked by the number of jobs they appear in, and written in the index
+    """
+    index = {}
+    for job in sorted(JOB_LOGS.keys()):
+      index[job] = extractAndIndex(self.makeArchive(job), self.outputdir)
+    ranking = rankSignatures(index)
+    self.assertEqual(ranking[0], ('Segmentation fault', 2))
+    self.assertEqual(sorted(ranking[1:]), [('Exit code 139', 1), ('Out of memory', 1)])
+    indexfile = os.path.join(self.outputdir, 'log_index.txt')
+    writeIndex(index, indexfile)
+    self.assertEqual(open(indexfile).read(), "00001234_00000001\tExit code 139\t1\n"
+                                             "00001234_00000001\tSegmentation fault\t1\n"
+                                             "00001234_00000002\tOut of memory\t1\n"
+                                             "00001234_00000002\tSegmentation fault\t1\n")
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase(ProdLogIndexTest)
+  testResult = unittest.TextTestRunner(verbosity = 2).run(suite)
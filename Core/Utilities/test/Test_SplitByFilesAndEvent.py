@@ -0,0 +1,63 @@
+'''
+Tests of L{splitFilesByEvents}
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from ILCDIRAC.Core.Utilities.SplitByFilesAndEvent           import splitFilesByEvents
+import unittest
+
+class SplitFilesByEventsTest(unittest.TestCase):
+  """ Splitting of files with known numbers of events
+  """
+  def split(self, filesandevents, evtsperjob, maxfilesperjob = 0):
+    """ Call the splitting, which must succeed
+    """
+    res = splitFilesByEvents(filesandevents, evtsperjob, maxfilesperjob)
+    self.assertTrue(res['OK'], res.get('Message'))
+    return res['Value']
+
+  def test_zeroEvents(self):
+    """ Files without events are not used, no files means no jobs, jobs need events
+    """
+    self.assertEqual(self.split([], 10), [])
+    self.assertEqual(self.split([('/a', 0), ('/b', 0)], 10), [])
+    self.assertEqual(self.split([('/a', 0), ('/b', 5), ('/c', 0)], 10),
+                     [{'files' : ['/b'], 'startFrom' : 0, 'nbevts' : 5}])
+    self.assertFalse(splitFilesByEvents([('/a', 10)], 0)['OK'])
+    self.assertFalse(splitFilesByEvents([('/a', -1)], 10)['OK'])
+
+  def test_exactFill(self):
+    """ Jobs ending exactly at the end of a file: the next job starts at the beginning of the next file
+    """
+    self.assertEqual(self.split([('/a', 20), ('/b', 10)], 10),
+                     [{'files' : ['/a'], 'startFrom' : 0, 'nbevts' : 10},
+                      {'files' : ['/a'], 'startFrom' : 10, 'nbevts' : 10},
+                      {'files' : ['/b'], 'startFrom' : 0, 'nbevts' : 10}])
+
+  def test_smallFiles(self):
+    """ Files with less events than a job: a job uses several files
+    """
+    self.assertEqual(self.split([('/a', 3), ('/b', 4), ('/c', 5)], 10),
+                     [{'files' : ['/a', '/b', '/c'], 'startFrom' : 0, 'nbevts' : 10},
+                      {'files' : ['/c'], 'startFrom' : 3, 'nbevts' : 2}])
+    ##Unless it's not allowed to
+    self.assertEqual(self.split([('/a', 3), ('/b', 4), ('/c', 5)], 10, 2),
+                     [{'files' : ['/a', '/b'], 'startFrom' : 0, 'nbevts' : 7},
+                      {'files' : ['/c'], 'startFrom' : 0, 'nbevts' : 5}])
+
+  def test_lastPartialJob(self):
+    """ The last job gets what remains, starting in the middle of a file
+    """
+    self.assertEqual(self.split([('/a', 15), ('/b', 8)], 10),
+                     [{'files' : ['/a'], 'startFrom' : 0, 'nbevts' : 10},
+                      {'files' : ['/a', '/b'], 'startFrom' : 10, 'nbevts' : 10},
+                      {'files' : ['/b'], 'startFrom' : 5, 'nbevts' : 3}])
+    ##The number of events can come as strings from the catalog
+    self.assertEqual(self.split([('/a', '25')], 10)[-1], {'files' : ['/a'], 'startFrom' : 20, 'nbevts' : 5})
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase(SplitFilesByEventsTest)
+  testResult = unittest.TextTestRunner(verbosity = 2).run(suite)
@@ -0,0 +1,138 @@
+'''
+Tests of L{UploadManifest}: resuming an upload, with a storage element that is a local directory
+and a catalog in memory.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from ILCDIRAC.Core.Utilities                                import UploadManifest as UploadModule
+from ILCDIRAC.Core.Utilities.UploadManifest                 import UploadManifest, getFilesToUpload, uploadFiles
+from DIRAC                                                   import S_OK, S_ERROR
+import unittest, tempfile, shutil, threading, os
+
+class FakeCatalog(object):
+  """ The files registered, and whether the catalog answers
+  """
+  def __init__(self):
+    self.files = {}
+    self.available = True
+
+  def exists(self, lfns):
+    """ Same answer as the FileCatalogClient
+    """
+    if not self.available:
+      return S_ERROR("Catalog not available")
+    return S_OK({'Successful' : dict([(lfn, self.files.has_key(lfn)) for lfn in lfns]), 'Failed' : {}})
+
+class FakeStorage(object):
+  """ The storage element: a directory. The files in failing cannot be uploaded
+  """
+  def __init__(self, path, catalog):
+    self.path = path
+    self.catalog = catalog
+    self.failing = []
+    self.uploaded = []
+    self.lock = threading.Lock()
+
+  def putAndRegister(self, lfn, localfile, se):
+    """ Copy the file and register it in the catalog
+    """
+    if lfn in self.failing:
+      return S_OK({'Successful' : {}, 'Failed' : {lfn : 'Transfer failed'}})
+    destination = os.path.join(self.path, se, lfn.lstrip("/"))
+    self.lock.acquire()
+    try:
+      if not os.path.isdir(os.path.dirname(destination)):
+        os.makedirs(os.path.dirname(destination))
+      self.uploaded.append(lfn)
+    finally:
+      self.lock.release()
+    shutil.copy(localfile, destination)
+    self.catalog.files[lfn] = destination
+    return S_OK({'Successful' : {lfn : {'put' : 1., 'register' : 1.}}, 'Failed' : {}})
+
+class UploadManifestTestCase(unittest.TestCase):
+  """ Base class of the tests: 10 local files to upload, the ReplicaManager uses the FakeStorage
+  """
+  def setUp(self):
+    self.area = tempfile.mkdtemp()
+    self.catalog = FakeCatalog()
+    self.storage = FakeStorage(os.path.join(self.area, 'SE'), self.catalog)
+    storage = self.storage
+    self.replicaManager = UploadModule.ReplicaManager
+    UploadModule.ReplicaManager = lambda: storage
+    self.lfns = {}
+    for index in range(10):
+      localfile = os.path.join(self.area, "gen.%03d.stdhep" % index)
+      open(localfile, 'w').write("events %s" % index)
+      self.lfns["/ilc/prod/ilc/generated/gen.%03d.stdhep" % index] = localfile
+    self.manifestPath = os.path.join(self.area, 'upload.manifest')
+
+  def tearDown(self):
+    UploadModule.ReplicaManager = self.replicaManager
+    shutil.rmtree(self.area, True)
+
+class ResumeTest(UploadManifestTestCase):
+  """ Interrupted uploads
+  """
+  def test_resume(self):
+    """ Only the files not uploaded the first time are uploaded the second time
+    """
+    failing = sorted(self.lfns.keys())[:3]
+    self.storage.failing = failing
+    manifest = UploadManifest(self.manifestPath)
+    uploadFiles(getFilesToUpload(self.lfns, manifest, self.catalog), 'SE-A', manifest, 4)
+    manifest.close()
+    self.assertEqual(sorted(self.storage.uploaded), sorted(self.lfns.keys())[3:])
+    ##Interrupted while writing the next line
+    open(self.manifestPath, 'a').write("Uploa")
+
+    self.storage.failing = []
+    self.storage.uploaded = []
+    manifest = UploadManifest(self.manifestPath)
+    for lfn in self.lfns.keys():
+      self.assertEqual(manifest.getState(lfn), lfn not in failing and 'Uploaded' or '')
+    toupload = getFilesToUpload(self.lfns, manifest, self.catalog)
+    self.assertEqual(sorted(toupload.keys()), failing)
+    uploadFiles(toupload, 'SE-A', manifest, 4)
+    manifest.close()
+    self.assertEqual(sorted(self.storage.uploaded), failing)
+    for lfn in self.lfns.keys():
+      self.assertTrue(os.path.exists(os.path.join(self.storage.path, 'SE-A', lfn.lstrip("/"))))
+    manifest = UploadManifest(self.manifestPath)
+    self.assertEqual([manifest.getState(lfn) for lfn in self.lfns.keys()], ['Uploaded'] * len(self.lfns))
+    manifest.close()
+
+  def test_inCatalog(self):
+    """ Files in the catalog but not in the manifest (interrupted before it was written) are not uploaded again
+    """
+    incatalog = sorted(self.lfns.keys())[5:]
+    for lfn in incatalog:
+      self.catalog.files[lfn] = 'somewhere'
+    manifest = UploadManifest(self.manifestPath)
+    toupload = getFilesToUpload(self.lfns, manifest, self.catalog)
+    self.assertEqual(sorted(toupload.keys()), sorted(self.lfns.keys())[:5])
+    for lfn in incatalog:
+      self.assertEqual(manifest.getState(lfn), 'Uploaded')
+    manifest.close()
+    ##And this is recorded
+    manifest = UploadManifest(self.manifestPath)
+    self.assertEqual(manifest.getState(incatalog[0]), 'Uploaded')
+    manifest.close()
+
+  def test_catalogNotAvailable(self):
+    """ When the catalog cannot tell, the files not in the manifest are uploaded
+    """
+    self.catalog.files[sorted(self.lfns.keys())[0]] = 'somewhere'
+    self.catalog.available = False
+    manifest = UploadManifest(self.manifestPath)
+    manifest.setState(sorted(self.lfns.keys())[1], 'Registered')
+    toupload = getFilesToUpload(self.lfns, manifest, self.catalog)
+    manifest.close()
+    self.assertEqual(sorted(toupload.keys()), sorted(self.lfns.keys())[:1] + sorted(self.lfns.keys())[2:])
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase(ResumeTest)
+  testResult = unittest.TextTestRunner(verbosity = 2).run(suite)
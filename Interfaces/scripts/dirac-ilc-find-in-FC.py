@@ -1,11 +1,57 @@
 #!/bin/env python
 '''
+Find files in the catalog from their meta data
+
+The query is split in pages, one per directory matching the directory meta data, and the files
+are written as the pages come, on stdout or in a file. The results are kept in a local cache
+keyed by the query, so asking the same again does not go to the catalog.
+
 Created on Mar 20, 2013
 
 @author: stephane
 '''
 
-from DIRAC import gLogger
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities.List import uniqueElements
+from types import DictType, ListType
+import os, sys, time
+
+try:
+  from hashlib import md5
+except ImportError:
+  from md5 import md5
+
+class Params(object):
+  def __init__(self):
+    self.count = False
+    self.outputfile = ''
+    self.usecache = True
+    self.cachedir = os.path.join(os.environ.get('HOME', '/tmp'), '.dirac-ilc-find-in-FC')
+    self.cacheage = 3600
+  def setCount(self, opt):
+    self.count = True
+    return S_OK()
+  def setOutputFile(self, opt):
+    self.outputfile = opt
+    return S_OK()
+  def setNoCache(self, opt):
+    self.usecache = False
+    return S_OK()
+  def setCacheDir(self, opt):
+    self.cachedir = opt
+    return S_OK()
+  def setCacheAge(self, opt):
+    self.cacheage = int(opt)
+    return S_OK()
+  def registerSwitch(self):
+    Script.registerSwitch("c", "count", "Only print the number of files found", self.setCount)
+    Script.registerSwitch("o:", "output=", "Write the files found in this file instead of stdout", self.setOutputFile)
+    Script.registerSwitch("n", "no-cache", "Do not use the cached results, query the catalog", self.setNoCache)
+    Script.registerSwitch("", "cache-dir=", "Directory of the cached results (default %s)" % self.cachedir, 
+                          self.setCacheDir)
+    Script.registerSwitch("", "cache-age=", "Seconds during which the cached results are used (default %s)" % self.cacheage, 
+                          self.setCacheAge)
+    Script.setUsageMessage("%s path meta1=A meta2=B etc." % Script.scriptName)
 
 def createQueryDict(argss):
   """
@@ -120,10 +166,117 @@ def createQueryDict(argss):
   
   return metaDict
 
+def normaliseQuery(path, metaDict):
+  """ String representation of the query that does not depend on the order of the meta data or of the values
+  """
+  def normalise(value):
+    if type(value) == DictType:
+      return "{%s}" % ",".join(["%r:%s" % (key, normalise(value[key])) for key in sorted(value.keys())])
+    if type(value) == ListType:
+      return "[%s]" % ",".join(sorted([normalise(item) for item in value]))
+    return repr(value)
+  return "%s?%s" % (os.path.normpath(path), normalise(metaDict))
+
+def planQuery(fc, metaDict, path):
+  """ Get the directories to query one after the other: those matching the directory meta data.
+  A directory is skipped if one of its parents is queried, as the files are searched recursively.
+  When the query has no directory meta data, there is only one page: the path itself.
+  """
+  res = fc.getMetadataFields()
+  if not res['OK']:
+    return res
+  dirMeta = dict([(name, value) for name, value in metaDict.items() 
+                  if res['Value']['DirectoryMetaFields'].has_key(name)])
+  if not dirMeta:
+    return S_OK([path])
+  res = fc.findDirectoriesByMetadata(dirMeta, path)
+  if not res['OK']:
+    return res
+  basepath = path.rstrip("/") + "/"
+  pages = []
+  kept = set()
+  ##Parents first, so that the children can be checked against all the directories kept
+  for directory in sorted(res['Value'].values(), key = lambda name: (name.rstrip("/").count("/"), name)):
+    directory = directory.rstrip("/") or "/"
+    if not (directory + "/").startswith(basepath):
+      continue
+    parent = directory
+    while parent != os.path.dirname(parent):
+      parent = os.path.dirname(parent)
+      if parent in kept:
+        break
+    else:
+      kept.add(directory)
+      pages.append(directory)
+  return S_OK(sorted(pages))
+
+def findFiles(fc, metaDict, pages):
+  """ Generator of the LFNs found, page by page
+  """
+  for page in pages:
+    res = fc.findFilesByMetadata(metaDict, page)
+    if not res['OK']:
+      raise RuntimeError("Query of %s failed: %s" % (page, res['Message']))
+    gLogger.verbose("Found %s files in %s" % (len(res['Value']), page))
+    for lfn in res['Value']:
+      yield lfn
+
+def getCacheFile(cachedir, query):
+  """ Name of the cache file of the query
+  """
+  return os.path.join(cachedir, "%s.lfns" % md5(query).hexdigest())
+
+def readCache(cachefile, maxage):
+  """ Generator of the cached LFNs, None if there is no recent enough cache
+  """
+  if not os.path.exists(cachefile) or time.time() - os.path.getmtime(cachefile) > maxage:
+    return None
+  def lfns():
+    cached = open(cachefile, 'r')
+    try:
+      for line in cached:
+        yield line.rstrip("\n")
+    finally:
+      cached.close()
+  return lfns()
+
+def streamFiles(lfns, output, cachefile = None, count = False):
+  """ Write the LFNs as they come in output (not when counting) and in the cache file, if any.
+  The cache file is only put in place when all the LFNs were obtained. Returns S_OK(number of LFNs).
+  """
+  cache = None
+  if cachefile:
+    tmpcache = "%s.%s" % (cachefile, os.getpid())
+    try:
+      if not os.path.isdir(os.path.dirname(cachefile)):
+        os.makedirs(os.path.dirname(cachefile))
+      cache = open(tmpcache, 'w')
+    except (IOError, OSError), x:
+      gLogger.warn("Cannot cache the results:", str(x))
+  nbfiles = 0
+  try:
+    for lfn in lfns:
+      nbfiles += 1
+      if not count:
+        output.write(lfn + "\n")
+      if cache:
+        cache.write(lfn + "\n")
+  except RuntimeError, x:
+    if cache:
+      cache.close()
+      os.remove(tmpcache)
+    return S_ERROR(str(x))
+  if cache:
+    cache.close()
+    os.rename(tmpcache, cachefile)
+  return S_OK(nbfiles)
+
 if __name__ == '__main__':
   from DIRAC.Core.Base import Script
+  clip = Params()
+  clip.registerSwitch()
   Script.parseCommandLine()
-  Script.setUsageMessage(  "%s path meta1=A meta2=B etc." % Script.scriptName)
+  from DIRAC import exit as dexit
 
   args = Script.getPositionalArgs()
   if len(args)<2:
@@ -131,7 +284,6 @@ if __name__ == '__main__':
     Script.showHelp()
     dexit(1)
     
-  from DIRAC import gLogger, exit as dexit
   path = args[0]
   if path == '.':
     path = '/'
@@ -142,15 +294,36 @@ if __name__ == '__main__':
   if not metaDict:
     gLogger.info("No query")
     dexit(1)
-  from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
-  
-  fc = FileCatalogClient()
-  res = fc.findFilesByMetadata(metaDict, path)
+
+  query = normaliseQuery(path, metaDict)
+  cachefile = getCacheFile(clip.cachedir, query)
+  lfns = None
+  if clip.usecache:
+    lfns = readCache(cachefile, clip.cacheage)
+  if lfns is not None:
+    gLogger.verbose("Using the cached results in", cachefile)
+    cachefile = None
+  else:
+    from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
+    fc = FileCatalogClient()
+    res = planQuery(fc, metaDict, path)
+    if not res['OK']:
+      gLogger.error(res['Message'])
+      dexit(1)
+    gLogger.verbose("Querying %s directories" % len(res['Value']))
+    lfns = findFiles(fc, metaDict, res['Value'])
+
+  output = sys.stdout
+  if clip.outputfile and not clip.count:
+    output = open(clip.outputfile, 'w')
+  res = streamFiles(lfns, output, cachefile, clip.count)
+  if output is not sys.stdout:
+    output.close()
   if not res['OK']:
     gLogger.error(res['Message'])
     dexit(1)
-  if not res['Value']:
+  if clip.count:
+    gLogger.notice("%s files found" % res['Value'])
+  elif not res['Value']:
     gLogger.notice("No files found")
-  for files in res['Value']:
-    gLogger.notice(files)
-  dexit(0)
\ No newline at end of file
+  dexit(0)
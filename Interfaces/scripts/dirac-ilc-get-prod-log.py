@@ -2,19 +2,26 @@
 '''
 Get production logs
 
+With -D, all the logs of the directory are downloaded in parallel, the job log archives are
+extracted, and an index of the error signatures found in each job is written in the output
+directory (log_index.txt), the most frequent ones being printed at the end.
+
 Created on Mar 21, 2013
 
 @author: stephane
 '''
 from DIRAC.Core.Base import Script
-from DIRAC import gLogger, S_OK, exit as dexit
+from DIRAC import gLogger, S_OK, S_ERROR, exit as dexit
 from DIRAC.Core.Utilities import PromptUser
+from ILCDIRAC.Core.Utilities.ProdLogIndex import extractAndIndex, writeIndex, rankSignatures
+import os, tarfile, threading, Queue
 
 class Params(object):
   def __init__(self):
     self.logD = ''
     self.logF = ''
     self.outputdir = './'
+    self.nbthreads = 8
   def setLogFileD(self,opt):
     self.logD = opt
     return S_OK()
@@ -24,13 +31,80 @@ class Params(object):
   def setOutputDir(self,opt):
     self.outputdir = opt
     return S_OK()
+  def setNbThreads(self,opt):
+    self.nbthreads = int(opt)
+    return S_OK()
   def registerSwitch(self):
     Script.registerSwitch('D:', 'LogFileDir=', 'Production log dir to download', self.setLogFileD)
     Script.registerSwitch('F:', 'LogFile=', 'Production log to download', self.setLogFileF)
     Script.registerSwitch('O:', 'OutputDir=', 'Output directory (default %s)' % self.outputdir, 
                           self.setOutputDir)
+    Script.registerSwitch('j:', 'threads=', 'Number of parallel downloads with -D (default %s)' % self.nbthreads,
+                          self.setNbThreads)
     Script.setUsageMessage('%s -F /ilc/prod/.../LOG/.../somefile' % Script.scriptName)
 
+def listLogDirectory(rm, logdir, se):
+  """ List the files of the log directory and of its sub directories
+  """
+  res = rm.getStorageListDirectory(logdir, se)
+  if not res['OK']:
+    return res
+  if not res['Value']['Successful'].has_key(logdir):
+    return S_ERROR(res['Value']['Failed'].get(logdir, 'Could not list %s' % logdir))
+  content = res['Value']['Successful'][logdir]
+  ##Whatever is returned, physical or logical paths, the names are what matters
+  files = [os.path.join(logdir, os.path.basename(path)) for path in content['Files'].keys()]
+  for subdir in content['SubDirs'].keys():
+    res = listLogDirectory(rm, os.path.join(logdir, os.path.basename(subdir.rstrip("/"))), se)
+    if not res['OK']:
+      return res
+    files.extend(res['Value'])
+  return S_OK(files)
+
+def getLogs(files, se, outputdir, nbthreads):
+  """ Download the files with a pool of threads, extract and index them as they arrive.
+  Each thread has its own ReplicaManager, they are not meant to be shared.
+  Returns the signatures found per file.
+  """
+  from DIRAC.DataManagementSystem.Client.ReplicaManager import ReplicaManager
+  todo = Queue.Queue()
+  for lfn in files:
+    todo.put(lfn)
+  index = {}
+  lock = threading.Lock()
+
+  def worker():
+    """ Get logs until there is none left
+    """
+    rm = ReplicaManager()
+    while True:
+      try:
+        lfn = todo.get_nowait()
+      except Queue.Empty:
+        return
+      res = rm.getStorageFile(lfn, se, outputdir, singleFile = True)
+      if not res['OK']:
+        gLogger.error("Failed to get %s:" % lfn, res['Message'])
+        continue
+      try:
+        signatures = extractAndIndex(os.path.join(outputdir, os.path.basename(lfn)), outputdir)
+      except (IOError, OSError, tarfile.TarError), x:
+        gLogger.error("Failed to extract %s:" % lfn, str(x))
+        continue
+      lock.acquire()
+      index[lfn] = signatures
+      lock.release()
+
+  threads = []
+  for dummy in range(max(1, min(nbthreads, len(files)))):
+    thread = threading.Thread(target = worker)
+    thread.setDaemon(True)
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  return index
+
 if __name__ == '__main__':
   clip = Params()
   clip.registerSwitch()
@@ -42,24 +116,33 @@ if __name__ == '__main__':
   from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
   ops = Operations()
   storageElementName = ops.getValue('/LogStorage/LogSE', 'LogSE')
-  
+
   from DIRAC.DataManagementSystem.Client.ReplicaManager import ReplicaManager
   rm = ReplicaManager()
   from DIRAC.Core.Utilities.PromptUser import promptUser
   if clip.logD:
-    res = promptUser('Are you sure you want to get ALL the files in this directory?')
+    res = listLogDirectory(rm, clip.logD.rstrip("/"), storageElementName)
+    if not res['OK']:
+      gLogger.error(res['Message'])
+      dexit(1)
+    files = res['Value']
+    res = promptUser('Are you sure you want to get ALL the %s files in this directory?' % len(files))
     if not res['OK']:
       dexit()
     choice = res['Value']
     if choice.lower()=='n':
       dexit(0)
-    res = rm.getStorageDirectory(clip.logD, storageElementName, clip.outputdir, singleDirectory=True)
-    if not res['OK']:
-      gLogger.error(res['Message'])
+    index = getLogs(files, storageElementName, clip.outputdir, clip.nbthreads)
+    indexfile = os.path.join(clip.outputdir, 'log_index.txt')
+    writeIndex(index, indexfile)
+    gLogger.notice("Got %s files out of %s, index of the errors in %s" % (len(index), len(files), indexfile))
+    for signature, count in rankSignatures(index):
+      gLogger.notice("%6s files: %s" % (count, signature))
+    if len(index) < len(files):
       dexit(1)
   if clip.logF:
     res = rm.getStorageFile(clip.logF, storageElementName, clip.outputdir, singleFile = True)
     if not res['OK']:
       gLogger.error(res['Message'])
       dexit(1)
-  
\ No newline at end of file
+
@@ -6,13 +6,12 @@ from DIRAC.Core.Base import Script
 from DIRAC import S_OK, S_ERROR, exit as dexit
 import os
 
-def getFileInfo(lfn):
+def getFileInfo(fc, lfn):
   """ Retrieve the file info
   """
-  from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
   from DIRAC.Core.Utilities import DEncode
   from DIRAC import gLogger
-  fc = FileCatalogClient()
+  import ast
   lumi = 0
   nbevts = 0
   res  = fc.getFileUserMetadata(lfn)
@@ -25,13 +24,33 @@ def getFileInfo(lfn):
   if 'AdditionalInfo' in res['Value']:
     addinfo = res['Value']['AdditionalInfo']
     if addinfo.count("{"):
-      addinfo = eval(addinfo)
+      addinfo = ast.literal_eval(addinfo)
     else:
       addinfo = DEncode.decode(addinfo)[0]
   if "NumberOfEvents" in res['Value'].keys():
     nbevts += int(res['Value']['NumberOfEvents'])
   return (float(lumi),int(nbevts),addinfo)
 
+def getFilesInfo(fc, lfns):
+  """ Sum the luminosity, the number of events and the cross sections of the files. Returns also 
+  the number of files that have a cross section
+  """
+  lumi = 0.
+  nbevts = 0
+  xsec = 0.
+  files = 0
+  for lfn in lfns:
+    info = getFileInfo(fc, lfn)
+    lumi += info[0]
+    nbevts += info[1]
+    addinfo = info[2]
+    if 'xsection' in addinfo:
+      if 'sum' in addinfo['xsection']:
+        if 'xsection' in addinfo['xsection']['sum']:
+          xsec += addinfo['xsection']['sum']['xsection']
+          files += 1
+  return (lumi, nbevts, xsec, files)
+
 def translate(detail):
   """ Replace whizard naming convention by human conventions
   """
@@ -88,252 +107,188 @@ def translate(detail):
 #    else:
 #      return S_OK(ancestor)
 
-class Params(object):
-  """ CLI Parameters class
+def getProductionSummary(prodID, full_detail, fc, trc, processesdict, cache):
+  """ Get the summary of a production. The cache entry is used if the number of files did not change
   """
-  def __init__(self):
-    """ Initialize
-    """
-    self.prod = []
-    self.minprod = 0
-    self.full_det = False
-    self.verbose = False
-    self.ptypes = ['MCGeneration','MCSimulation','MCReconstruction',"MCReconstruction_Overlay"]
-    self.statuses = ['Active','Stopped','Completed','Archived']
-    
-  def setProdID(self, opt):
-    """ Set the prodID to use. can be a range, a list, a unique value
-    and a 'greater than' value
-    """
-    if opt.count(","):
-      parts = opt.split(",")
-    else:
-      parts = [opt]
-    prods = []
-    for part in parts:
-      if part.count("gt"):
-        self.minprod = int(part.replace("gt",""))
-        continue
-      if part.count("-"):
-        prods.extend(range(int(part.split("-")[0]), int(part.split("-")[1])+1))
-      else:
-        prods.append(int(part))  
-    self.prod = prods
+  from DIRAC import gLogger
+  meta = {}
+  meta['ProdID']=prodID
+  res = trc.getTransformation(str(prodID))
+  if not res['OK']:
+    gLogger.error("Error getting transformation %s" % prodID )
+    return None
+  prodtype = res['Value']['Type']
+  proddetail = res['Value']['Description']
+  if prodtype == 'MCReconstruction' or prodtype == 'MCReconstruction_Overlay' :
+    meta['Datatype']='DST'
+  elif prodtype == 'MCGeneration':
+    meta['Datatype']='gen'
+  elif prodtype == 'MCSimulation':
+    meta['Datatype']='SIM'
+  elif prodtype in ['Split','Merge']:
+    gLogger.warn("Invalid query for %s productions" % prodtype)
+    return None
+  else:
+    gLogger.error("Unknown production type %s"% prodtype)
+    return None
+  res = fc.findFilesByMetadata(meta)  
+  if not res['OK']:
+    gLogger.error(res['Message'])
+    return None
+  lfns = res['Value']
+  nb_files = len(lfns)
+  path = ""
+  if not len(lfns):
+    gLogger.warn("No files found for prod %s" % prodID)
+    return None
+  
+  ##Nothing changed since last time
+  entry = cache.get(prodID)
+  if entry and entry['NbFiles'] == nb_files and (entry['Precise'] or not full_detail):
+    gLogger.verbose("Using cached summary of prod %s" % prodID)
+    return entry['Summary']
+  
+  path = os.path.dirname(lfns[0])
+  res = fc.getDirectoryMetadata(path)
+  if not res['OK']:
+    gLogger.warn('No meta data found for %s' % path)
+    return None
+  dirmeta = {}
+  dirmeta['proddetail'] = proddetail
+  dirmeta['prodtype'] = prodtype
+  dirmeta['nb_files']=nb_files
+  dirmeta.update(res['Value'])
+  if not full_detail:
+    lumi, nbevts, xsec, files = getFilesInfo(fc, lfns[:1])
+    nbevts *= len(lfns)
+    lumi *= len(lfns)
+  else:
+    lumi, nbevts, xsec, files = getFilesInfo(fc, lfns)
+  if not lumi:
+    depthDict = {}  
+    depSet = set()  
+    res = fc.getFileAncestors(lfns,[1,2,3,4])
+    temp_ancestorlist = []
+    if res['OK']:
+      for lfn,ancestorsDict in res['Value']['Successful'].items():
+        for ancestor,dep in ancestorsDict.items():
+          depthDict.setdefault(dep,[])
+          if ancestor not in temp_ancestorlist:
+            depthDict[dep].append(ancestor)
+            depSet.add(dep)
+            temp_ancestorlist.append(ancestor)
+    depList = list(depSet)
+    depList.sort()
+    xsec = 0
+    files = 0
+    if depList:
+      lumi, dummy_nbevts, xsec, files = getFilesInfo(fc, depthDict[depList[-1]])
+  if xsec and files:
+    xsec /= files
+    dirmeta['CrossSection']=xsec
+  else:
+    dirmeta['CrossSection']=0.0
+        
+  if nbevts:
+    dirmeta['NumberOfEvents']=nbevts
+  if not dirmeta.has_key('NumberOfEvents'):
+    dirmeta['NumberOfEvents']=0
+  detail = dirmeta['EvtType']
+  if processesdict.has_key(dirmeta['EvtType']):
+    if processesdict[dirmeta['EvtType']].has_key('Detail'):
+      detail = processesdict[dirmeta['EvtType']]['Detail']
 
-    return S_OK()
+  if not prodtype == 'MCGeneration':
+    res = trc.getTransformationInputDataQuery(str(prodID))
+    if res['OK']:
+      if res['Value'].has_key('ProdID'):
+        dirmeta['MomProdID']=res['Value']['ProdID']
+  if not dirmeta.has_key('MomProdID'):
+    dirmeta['MomProdID']=0
+  dirmeta['detail']= translate(detail)
+  cache[prodID] = {'NbFiles' : nb_files, 'Precise' : full_detail, 'Summary' : dirmeta}
+  return dirmeta
 
-  def setFullDetail(self,opt):
-    """ Get every individual file's properties, makes this 
-    very very slow
-    """
-    self.full_det = True
-    return S_OK()
+def getSummaries(prodids, full_detail, processesdict, cache, nbthreads):
+  """ Get the summaries of the productions using a pool of threads, each having its own clients.
+  Returns them in the order of prodids.
+  """
+  from DIRAC.TransformationSystem.Client.TransformationClient   import TransformationClient
+  from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
+  from DIRAC import gLogger
+  import threading, Queue
+  todo = Queue.Queue()
+  for prodID in prodids:
+    todo.put(prodID)
+  summaries = {}
+  lock = threading.Lock()
 
-  def setVerbose(self, opt):
-    """ Extra printouts
+  def worker():
+    """ Treat productions until there is none left
     """
-    self.verbose = True
-    return S_OK()
+    fc = FileCatalogClient()
+    trc = TransformationClient()
+    while True:
+      try:
+        prodID = todo.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        dirmeta = getProductionSummary(prodID, full_detail, fc, trc, processesdict, cache)
+      except Exception, x:
+        gLogger.exception("Failed to get the summary of prod %s" % prodID, '', x)
+        continue
+      if dirmeta:
+        lock.acquire()
+        summaries[prodID] = dirmeta
+        lock.release()
 
-  def setProdTypes(self, opt):
-    """ The prod types to consider
-    """
-    self.ptypes = opt.split(",")
-    return S_OK()
+  threads = []
+  for dummy in range(max(1, min(nbthreads, len(prodids)))):
+    thread = threading.Thread(target = worker)
+    thread.setDaemon(True)
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  return [summaries[prodID] for prodID in prodids if summaries.has_key(prodID)]
 
-  def setStatuses(self, opt):
-    ''' The prod statuses
-    '''
-    self.statuses = opt.split(",")
-    return S_OK()
+def loadCache(cachefile):
+  """ Read the summaries obtained in the previous runs
+  """
+  from DIRAC.Core.Utilities import DEncode
+  from DIRAC import gLogger
+  if not cachefile or not os.path.exists(cachefile):
+    return {}
+  try:
+    cf = open(cachefile, 'r')
+    cache = DEncode.decode(cf.read())[0]
+    cf.close()
+  except Exception, x:
+    gLogger.warn("Could not read the cache %s, ignoring it:" % cachefile, str(x))
+    return {}
+  return cache
 
-  def registerSwitch(self):
-    """ Register all CLI switches
-    """
-    Script.registerSwitch("P:", "prods=", "Productions: greater than with gt1234, range with 32-56, list with 34,56", self.setProdID)
-    Script.registerSwitch("p", "precise_detail", "Precise detail, slow", self.setFullDetail)
-    Script.registerSwitch("v", "verbose", "Verbose output", self.setVerbose)
-    Script.registerSwitch("t:", "types=", "Production Types, comma separated, default all", self.setProdTypes)
-    Script.registerSwitch("S:", "Statuses=", "Statuses, comma separated, default all", self.setStatuses)
-    Script.setUsageMessage( '\n'.join( [ __doc__.split( '\n' )[1],
-                                        '\nUsage:',
-                                        '  %s [option|cfgfile] ...\n' % Script.scriptName ] ) )
+def saveCache(cachefile, cache):
+  """ Store the summaries for the next runs
+  """
+  from DIRAC.Core.Utilities import DEncode
+  from DIRAC import gLogger
+  if not cachefile:
+    return
+  try:
+    cf = open(cachefile + ".tmp", 'w')
+    cf.write(DEncode.encode(cache))
+    cf.close()
+    os.rename(cachefile + ".tmp", cachefile)
+  except (IOError, OSError), x:
+    gLogger.warn("Could not write the cache %s:" % cachefile, str(x))
 
-if __name__=="__main__":
-  clip = Params()
-  clip.registerSwitch()
-  Script.parseCommandLine()
+def writeTables(metadata, outputfile):
+  """ Write the HTML tables, one detector and production type after the other
+  """
   from ILCDIRAC.Core.Utilities.HTML                             import Table
-  from ILCDIRAC.Core.Utilities.ProcessList                      import ProcessList
-  from DIRAC.TransformationSystem.Client.TransformationClient   import TransformationClient
-  from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
-  from DIRAC import gConfig, gLogger
-  prod = clip.prod
-  full_detail = clip.full_det
-  fc = FileCatalogClient()
-  
-  processlist = gConfig.getValue('/LocalSite/ProcessListPath')
-  prl = ProcessList(processlist)
-  processesdict = prl.getProcessesDict()
-  
-  trc = TransformationClient()
-  prodids = []
-  if not prod:
-   conddict = {}
-   conddict['Status'] = clip.statuses
-   if clip.ptypes:
-     conddict['Type'] = clip.ptypes
-   res = trc.getTransformations( conddict )
-   if res['OK']:
-     for transfs in res['Value']:
-       prodids.append(transfs['TransformationID'])
-  else:
-    prodids.extend(prod)
-
-  metadata = []
-  
-  gLogger.info("Will run on prods %s" % str(prodids))
-  
-  for prodID in prodids:
-    if prodID<clip.minprod:
-      continue
-    meta = {}
-    meta['ProdID']=prodID
-    res = trc.getTransformation(str(prodID))
-    if not res['OK']:
-      gLogger.error("Error getting transformation %s" % prodID )
-      continue
-    prodtype = res['Value']['Type']
-    proddetail = res['Value']['Description']
-    if prodtype == 'MCReconstruction' or prodtype == 'MCReconstruction_Overlay' :
-      meta['Datatype']='DST'
-    elif prodtype == 'MCGeneration':
-      meta['Datatype']='gen'
-    elif prodtype == 'MCSimulation':
-      meta['Datatype']='SIM'
-    elif prodtype in ['Split','Merge']:
-      gLogger.warn("Invalid query for %s productions" % prodtype)
-      continue
-    else:
-      gLogger.error("Unknown production type %s"% prodtype)
-      continue
-    res = fc.findFilesByMetadata(meta)  
-    if not res['OK']:
-      gLogger.error(res['Message'])
-      continue
-    lfns = res['Value']
-    nb_files = len(lfns)
-    path = ""
-    if not len(lfns):
-      gLogger.warn("No files found for prod %s" % prodID)
-      continue
-    path = os.path.dirname(lfns[0])
-    res = fc.getDirectoryMetadata(path)
-    if not res['OK']:
-      gLogger.warn('No meta data found for %s' % path)
-      continue
-    dirmeta = {}
-    dirmeta['proddetail'] = proddetail
-    dirmeta['prodtype'] = prodtype
-    dirmeta['nb_files']=nb_files
-    dirmeta.update(res['Value'])
-    lumi  = 0.
-    nbevts = 0
-    addinfo = None
-    files = 0
-    xsec = 0.0
-    if not full_detail:
-      lfn  = lfns[0]
-      info = getFileInfo(lfn)
-      nbevts = info[1]*len(lfns)
-      lumi = info[0]*len(lfns)
-      addinfo = info[2]
-      if 'xsection' in addinfo:
-        if 'sum' in addinfo['xsection']:
-          if 'xsection' in addinfo['xsection']['sum']:
-            xsec += addinfo['xsection']['sum']['xsection']
-            files += 1
-    else:
-      for lfn in lfns:
-        info = getFileInfo(lfn)
-        lumi += info[0]
-        nbevts += info[1]
-        addinfo = info[2]
-        if 'xsection' in addinfo:
-          if 'sum' in addinfo['xsection']:
-            if 'xsection' in addinfo['xsection']['sum']:
-              xsec += addinfo['xsection']['sum']['xsection']
-              files += 1
-    if not lumi:
-      xsec = 0
-      files = 0
-      depthDict = {}  
-      depSet = set()  
-      res = fc.getFileAncestors(lfns,[1,2,3,4])
-      temp_ancestorlist = []
-      if res['OK']:
-        for lfn,ancestorsDict in res['Value']['Successful'].items():
-          for ancestor,dep in ancestorsDict.items():
-            depthDict.setdefault(dep,[])
-            if ancestor not in temp_ancestorlist:
-              depthDict[dep].append(ancestor)
-              depSet.add(dep)
-              temp_ancestorlist.append(ancestor)
-      depList = list(depSet)
-      depList.sort()
-      for ancestor in depthDict[depList[-1]]:
-        info = getFileInfo(ancestor)
-        lumi += info[0]
-        addinfo = info[2]
-        if 'xsection' in addinfo:
-          if 'sum' in addinfo['xsection']:
-            if 'xsection' in addinfo['xsection']['sum']:
-              xsec += addinfo['xsection']['sum']['xsection']
-              files += 1
-    if xsec and files:
-      xsec /= files
-      dirmeta['CrossSection']=xsec
-    else:
-      dirmeta['CrossSection']=0.0
-          
-    if nbevts:
-      dirmeta['NumberOfEvents']=nbevts
-    #if not lumi:
-    #  dirmeta['Luminosity']=0
-    #  dirmeta['CrossSection']=0
-    #else:
-    #  if nbevts:
-    #    dirmeta['CrossSection']=nbevts/lumi
-    #  else:
-    #    dirmeta['CrossSection']=0
-    #if addinfo:
-    #  if 'xsection' in addinfo:
-    #    if 'sum' in addinfo['xsection']:
-    #      if 'xsection' in addinfo['xsection']['sum']:
-    #        dirmeta['CrossSection']=addinfo['xsection']['sum']['xsection']
-    if not dirmeta.has_key('NumberOfEvents'):
-      dirmeta['NumberOfEvents']=0
-    #print processesdict[dirmeta['EvtType']]
-    dirmeta['detail']=''
-    if processesdict.has_key(dirmeta['EvtType']):
-      if processesdict[dirmeta['EvtType']].has_key('Detail'):
-        detail = processesdict[dirmeta['EvtType']]['Detail']
-        
-    else:
-      detail=dirmeta['EvtType']
-  
-  
-    if not prodtype == 'MCGeneration':
-      res = trc.getTransformationInputDataQuery(str(prodID))
-      if res['OK']:
-        if res['Value'].has_key('ProdID'):
-          dirmeta['MomProdID']=res['Value']['ProdID']
-    if not dirmeta.has_key('MomProdID'):
-      dirmeta['MomProdID']=0
-    dirmeta['detail']= translate(detail)
-
-    metadata.append(dirmeta)
-  
+  from DIRAC import gLogger
   detectors = {}
   detectors['ILD'] = {}
   corres = {"MCGeneration":'gen',"MCSimulation":'SIM',"MCReconstruction":"REC","MCReconstruction_Overlay":"REC"}
@@ -370,7 +325,7 @@ if __name__=="__main__":
                                                                    channel['MomProdID'],
                                                                    str(channel['proddetail'])))
   
-  of = file("tables.html","w")
+  of = file(outputfile,"w")
   of.write("""<!DOCTYPE html>
 <html>
  <head>
@@ -428,5 +383,131 @@ if __name__=="__main__":
 </html>
 """)
   of.close()
+
+class Params(object):
+  """ CLI Parameters class
+  """
+  def __init__(self):
+    """ Initialize
+    """
+    self.prod = []
+    self.minprod = 0
+    self.full_det = False
+    self.verbose = False
+    self.ptypes = ['MCGeneration','MCSimulation','MCReconstruction',"MCReconstruction_Overlay"]
+    self.statuses = ['Active','Stopped','Completed','Archived']
+    self.nbthreads = 8
+    self.cachefile = 'production_summary.cache'
+    
+  def setProdID(self, opt):
+    """ Set the prodID to use. can be a range, a list, a unique value
+    and a 'greater than' value
+    """
+    if opt.count(","):
+      parts = opt.split(",")
+    else:
+      parts = [opt]
+    prods = []
+    for part in parts:
+      if part.count("gt"):
+        self.minprod = int(part.replace("gt",""))
+        continue
+      if part.count("-"):
+        prods.extend(range(int(part.split("-")[0]), int(part.split("-")[1])+1))
+      else:
+        prods.append(int(part))  
+    self.prod = prods
+
+    return S_OK()
+
+  def setFullDetail(self,opt):
+    """ Get every individual file's properties, makes this 
+    very very slow
+    """
+    self.full_det = True
+    return S_OK()
+
+  def setVerbose(self, opt):
+    """ Extra printouts
+    """
+    self.verbose = True
+    return S_OK()
+
+  def setProdTypes(self, opt):
+    """ The prod types to consider
+    """
+    self.ptypes = opt.split(",")
+    return S_OK()
+
+  def setStatuses(self, opt):
+    ''' The prod statuses
+    '''
+    self.statuses = opt.split(",")
+    return S_OK()
+
+  def setNbThreads(self, opt):
+    """ Number of productions treated in parallel
+    """
+    self.nbthreads = int(opt)
+    return S_OK()
+
+  def setCacheFile(self, opt):
+    """ Where the summaries are kept between runs, empty to not use it
+    """
+    self.cachefile = opt
+    return S_OK()
+
+  def registerSwitch(self):
+    """ Register all CLI switches
+    """
+    Script.registerSwitch("P:", "prods=", "Productions: greater than with gt1234, range with 32-56, list with 34,56", self.setProdID)
+    Script.registerSwitch("p", "precise_detail", "Precise detail, slow", self.setFullDetail)
+    Script.registerSwitch("v", "verbose", "Verbose output", self.setVerbose)
+    Script.registerSwitch("t:", "types=", "Production Types, comma separated, default all", self.setProdTypes)
+    Script.registerSwitch("S:", "Statuses=", "Statuses, comma separated, default all", self.setStatuses)
+    Script.registerSwitch("j:", "threads=", "Number of productions treated in parallel (default %s)" % self.nbthreads,
+                          self.setNbThreads)
+    Script.registerSwitch("C:", "cache=", "Cache file, reused for the productions whose number of files did not change (default %s)" % self.cachefile, 
+                          self.setCacheFile)
+    Script.setUsageMessage( '\n'.join( [ __doc__.split( '\n' )[1],
+                                        '\nUsage:',
+                                        '  %s [option|cfgfile] ...\n' % Script.scriptName ] ) )
+
+if __name__=="__main__":
+  clip = Params()
+  clip.registerSwitch()
+  Script.parseCommandLine()
+  from ILCDIRAC.Core.Utilities.ProcessList                      import ProcessList
+  from DIRAC.TransformationSystem.Client.TransformationClient   import TransformationClient
+  from DIRAC import gConfig, gLogger
+  prod = clip.prod
+  full_detail = clip.full_det
+  
+  processlist = gConfig.getValue('/LocalSite/ProcessListPath')
+  prl = ProcessList(processlist)
+  processesdict = prl.getProcessesDict()
+  
+  trc = TransformationClient()
+  prodids = []
+  if not prod:
+   conddict = {}
+   conddict['Status'] = clip.statuses
+   if clip.ptypes:
+     conddict['Type'] = clip.ptypes
+   res = trc.getTransformations( conddict )
+   if res['OK']:
+     for transfs in res['Value']:
+       prodids.append(transfs['TransformationID'])
+  else:
+    prodids.extend(prod)
+  prodids = [prodID for prodID in prodids if prodID >= clip.minprod]
+
+  gLogger.info("Will run on prods %s" % str(prodids))
+  
+  cache = loadCache(clip.cachefile)
+  metadata = getSummaries(prodids, full_detail, processesdict, cache, clip.nbthreads)
+  saveCache(clip.cachefile, cache)
+
+  writeTables(metadata, "tables.html")
   gLogger.notice("Check ./tables.html in any browser for the results")
   dexit(0)
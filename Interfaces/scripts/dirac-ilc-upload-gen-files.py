@@ -27,6 +27,8 @@ class Params(object):
     self.software = ''
     self.fmeta = {}
     self.force = False
+    self.nbthreads = 4
+    self.manifest = ''
     
   def setDir(self, opt):
     self.dir = opt
@@ -124,6 +126,17 @@ class Params(object):
     self.force = True
     return S_OK()
   
+  def setNbThreads(self, opt):
+    try:
+      self.nbthreads = int(opt)
+    except ValueError:
+      return S_ERROR("Number of threads must be integer")
+    return S_OK()
+
+  def setManifest(self, opt):
+    self.manifest = opt
+    return S_OK()
+  
   def registerSwitches(self):
     Script.registerSwitch('P:', 'Path=', 'Path where the file(s) are (directory or single file)', self.setDir)
     Script.registerSwitch('S:', "SE=", 'Storage element(s) to use ex: DESY-SRM', self.setSE)
@@ -143,6 +156,10 @@ class Params(object):
     Script.registerSwitch('', 'XSectionError=', 'Cross section error in fb', self.setXSecE )
     Script.registerSwitch('', 'Software=', "Software and version, e.g. %s"%self.software, self.setSoftware)
     Script.registerSwitch('f', 'force', "Do not stop for confirmation", self.setForce)
+    Script.registerSwitch('j:', 'threads=', "Number of parallel uploads, default %s" % self.nbthreads, 
+                          self.setNbThreads)
+    Script.registerSwitch('', 'manifest=', "File recording what was uploaded, to resume an interrupted upload, "
+                          "default upload_<final file name>.manifest", self.setManifest)
     Script.setUsageMessage('\n%s -P /some/path/ -E 1000 -M B1b_ws -I 35945 etc.\n' % Script.scriptName)  
   
 if __name__ == '__main__':
@@ -220,7 +237,6 @@ if __name__ == '__main__':
       dexit(0)    
 
   
-  from DIRAC.DataManagementSystem.Client.ReplicaManager import ReplicaManager
   from DIRAC.Resources.Catalog.FileCatalogClient import FileCatalogClient
   fc = FileCatalogClient()
   
@@ -234,26 +250,43 @@ if __name__ == '__main__':
     if not res['OK']:
       gLogger.error("Failed to set meta data %s to %s" %(pathdict['meta'], pathdict['path']))
 
-  rm = ReplicaManager()
+  lfns = {}
   for f in flist:
     fnum = f.split(".")[-2]
     fext = f.split(".")[-1]
     final_fname = final_fname_base + '.' + fnum + "." + fext
-    gLogger.notice("Uploading %s to" % f, finalpath+"/"+final_fname)
-    if not clip.force:
-      res = promptUser('Continue?', ['y','n'], 'n')
-      if not res['OK']:
-        gLogger.error(res['Message'])
-        break
-      if not res['Value'].lower()=='y':
-        break    
-
-    res = rm.putAndRegister(finalpath+"/"+final_fname, f, clip.se)
-    if not res['OK']:
-      gLogger.error("Failed to upload %s:" % f, res['Message'])
-      continue
-    res = fc.setMetadata(finalpath+"/"+final_fname, clip.fmeta)
+    lfns[finalpath+"/"+final_fname] = f
+  
+  from ILCDIRAC.Core.Utilities.UploadManifest import UploadManifest, getFilesToUpload, uploadFiles
+  manifest = UploadManifest(clip.manifest or "upload_%s.manifest" % final_fname_base)
+  toupload = getFilesToUpload(lfns, manifest, fc)
+  gLogger.notice("%s file(s) already uploaded, %s to upload with %s threads" % (len(lfns) - len(toupload), 
+                                                                                len(toupload), clip.nbthreads))
+  if not clip.force and toupload:
+    res = promptUser('Continue?', ['y','n'], 'n')
     if not res['OK']:
-      gLogger.error("Failed setting the metadata to %s:" % f, res['Message'])
-      
+      gLogger.error(res['Message'])
+      dexit(1)
+    if not res['Value'].lower()=='y':
+      dexit(0)    
+  uploadFiles(toupload, clip.se, manifest, clip.nbthreads)
+
+  ##Now all the meta data in one go
+  from ILCDIRAC.Core.Utilities.RegisterMetadata import registerMetadata
+  toregister = dict([(lfn, clip.fmeta) for lfn in lfns.keys() if manifest.getState(lfn) == 'Uploaded'])
+  res = registerMetadata(fc, toregister)
+  if not res['OK']:
+    gLogger.error("Failed setting the metadata:", res['Message'])
+    dexit(1)
+  for lfn in res['Value']['Successful']:
+    manifest.setState(lfn, 'Registered')
+  for lfn, message in res['Value']['Failed'].items():
+    gLogger.error("Failed setting the metadata to %s:" % lfns[lfn], message)
+  manifest.close()
+  
+  done = len([lfn for lfn in lfns.keys() if manifest.getState(lfn) == 'Registered'])
+  gLogger.notice("%s file(s) out of %s uploaded and registered" % (done, len(lfns)))
+  if done < len(lfns):
+    gLogger.notice("Run the same command again to retry the others")
+    dexit(1)
   dexit(0)
\ No newline at end of file
@@ -23,7 +23,15 @@ class OverlayDB ( DB ):
                                                        },
                                              'PrimaryKey' : 'Site',
                                              'Indexes': {'Index':['Site']}
-                                           }
+                                           },
+                          "OverlayLeases" : { 'Fields' : { 'LeaseID' : "INTEGER NOT NULL AUTO_INCREMENT",
+                                                           'Site' : "VARCHAR(256) NOT NULL",
+                                                           'JobID' : "INTEGER DEFAULT 0",
+                                                           'Expiration' : "DATETIME NOT NULL"
+                                                         },
+                                              'PrimaryKey' : 'LeaseID',
+                                              'Indexes': {'SiteIndex':['Site'], 'ExpirationIndex':['Expiration']}
+                                            }
                         }
                       )
     limits = self.ops.getValue("/Overlay/MaxConcurrentRunning", 200)
@@ -37,6 +45,11 @@ class OverlayDB ( DB ):
       res = self.ops.getValue("/Overlay/Sites/%s/MaxConcurrentRunning" % tempsite, 200)
       self.limits[tempsite] = res
     self.logger.info("Using the following restrictions : %s" % self.limits)
+    self.leaseDuration = {}
+    self.leaseDuration["default"] = self.ops.getValue("/Overlay/LeaseDuration", 10800)
+    for tempsite in sites:
+      self.leaseDuration[tempsite] = self.ops.getValue("/Overlay/Sites/%s/LeaseDuration" % tempsite, 
+                                                       self.leaseDuration["default"])
 
   #####################################################################
   # Private methods
@@ -65,10 +78,10 @@ class OverlayDB ( DB ):
       return S_ERROR("Could not find any site %s"%(site))
     
   def _addSite(self, site, connection = False ):
-    """ Add a new site to the DB
+    """ Add a new site to the DB, does nothing if the site is already known
     """ 
     connection = self.__getConnection( connection )
-    req = "INSERT INTO OverlayData (Site,NumberOfJobs) VALUES ('%s',1);" % site
+    req = "INSERT IGNORE INTO OverlayData (Site,NumberOfJobs) VALUES ('%s',0);" % site
     res = self._update( req, connection )
     if not res['OK']:
       return res
@@ -81,14 +94,84 @@ class OverlayDB ( DB ):
       return self.limits[site]   
     return self.limits['default']
 
-  def _addNewJob(self, site, nbjobs, connection = False ):
-    """ Add a new running job in the DB
+  def _leaseDurationForSite(self, site):
+    """ Get the lease duration (in seconds) for a given site.
+    """
+    if site in self.leaseDuration.keys():
+      return self.leaseDuration[site]
+    return self.leaseDuration['default']
+
+  def _takeSlot(self, site, connection = False ):
+    """ Atomically increment the number of jobs at the site if the limit is not reached.
+    Returns S_OK(True) if a slot was taken.
     """
     connection = self.__getConnection( connection )
-    nbjobs += 1  
-    req = "UPDATE OverlayData SET NumberOfJobs=%s WHERE Site='%s';" % (nbjobs, site)
-    self._update( req, connection )
-    return S_OK()
+    req = "UPDATE OverlayData SET NumberOfJobs=NumberOfJobs+1 WHERE Site='%s' AND NumberOfJobs<%s;" % (site, 
+                                                                                                    int(self._limitForSite(site)))
+    res = self._update( req, connection )
+    if not res['OK']:
+      return res
+    return S_OK(res['Value'] == 1)
+
+  def _freeSlot(self, site, connection = False ):
+    """ Atomically decrement the number of jobs at the site
+    """
+    connection = self.__getConnection( connection )
+    req = "UPDATE OverlayData SET NumberOfJobs=NumberOfJobs-1 WHERE Site='%s' AND NumberOfJobs>0;" % (site)
+    return self._update( req, connection )
+
+  def _addLease(self, site, jobid, connection = False ):
+    """ Register a new lease for the site, valid for the site lease duration.
+    Returns the LeaseID.
+    """
+    connection = self.__getConnection( connection )
+    req = "INSERT INTO OverlayLeases (Site,JobID,Expiration) VALUES ('%s',%s,DATE_ADD(UTC_TIMESTAMP(), INTERVAL %s SECOND));" % (site, int(jobid), int(self._leaseDurationForSite(site)))
+    res = self._update( req, connection )
+    if not res['OK']:
+      return res
+    if not res.has_key('lastRowId'):
+      return S_ERROR("Could not obtain the lease ID")
+    return S_OK(res['lastRowId'])
+
+  def _releaseLease(self, site, leaseid, connection = False ):
+    """ Delete the lease and give back its slot. The DELETE is what guarantees that a slot
+    is only given back once, even if the lease is released and reclaimed concurrently.
+    """
+    connection = self.__getConnection( connection )
+    req = "DELETE FROM OverlayLeases WHERE LeaseID=%s AND Site='%s';" % (int(leaseid), site)
+    res = self._update( req, connection )
+    if not res['OK']:
+      return res
+    if not res['Value']:
+      return S_OK(False)
+    res = self._freeSlot(site, connection)
+    if not res['OK']:
+      return res
+    return S_OK(True)
+
+  def _getExpiredLeases(self, site = None, connection = False ):
+    """ Get the list of (LeaseID, Site) of the expired leases, for a given site or for all of them
+    """
+    connection = self.__getConnection( connection )
+    req = "SELECT LeaseID,Site FROM OverlayLeases WHERE Expiration<UTC_TIMESTAMP()"
+    if site:
+      req += " AND Site='%s'" % site
+    req += ";"
+    res = self._query( req, connection )
+    if not res['OK']:
+      return res
+    return S_OK([(row[0], row[1]) for row in res['Value']])
+
+  def _countLeases(self, site = None, connection = False ):
+    """ Set the number of jobs of the site (or of all sites) to the number of leases it has: 
+    fixes the counters left wrong by a crash, or inherited from before the leases existed
+    """
+    connection = self.__getConnection( connection )
+    req = "UPDATE OverlayData SET NumberOfJobs=(SELECT COUNT(*) FROM OverlayLeases WHERE OverlayLeases.Site=OverlayData.Site)"
+    if site:
+      req += " WHERE Site='%s'" % site
+    req += ";"
+    return self._update( req, connection )
 
 ### Methods to fix the site
   def getSites(self, connection = False):
@@ -130,40 +213,67 @@ class OverlayDB ( DB ):
 
 ### Important methods
   
-  def canRun(self, site, connection = False ):
-    """ Can the job run at that site?
+  def reclaimExpiredLeases(self, site = None, connection = False ):
+    """ Release the leases that have expired: the jobs holding them did not call jobDone in time,
+    so their slots are given back. The number of jobs is then made equal to the number of leases.
+    Returns the number of leases reclaimed per site.
     """
     connection = self.__getConnection( connection )
-    res = self._checkSite(site, connection)
-    nbjobs = 0
+    res = self._getExpiredLeases(site, connection)
     if not res['OK']:
-      self._addSite(site, connection)
-      nbjobs = 1
-    else:
-      nbjobs = res['Value'][0][0]
-    if nbjobs < self._limitForSite(site):
-      res = self._addNewJob(site, nbjobs, connection)
+      return res
+    reclaimed = {}
+    for leaseid, leasesite in res['Value']:
+      res = self._releaseLease(leasesite, leaseid, connection)
+      if not res['OK']:
+        self.logger.error("Could not reclaim lease %s at %s" % (leaseid, leasesite), res['Message'])
+        continue
+      if res['Value']:
+        reclaimed[leasesite] = reclaimed.get(leasesite, 0) + 1
+    if reclaimed:
+      self.logger.info("Reclaimed expired leases: %s" % reclaimed)
+    res = self._countLeases(site, connection)
+    if not res['OK']:
+      self.logger.error("Could not count the leases:", res['Message'])
+    return S_OK(reclaimed)
+
+  def canRun(self, site, jobid = 0, connection = False ):
+    """ Can the job run at that site? If so, a lease is granted and its ID is returned, 
+    otherwise returns S_OK(False). The lease must be given back with L{jobDone}, or it expires.
+    """
+    connection = self.__getConnection( connection )
+    res = self.reclaimExpiredLeases(site, connection)
+    if not res['OK']:
+      self.logger.warn("Failed to reclaim expired leases", res['Message'])
+    res = self._addSite(site, connection)
+    if not res['OK']:
+      return res
+    ##The lease is there before the slot is taken: if anything fails in between, the site has more leases
+    ##than jobs, which only delays the other jobs until the leases are counted again
+    res = self._addLease(site, jobid, connection)
+    if not res['OK']:
+      return res
+    leaseid = res['Value']
+    res = self._takeSlot(site, connection)
+    if not res['OK'] or not res['Value']:
+      req = "DELETE FROM OverlayLeases WHERE LeaseID=%s;" % int(leaseid)
+      resdel = self._update( req, connection )
+      if not resdel['OK']:
+        self.logger.error("Could not remove lease %s, it will expire:" % leaseid, resdel['Message'])
       if not res['OK']:
         return res
-      return S_OK(True)
-    else:
       return S_OK(False)
+    return S_OK(leaseid)
   
-  def jobDone(self, site, connection = False ):
-    """ Remove a job from the DB, should not remove a job from the DB 
-        if the Site does not exist, but this should never happen
+  def jobDone(self, site, leaseid = 0, connection = False ):
+    """ Give back the lease obtained from L{canRun}. Without lease ID (old clients), nothing is done:
+    there is no way to know which lease is the job's, it will expire.
     """
+    if not leaseid:
+      self.logger.verbose("jobDone called without lease at %s, the lease will expire" % site)
+      return S_OK()
     connection = self.__getConnection( connection )
-    res = self._checkSite(site, connection)
+    res = self._releaseLease(site, leaseid, connection)
     if not res['OK']:
       return res
-    nbjobs = res['Value'][0][0]
-    if nbjobs == 1:
-      return S_OK()
-    nbjobs -= 1
-    req = "UPDATE OverlayData SET NumberOfJobs=%s WHERE Site='%s';" % (nbjobs, site)
-    res = self._update( req, connection )
-    if not res['OK']:
-      return res   
-    return S_OK()    
-  
\ No newline at end of file
+    return S_OK()
@@ -6,55 +6,309 @@
 """
 __RCSID__ = " $Id: $ "
 
-from DIRAC                                              import S_OK
+from DIRAC                                              import S_OK, S_ERROR, gLogger, gConfig
 from DIRAC.Core.DISET.RequestHandler                    import RequestHandler
+from DIRAC.Resources.Catalog.FileCatalogClient          import FileCatalogClient
 
 from ILCDIRAC.OverlaySystem.DB.OverlayDB                import OverlayDB
-from types import StringTypes, DictType
+from types import StringTypes, DictType, IntType, LongType
+import threading, time, zlib, random, os
 
 
 # This is a global instance of the OverlayDB class
 overlayDB = False
 
+# FIFO queues of tickets per site, protected by queueCondition, which is also
+# used to wake up the waiting jobs when a slot is given back. The queues are in the memory of
+# the service process: with several instances of the service, each one has its own queues, and
+# the order is only kept between the jobs using the same instance (the site limits are still
+# enforced by the DB)
+queueCondition = threading.Condition()
+siteQueues = {}
+tickets = {}
+ticketCounter = [0]
+serviceStart = int(time.time())
+
+# Maximum time a waitForSlot call is kept open, must be shorter than the client timeout
+maxWaitTime = 50
+# Interval at which the waiting calls recheck the DB, to catch the expired leases
+recheckInterval = 10
+# A ticket that was not polled for that long is considered abandoned
+ticketLifeTime = 600
+# Same for the ticket at the head of a queue, which blocks all the others: a live job polls again
+# at most a RecheckInterval after its previous call, default is MaxWaitTime + RecheckInterval
+headLifeTime = 0
+# Each waiting call holds a service thread: above that many, the calls return at once, and the
+# jobs are told to come back later, so that there are always threads left for jobDone
+maxWaiters = 0
+waiters = [0]
+
+# Index of the overlay files, per metadata query: the LFNs are kept compressed, with the number
+# of events per directory. Rebuilt from the catalog when older than indexLifeTime, by one thread
+# per query (indexLocks), while the others keep using the old one
+fileIndex = {}
+indexLocks = {}
+indexLock = threading.Lock()
+indexLifeTime = 21600
+
 def initializeOverlayHandler( serviceInfo ):
   """ Global initialize for the Overlay service handler
   """
-  global overlayDB
+  global overlayDB, maxWaitTime, recheckInterval, ticketLifeTime, indexLifeTime, maxWaiters, headLifeTime
   overlayDB = OverlayDB()
+  cfgPath = serviceInfo['serviceSectionPath']
+  maxWaitTime = gConfig.getValue( "%s/MaxWaitTime" % cfgPath, maxWaitTime )
+  recheckInterval = gConfig.getValue( "%s/RecheckInterval" % cfgPath, recheckInterval )
+  ticketLifeTime = gConfig.getValue( "%s/TicketLifeTime" % cfgPath, ticketLifeTime )
+  headLifeTime = gConfig.getValue( "%s/HeadLifeTime" % cfgPath, maxWaitTime + recheckInterval )
+  indexLifeTime = gConfig.getValue( "%s/IndexLifeTime" % cfgPath, indexLifeTime )
+  maxWaiters = gConfig.getValue( "%s/MaxWaiters" % cfgPath, 
+                                 max( 1, gConfig.getValue( "%s/MaxThreads" % cfgPath, 15 ) / 2 ) )
   return S_OK()
 
+def _purgeTickets( site ):
+  """ Remove the abandoned tickets from the site queue. Must be called with queueCondition held.
+  """
+  now = time.time()
+  queue = siteQueues.get( site, [] )
+  for ticket in list( queue ):
+    lifetime = ticketLifeTime
+    ##A dead job at the head would block the queue, the next one must be allowed to try soon
+    if ticket == queue[0]:
+      lifetime = min( headLifeTime or ticketLifeTime, ticketLifeTime )
+    if now - tickets[ticket]['LastSeen'] > lifetime and not tickets[ticket].get( 'Checking' ):
+      gLogger.info( "Dropping abandoned ticket %s at %s" % ( ticket, site ) )
+      queue.remove( ticket )
+      del tickets[ticket]
+
+def _buildIndex( meta, defaultnbevts ):
+  """ Get from the catalog the files matching the meta data, and the number of events in each directory
+  """
+  fc = FileCatalogClient()
+  res = fc.findFilesByMetadata( meta )
+  if not res['OK']:
+    return res
+  lfns = res['Value']
+  nbevts = {}
+  for directory in set( [os.path.dirname( lfn ) for lfn in lfns] ):
+    nbevts[directory] = defaultnbevts
+    res = fc.getDirectoryMetadata( directory )
+    if res['OK'] and res['Value'].has_key( 'NumberOfEvents' ):
+      nbevts[directory] = int( res['Value']['NumberOfEvents'] )
+  gLogger.info( "Indexed %s files in %s directories for %s" % ( len( lfns ), len( nbevts ), meta ) )
+  return S_OK( { 'Time' : time.time(), 'LFNs' : zlib.compress( "\n".join( lfns ) ),
+                 'NbFiles' : len( lfns ), 'NbEvts' : nbevts } )
+
+def _getIndexLock( key ):
+  """ The lock of the index of a query, created if needed
+  """
+  indexLock.acquire()
+  try:
+    if not indexLocks.has_key( key ):
+      indexLocks[key] = threading.Lock()
+    return indexLocks[key]
+  finally:
+    indexLock.release()
+
+def _getIndex( meta, defaultnbevts ):
+  """ Get the index for the meta data query, rebuilding it if too old
+  """
+  key = str( sorted( meta.items() ) )
+  entry = fileIndex.get( key )
+  if entry and time.time() - entry['Time'] < indexLifeTime:
+    return S_OK( entry )
+  ##Only one thread scans the catalog, the others use the old index meanwhile, or wait if there is none
+  lock = _getIndexLock( key )
+  if not lock.acquire( not entry ):
+    return S_OK( entry )
+  try:
+    entry = fileIndex.get( key )
+    if entry and time.time() - entry['Time'] < indexLifeTime:
+      return S_OK( entry )
+    res = _buildIndex( meta, defaultnbevts )
+    if not res['OK']:
+      ##Better use an old index than nothing
+      if entry:
+        gLogger.warn( "Could not refresh the index, using the old one", res['Message'] )
+        return S_OK( entry )
+      return res
+    fileIndex[key] = res['Value']
+  finally:
+    lock.release()
+  return S_OK( fileIndex[key] )
+
 class OverlayHandler(RequestHandler):
   """ Service for Overlay
   """
   types_canRun = [StringTypes]
-  def export_canRun(self, site):
-    """ Check if current job can access the data
+  def export_canRun(self, site, jobid = 0):
+    """ Check if current job can access the data. Returns the lease ID if it can, False otherwise.
+    Kept for the jobs not using the queue: they do not get a slot while others wait in the queue of the site.
     """
-    return overlayDB.canRun(site)
+    queueCondition.acquire()
+    try:
+      _purgeTickets( site )
+      queued = len( siteQueues.get( site, [] ) )
+    finally:
+      queueCondition.release()
+    if queued:
+      return S_OK( False )
+    return overlayDB.canRun(site, jobid)
 
   types_jobDone = [StringTypes]
-  def export_jobDone(self, site):
-    """ report that a given job is done downloading the 
-    files at a given site
+  def export_jobDone(self, site, leaseid = 0):
+    """ report that a given job is done downloading the
+    files at a given site: give back the lease
     """
-    return overlayDB.jobDone(site)
-  
+    res = overlayDB.jobDone(site, leaseid)
+    queueCondition.acquire()
+    try:
+      queueCondition.notifyAll()
+    finally:
+      queueCondition.release()
+    return res
+
+  types_enqueue = [StringTypes]
+  def export_enqueue(self, site, jobid = 0):
+    """ Put the job in the FIFO queue of the site. Returns the ticket to use in L{export_waitForSlot}
+    """
+    queueCondition.acquire()
+    try:
+      ticketCounter[0] += 1
+      ticket = "%s.%s" % ( serviceStart, ticketCounter[0] )
+      tickets[ticket] = { 'Site' : site, 'JobID' : jobid, 'LastSeen' : time.time() }
+      siteQueues.setdefault( site, [] ).append( ticket )
+      position = len( siteQueues[site] ) - 1
+    finally:
+      queueCondition.release()
+    return S_OK( { 'Ticket' : ticket, 'Position' : position } )
+
+  types_waitForSlot = [StringTypes]
+  def export_waitForSlot(self, ticket, waittime = 0):
+    """ Wait (at most waittime seconds, bounded by the service MaxWaitTime) until the ticket is
+    at the head of its site queue and a slot is free. Returns a dictionary with the LeaseID
+    (0 if none could be obtained yet) and the Position of the ticket in the queue.
+    """
+    if not waittime or waittime > maxWaitTime:
+      waittime = maxWaitTime
+    deadline = time.time() + waittime
+    queueCondition.acquire()
+    waiting = waiters[0] < maxWaiters
+    if waiting:
+      waiters[0] += 1
+    else:
+      deadline = time.time()
+    try:
+      while True:
+        if not tickets.has_key( ticket ):
+          return S_ERROR( "Unknown ticket %s" % ticket )
+        tickets[ticket]['LastSeen'] = time.time()
+        site = tickets[ticket]['Site']
+        _purgeTickets( site )
+        position = siteQueues[site].index( ticket )
+        if not position and not tickets[ticket].get( 'Checking' ):
+          tickets[ticket]['Checking'] = True
+          jobid = tickets[ticket]['JobID']
+          ##The DB is asked without holding the condition, so that the other calls do not wait for it
+          queueCondition.release()
+          try:
+            res = overlayDB.canRun( site, jobid )
+          finally:
+            queueCondition.acquire()
+          if tickets.has_key( ticket ):
+            tickets[ticket]['Checking'] = False
+          if not res['OK']:
+            return res
+          if res['Value']:
+            if tickets.has_key( ticket ):
+              siteQueues[site].remove( ticket )
+              del tickets[ticket]
+            ##Let the next in line try
+            queueCondition.notifyAll()
+            return S_OK( { 'LeaseID' : res['Value'], 'Position' : 0 } )
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          result = { 'LeaseID' : 0, 'Position' : position }
+          if not waiting:
+            result['RetryAfter'] = recheckInterval
+          return S_OK( result )
+        queueCondition.wait( min( remaining, recheckInterval ) )
+    finally:
+      if waiting:
+        waiters[0] -= 1
+      queueCondition.release()
+
+  types_dequeue = [StringTypes]
+  def export_dequeue(self, ticket):
+    """ Remove the ticket from its queue, when the job gives up waiting
+    """
+    queueCondition.acquire()
+    try:
+      if tickets.has_key( ticket ):
+        siteQueues[tickets[ticket]['Site']].remove( ticket )
+        del tickets[ticket]
+        queueCondition.notifyAll()
+    finally:
+      queueCondition.release()
+    return S_OK()
+
+  types_getQueueLength = [StringTypes]
+  def export_getQueueLength(self, site):
+    """ Get the number of jobs waiting in the queue of a given site
+    """
+    queueCondition.acquire()
+    try:
+      _purgeTickets( site )
+      length = len( siteQueues.get( site, [] ) )
+    finally:
+      queueCondition.release()
+    return S_OK( length )
+
+  types_getRandomFiles = [DictType, [IntType, LongType]]
+  def export_getRandomFiles(self, meta, nbfiles, defaultnbevts = 100):
+    """ Get a random sample of nbfiles files among the ones matching the meta data. Returns
+    a dictionary with the sampled LFNs, the number of events in each, and the total number of files.
+    """
+    res = _getIndex( meta, defaultnbevts )
+    if not res['OK']:
+      return res
+    entry = res['Value']
+    lfns = zlib.decompress( entry['LFNs'] ).split( "\n" ) if entry['NbFiles'] else []
+    sample = random.sample( lfns, min( nbfiles, len( lfns ) ) )
+    nbevts = {}
+    for lfn in sample:
+      nbevts[lfn] = entry['NbEvts'].get( os.path.dirname( lfn ), defaultnbevts )
+    return S_OK( { 'LFNs' : sample, 'NbEvts' : nbevts, 'TotalFiles' : entry['NbFiles'] } )
+
   types_getJobsAtSite =  [StringTypes]
   def export_getJobsAtSite(self, site):
     """ Get the jobs running at a given site
     """
     return overlayDB.getJobsAtSite(site)
-  
+
   types_getSites = []
   def export_getSites(self):
     """ Get all sites registered
     """
     return overlayDB.getSites()
-  
+
   types_setJobsAtSites = [ DictType ]
   def export_setJobsAtSites(self, sitedict):
-    """ Set the number of jobs running at each site: 
+    """ Set the number of jobs running at each site:
     called from the ResetCounter agent
     """
     return overlayDB.setJobsAtSites(sitedict)
-  
\ No newline at end of file
+
+  types_reclaimExpiredLeases = []
+  def export_reclaimExpiredLeases(self):
+    """ Give back the slots of the jobs that did not call jobDone before their lease expired:
+    called from the ResetCounter agent
+    """
+    res = overlayDB.reclaimExpiredLeases()
+    if res['OK'] and res['Value']:
+      queueCondition.acquire()
+      try:
+        queueCondition.notifyAll()
+      finally:
+        queueCondition.release()
+    return res
@@ -16,6 +16,8 @@ from ILCDIRAC.ProcessProductionSystem.Utilities.SoftwareInstall           import
 from ILCDIRAC.Interfaces.API.NewInterface.UserJob import UserJob
 from ILCDIRAC.Interfaces.API.DiracILC import DiracILC
 
+import threading, Queue
+
 
 AGENT_NAME = 'ProcessProduction/SoftwareManagementAgent'
 
@@ -45,73 +47,127 @@ class SoftwareManagementAgent( AgentModule ):
     ownerGroup = proxyInfo['group']
     self.log.info("submitTasks: Jobs will be submitted with the credentials %s:%s" % (owner, ownerGroup))    
     
-    sites = self.diracadmin.getSiteMask()['Value']
-    for site in sites:
-      res = self.ppc.changeSiteStatus( {'SiteName' : site, 'Status' : 'OK'} )
-      if not res['OK']:
-        self.log.error('Cannot add or update site %s' % site)
-        
-    banned_sites = self.diracadmin.getBannedSites()['Value']
-    for banned_site in banned_sites:
-      self.ppc.changeSiteStatus( {'SiteName' : banned_site, 'Status' : 'Banned'} )
-      if not res['OK']:
-        self.log.error('Cannot mark as banned site %s' % banned_site)
+    sitesdict = {}
+    for site in self.diracadmin.getSiteMask()['Value']:
+      sitesdict[site] = 'OK'
+    for banned_site in self.diracadmin.getBannedSites()['Value']:
+      sitesdict[banned_site] = 'Banned'
+    res = self.ppc.changeSitesStatus( sitesdict )
+    if not res['OK']:
+      self.log.error('Cannot update the sites status:', res['Message'])
         
     ##Then we need to get new installation tasks
     res = self.ppc.getInstallSoftwareTask()
     if not res['OK']:
       self.log.error('Failed to obtain task')
     task_dict = res['Value']
+    tasks = []
     for softdict in task_dict.values():
       self.log.info('Will install %s %s at %s' % (softdict['AppName'], softdict['AppVersion'], softdict['Sites']))
       for site in softdict['Sites']:
-        j = UserJob()
-        j.setSystemConfig(softdict['Platform'])
-        j.dontPromptMe()
-        j.setDestination(site)
-        j.setJobGroup("Installation")
-        j.setName('install_%s' % site)
-        j._addSoftware(softdict['AppName'], softdict['AppVersion'])
-        #Add the application here somehow.
-        res  = j.append(SoftwareInstall())
-        if not res['OK']:
-          self.log.error(res['Message'])
-          continue
-        res = j.submit(self.dirac)
-        #res = self.dirac.submit(j)
-        if not res['OK']:
-          self.log.error('Could not create the job')
-          continue
-        jobdict = {}
-        jobdict['AppName'] = softdict['AppName']
-        jobdict['AppVersion'] = softdict['AppVersion']
-        jobdict['Platform'] = softdict['Platform']
-        jobdict['JobID'] = res['Value']
-        jobdict['Status'] = 'Waiting'
-        jobdict['Site'] = site
-        res = self.ppc.addOrUpdateJob(jobdict)
-        if not res['OK']:
-          self.log.error('Could not add job %s: %s' % (jobdict['JobID'], res['Message']))
+        tasks.append((softdict, site))
+    submitted = self.submitInstallationJobs(tasks)
+    if submitted:
+      res = self.ppc.addOrUpdateJobs(submitted)
+      if not res['OK']:
+        self.log.error('Could not add the jobs:', res['Message'])
+      else:
+        for jobid, message in res['Value']['Failed'].items():
+          self.log.error('Could not add job %s: %s' % (jobid, message))
     
     ##Monitor jobs
-    jobs = {}
+    jobs = []
     res = self.ppc.getJobs()
     if not res['OK']:
       self.log.error('Could not retrieve jobs')
     else:
       jobs = res['Value']
-      for job in jobs:
-        res = self.dirac.status(job['JobID'])
-        if res['OK']:
-          jobstatuses = res['Value'] 
-          job['Status'] = jobstatuses['JobID']['Status']
-          res = self.ppc.addOrUpdateJob(job)
-          if not res['OK']:
-            self.log.error("Failed to updated job %s: %s" % (job['JobID'], res['Message']))
+    if jobs:
+      res = self.dirac.status([job['JobID'] for job in jobs])
+      if not res['OK']:
+        self.log.error("Failed to get the jobs status:", res['Message'])
+      else:
+        jobstatuses = res['Value']
+        for job in jobs:
+          if not jobstatuses.has_key(job['JobID']):
+            self.log.error("Failed to update job %s status" % job['JobID'])
+            continue
+          job['Status'] = jobstatuses[job['JobID']]['Status']
+        res = self.ppc.addOrUpdateJobs([job for job in jobs if job.has_key('Status')])
+        if not res['OK']:
+          self.log.error("Failed to update the jobs:", res['Message'])
         else:
-          self.log.error("Failed to update job %s status" % job['JobID'])
+          for jobid, message in res['Value']['Failed'].items():
+            self.log.error("Failed to updated job %s: %s" % (jobid, message))
           
     return S_OK()
   
+  def submitInstallationJobs(self, tasks):
+    """ Submit one installation job per (software dict, site) task, using a pool of
+    MaxSubmissionThreads threads. Returns the list of job dictionaries to register.
+    """
+    nbthreads = max(1, min(self.am_getOption('MaxSubmissionThreads', 4), len(tasks)))
+    toSubmit = Queue.Queue()
+    for task in tasks:
+      toSubmit.put(task)
+    submitted = []
+    lock = threading.Lock()
+
+    def worker():
+      """ Submit jobs until there is nothing left
+      """
+      while True:
+        try:
+          softdict, site = toSubmit.get_nowait()
+        except Queue.Empty:
+          return
+        try:
+          res = self.submitInstallationJob(softdict, site)
+        except Exception:
+          self.log.exception('Failed to submit installation job')
+          continue
+        if not res['OK']:
+          self.log.error('Could not create the job', res['Message'])
+          continue
+        lock.acquire()
+        submitted.append(res['Value'])
+        lock.release()
+
+    threads = []
+    for dummy in range(nbthreads):
+      thread = threading.Thread(target = worker)
+      thread.setDaemon(True)
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+    return submitted
+
+  def submitInstallationJob(self, softdict, site):
+    """ Submit the job installing the software at the site, returns the job dictionary
+    """
+    j = UserJob()
+    j.setSystemConfig(softdict['Platform'])
+    j.dontPromptMe()
+    j.setDestination(site)
+    j.setJobGroup("Installation")
+    j.setName('install_%s' % site)
+    j._addSoftware(softdict['AppName'], softdict['AppVersion'])
+    #Add the application here somehow.
+    res  = j.append(SoftwareInstall())
+    if not res['OK']:
+      return res
+    res = j.submit(self.dirac)
+    #res = self.dirac.submit(j)
+    if not res['OK']:
+      return res
+    jobdict = {}
+    jobdict['AppName'] = softdict['AppName']
+    jobdict['AppVersion'] = softdict['AppVersion']
+    jobdict['Platform'] = softdict['Platform']
+    jobdict['JobID'] = res['Value']
+    jobdict['Status'] = 'Waiting'
+    jobdict['Site'] = site
+    return S_OK(jobdict)
+  
   
-  
\ No newline at end of file
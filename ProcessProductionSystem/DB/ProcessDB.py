@@ -8,7 +8,7 @@ __RCSID__ = " $Id: $ "
 
 from DIRAC                                                             import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Base.DB                                                import DB
-from DIRAC.Core.Utilities.List                                         import intListToString
+from DIRAC.Core.Utilities.List                                         import intListToString, stringListToString
 
 class ProcessDB ( DB ):
   """ DB for the ProcessProductionSystem
@@ -249,25 +249,25 @@ class ProcessDB ( DB ):
     """ Return the list of softwares/version available, and valid
     """
     connection = self.__getConnection( connection )
-    req = "SELECT idSoftware,AppName,AppVersion,Comment FROM Software WHERE Valid = TRUE;"
+    ##Get the dependency in the same go
+    req = "SELECT Software.idSoftware,AppName,AppVersion,Comment,idDependency FROM Software \
+           LEFT JOIN DependencyRelation ON DependencyRelation.idSoftware = Software.idSoftware \
+           WHERE Valid = TRUE ORDER BY Software.idSoftware,idDependencyRelation;"
     res = self._query( req, connection )
     if not res['OK']:
       return res
     apps = {}
-    for idSoftware, AppName, AppVersion, Comment in res['Value']:
+    for idSoftware, AppName, AppVersion, Comment, idDependency in res['Value']:
+      if apps.has_key(idSoftware):
+        ##Only the first dependency is reported
+        continue
       app = {}
       app['Name'] = AppName
       app['Version'] = AppVersion
       app['Comment'] = Comment
-      ##Check for dependency
-      #req = "SELECT idDependency FROM DependencyRelation WHERE idSoftware=%s;"%(idSoftware)
-      #res = self._query( req, connection )
-      res = self._getFields('DependencyRelation', ['idDependency'], ['idSoftware'], [idSoftware], conn = connection )
       depid = 0
-      if not len(res['Value']):
-        depid = 0
-      else:
-        depid = res['Value'][0]
+      if idDependency is not None:
+        depid = (idDependency,)
       app['Dependency'] = depid
       apps[idSoftware] = app
       
@@ -390,25 +390,19 @@ class ProcessDB ( DB ):
     connection = self.__getConnection( connection )
     
     #now get what is already available at each site
-    req = "SELECT idSoftware,idSite FROM ApplicationStatusAtSite WHERE idSoftware IN (SELECT idSoftware FROM Software WHERE Valid=TRUE) \
-           AND idSite IN (SELECT idSite FROM Sites WHERE Status='OK') AND ApplicationStatusAtSite.Status='NotAvailable';"
+    req = "SELECT Software.idSoftware,AppName,AppVersion,Platform,SiteName FROM ApplicationStatusAtSite \
+           JOIN Software ON Software.idSoftware = ApplicationStatusAtSite.idSoftware \
+           JOIN Sites ON Sites.idSite = ApplicationStatusAtSite.idSite \
+           WHERE Software.Valid=TRUE AND Sites.Status='OK' AND ApplicationStatusAtSite.Status='NotAvailable';"
     res =  self._query( req, connection )
     if not res['OK']:
       return res
-    rows = res['Value']
     soft_dict = {}
-    for row in rows:
-      if not soft_dict.has_key(row[0]): 
-        soft_dict[row[0]] = {}
-        res  = self._getFields('Software', ['AppName', 'AppVersion', 'Platform'],
-                               ['idSoftware'], [row[0]], conn = connection)
-        soft_dict[row[0]]['AppName'], soft_dict[row[0]]['AppVersion'], soft_dict[row[0]]['Platform'] = res['Value'][0]
-      if not   soft_dict[row[0]].has_key('Sites'):
-        soft_dict[row[0]]['Sites'] = []
-      res =   self._getFields('Sites', ['SiteName'], ['idSite'], [row[1]], conn = connection )
-      if len(res['Value']):
-        sitename = res['Value'][0][0]
-        soft_dict[row[0]]['Sites'].append(sitename)    
+    for idSoftware, AppName, AppVersion, Platform, SiteName in res['Value']:
+      if not soft_dict.has_key(idSoftware): 
+        soft_dict[idSoftware] = {'AppName' : AppName, 'AppVersion' : AppVersion, 
+                                 'Platform' : Platform, 'Sites' : []}
+      soft_dict[idSoftware]['Sites'].append(SiteName)    
           
     return S_OK(soft_dict)
   
@@ -417,22 +411,22 @@ class ProcessDB ( DB ):
     """
     connection = self.__getConnection( connection )
   
-    res = self._getFields('SoftwareOperations', ['JobID', 'idSoftware', 'Site'], [], [], conn = connection)
-    rows = res['Value']
+    req = "SELECT JobID,AppName,AppVersion,Platform,SiteName FROM SoftwareOperations \
+           JOIN Software ON Software.idSoftware = SoftwareOperations.idSoftware \
+           JOIN Sites ON Sites.idSite = SoftwareOperations.idSite;"
+    res = self._query( req, connection )
+    if not res['OK']:
+      return res
 
     resjobs = []
-    
-    for row in rows:
+    for JobID, AppName, AppVersion, Platform, SiteName in res['Value']:
       jobdict = {}
-      jobdict['JobID'] = row[0]
-      res = self._getFields('Software', ['AppName', 'AppVersion', 'Platform'], ['idSoftware'], [row[1]], conn = connection)
-      jobdict['Site'] = row[2]
-      row = res['Value'][0]
-      if len(row):
-        jobdict['AppName'] = row[0]
-        jobdict['AppVersion'] = row[1]
-        jobdict['Platform'] = row[2]
-        resjobs.append(jobdict)
+      jobdict['JobID'] = JobID
+      jobdict['Site'] = SiteName
+      jobdict['AppName'] = AppName
+      jobdict['AppVersion'] = AppVersion
+      jobdict['Platform'] = Platform
+      resjobs.append(jobdict)
         
     return S_OK(resjobs)
   ##################################################################
@@ -577,7 +571,9 @@ class ProcessDB ( DB ):
       if len(res['Value']):
         softid = res['Value'][0][0]
     siteid = 0    
-    res = self._getFields('idSite', 'Sites', ['SiteName'], [jobdict['Site']], conn = connection)
+    res = self._getFields('Sites', ['idSite'], ['SiteName'], [jobdict['Site']], conn = connection)
+    if not res['OK']:
+      return res
     if len(res['Value']):
       siteid = res['Value'][0][0]    
     if not siteid or not softid:
@@ -784,6 +780,45 @@ class ProcessDB ( DB ):
       return res
     return S_OK()
   
+  def changeSitesStatus(self, sitesdict, connection = False ):
+    """ Mark several sites as banned or active in one go: sitesdict is {SiteName : Status}
+    """
+    connection = self.__getConnection( connection )
+    for site, status in sitesdict.items():
+      if not status in self.SiteStatuses:
+        return S_ERROR("Status %s of site %s is not a valid site status" % (status, site))
+    res = self._getFields('Sites', ['SiteName'], [], [], conn = connection)
+    if not res['OK']:
+      return res
+    knownsites = [row[0] for row in res['Value']]
+    for site in sitesdict.keys():
+      if not site in knownsites:
+        res = self.addSite(site, connection)
+        if not res['OK']:
+          return res
+    for status in set(sitesdict.values()):
+      sites = [site for site, sitestatus in sitesdict.items() if sitestatus == status]
+      query = 'UPDATE Sites SET Status="%s" WHERE SiteName IN (%s);' % (status, stringListToString(sites))
+      res = self._update(query, connection)
+      if not res['OK']:
+        return res
+    return S_OK()
+  
+  def addOrUpdateJobs(self, joblist, connection = False ):
+    """ Call L{addOrUpdateJob} for all the jobs of the list, returns the JobIDs that failed with the reason
+    """
+    connection = self.__getConnection( connection )
+    failed = {}
+    for jobdict in joblist:
+      ##One bad job must not prevent the others from being updated
+      try:
+        res = self.addOrUpdateJob(jobdict, connection)
+      except Exception, x:
+        res = S_ERROR("Exception while updating the job: %s" % str(x))
+      if not res['OK']:
+        failed[jobdict.get('JobID', 0)] = res['Message']
+    return S_OK({'Failed' : failed})
+
   def reportOK(self, jobdict, connection = False ):
     """ Report if application is OK to use or not at a given site
     """
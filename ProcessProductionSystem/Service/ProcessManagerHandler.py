@@ -6,21 +6,85 @@
 """
 __RCSID__ = " $Id: $ "
 
-from DIRAC                                              import S_OK, S_ERROR
+from DIRAC                                              import S_OK, S_ERROR, gConfig
 from DIRAC.Core.DISET.RequestHandler                    import RequestHandler
 from types import StringTypes, ListType, TupleType, LongType, IntType, DictType, BooleanType
 
 from ILCDIRAC.ProcessProductionSystem.DB.ProcessDB import ProcessDB
 
+import threading, time
+
 # This is a global instance of the ProcessDB class
 processDB = False
 
+class ReadCache(object):
+  """ Cache of the successful DB answers, emptied when the DB is modified through this service.
+  Entries also expire after some time, to see the changes done through other service instances.
+  """
+  def __init__(self, lifetime = 300):
+    self.lifetime = lifetime
+    self.entries = {}
+    self.hits = 0
+    self.misses = 0
+    self.generation = 0
+    self.lock = threading.Lock()
+
+  def get(self, key, method, *args):
+    """ Return the cached answer for key, or call method with args and cache the answer if OK
+    """
+    self.lock.acquire()
+    try:
+      if self.entries.has_key(key) and time.time() - self.entries[key][0] < self.lifetime:
+        self.hits += 1
+        return self.entries[key][1]
+      self.misses += 1
+      generation = self.generation
+    finally:
+      self.lock.release()
+    res = method(*args)
+    if res['OK']:
+      self.lock.acquire()
+      try:
+        ##Do not keep an answer obtained while the DB was being modified
+        if generation == self.generation:
+          self.entries[key] = (time.time(), res)
+      finally:
+        self.lock.release()
+    return res
+
+  def invalidate(self):
+    """ Forget everything
+    """
+    self.lock.acquire()
+    try:
+      self.entries = {}
+      self.generation += 1
+    finally:
+      self.lock.release()
+
+  def getStatistics(self):
+    """ Number of hits, misses and entries
+    """
+    return {'Hits' : self.hits, 'Misses' : self.misses, 'Entries' : len(self.entries)}
+
+softwareCache = ReadCache()
+processCache = ReadCache()
+
 def initializeProcessManagerHandler( serviceInfo ):
 
   global processDB
   processDB = ProcessDB()
+  lifetime = gConfig.getValue( "%s/CacheLifeTime" % serviceInfo['serviceSectionPath'], 300 )
+  softwareCache.lifetime = lifetime
+  processCache.lifetime = lifetime
   return S_OK()
 
+def invalidateCaches():
+  """ Called by all the methods that modify the DB
+  """
+  softwareCache.invalidate()
+  processCache.invalidate()
+
 class ProcessManagerHandler(RequestHandler):
 ######################################################################
 #               Get methods
@@ -35,7 +99,7 @@ class ProcessManagerHandler(RequestHandler):
   def export_getProcessInfo(self, ProcessName, Params ):
     """Get info for a given process
     """
-    return processDB.getProcessInfo(ProcessName, Params )
+    return processCache.get((ProcessName, tuple(Params)), processDB.getProcessInfo, ProcessName, list(Params) )
   
   types_getProductionDetails = [[LongType, IntType], [ListType, TupleType]]
   def export_getProductionDetails(self, ProdID, Params):
@@ -53,13 +117,26 @@ class ProcessManagerHandler(RequestHandler):
   def export_getSoftwareParams(self, AppName, AppVersion, Platform, Params):
     """ Get the given software status
     """
-    return processDB.getSoftwareParams(AppName, AppVersion, Platform, Params)
+    return softwareCache.get((AppName, AppVersion, Platform, tuple(Params)), processDB.getSoftwareParams, 
+                             AppName, AppVersion, Platform, list(Params))
   
   types_getInstallSoftwareTask = []
   def export_getInstallSoftwareTask(self):
     """ Obtain a new task: when new software is installed. it's needed to install it everywhere.
     """
     return processDB.getInstallSoftwareTask()
+
+  types_getJobs = []
+  def export_getJobs(self):
+    """ Get the installation jobs being followed
+    """
+    return processDB.getJobs()
+
+  types_getCacheStatistics = []
+  def export_getCacheStatistics(self):
+    """ Get the hits and misses of the software and process caches
+    """
+    return S_OK({'Software' : softwareCache.getStatistics(), 'Processes' : processCache.getStatistics()})
 #######################################################################
 #              Add methods
 #######################################################################
@@ -67,19 +144,25 @@ class ProcessManagerHandler(RequestHandler):
   def export_addSoftware(self, AppName, AppVersion, Platform, Comment, Path):
     """ Add new software in the DB
     """
-    return processDB.addSoftware(AppName, AppVersion, Platform, Comment, Path)
+    res = processDB.addSoftware(AppName, AppVersion, Platform, Comment, Path)
+    invalidateCaches()
+    return res
     
   types_addDependency = [StringTypes, StringTypes, StringTypes, StringTypes, StringTypes]
   def export_addDependency(self, AppName, AppVersion, DepName, DepVersion, Platform):
     """ Add a dependency between softwares
     """
-    return processDB.addDependency(AppName, AppVersion, DepName, DepVersion, Platform)
+    res = processDB.addDependency(AppName, AppVersion, DepName, DepVersion, Platform)
+    invalidateCaches()
+    return res
 
   types_addProcess = [StringTypes, StringTypes, StringTypes, StringTypes]
   def export_addProcess(self, ProcessName, ProcessDetail, WhizardVers, Template):
     """ Add a new process
     """
-    return processDB.addProcess(ProcessName, ProcessDetail, WhizardVers, Template)
+    res = processDB.addProcess(ProcessName, ProcessDetail, WhizardVers, Template)
+    invalidateCaches()
+    return res
  
   types_addSteeringFile = [StringTypes, StringTypes]
   def export_addSteeringFile(self, FileName, Path = ''):
@@ -99,7 +182,9 @@ class ProcessManagerHandler(RequestHandler):
         or not ProdDataDict.has_key('Platform')
         ):
       return S_ERROR('Incorrect dictionary structure')
-    return processDB.addProductionData(ProdDataDict)
+    res = processDB.addProductionData(ProdDataDict)
+    invalidateCaches()
+    return res
   
   types_addsite = [StringTypes]
   def export_addSite(self, sitename):
@@ -112,6 +197,12 @@ class ProcessManagerHandler(RequestHandler):
     """ Add a job
     """
     return processDB.addOrUpdateJob(jobdict)
+
+  types_addOrUpdateJobs = [[ListType, TupleType]]
+  def export_addOrUpdateJobs(self, joblist):
+    """ Add or update several jobs
+    """
+    return processDB.addOrUpdateJobs(joblist)
 #######################################################################
 #              Change methods
 #######################################################################
@@ -121,18 +212,28 @@ class ProcessManagerHandler(RequestHandler):
     """
     if not (ProcessDict.has_key('ProdID') and ProcessDict.has_key('AppName') and ProcessDict.has_key('CrossSection')):
       return S_ERROR("Missing essential dictionary info")
-    return processDB.updateCrossSection(ProcessDict)
+    res = processDB.updateCrossSection(ProcessDict)
+    invalidateCaches()
+    return res
     
   types_changeSoftwareStatus = [StringTypes, StringTypes, StringTypes, StringTypes, BooleanType]
   def export_changeSoftwareStatus(self, AppName, AppVersion, Platform, Comment, Status = False):
     """ Change the status of a software, by feault to False
     """
-    return processDB.changeSoftwareStatus(AppName, AppVersion, Platform, Comment, Status)
+    res = processDB.changeSoftwareStatus(AppName, AppVersion, Platform, Comment, Status)
+    invalidateCaches()
+    return res
   
   types_changeSiteStatus = [DictType]
   def export_changeSiteStatus(self, sitedict):
     return processDB.changeSiteStatus(sitedict)
 
+  types_changeSitesStatus = [DictType]
+  def export_changeSitesStatus(self, sitesdict):
+    """ Change the status of several sites: sitesdict is {SiteName : Status}
+    """
+    return processDB.changeSitesStatus(sitesdict)
+
   types_reportOK = [DictType]
   def export_reportOK(self, jobdict):
     return processDB.reportOK(jobdict)
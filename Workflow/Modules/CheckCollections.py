@@ -153,6 +153,7 @@ exit $$appstatus
                             callbackFunction = self.redirectLogOutput,
                             bufferLimit = 20971520
     )
+    self.closeLogOutput()
 
     # Check results
 
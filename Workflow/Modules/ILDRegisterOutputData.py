@@ -12,6 +12,7 @@ __RCSID__ = "$Id: ILDRegisterOutputData.py 44185 2011-10-24 08:17:07Z sposs $"
 
 from ILCDIRAC.Workflow.Modules.ModuleBase                  import ModuleBase
 from DIRAC.Resources.Catalog.FileCatalogClient             import FileCatalogClient
+from ILCDIRAC.Core.Utilities.RegisterMetadata              import registerFiles
 
 from DIRAC import S_OK, gLogger
 import os
@@ -69,6 +70,8 @@ class ILDRegisterOutputData(ModuleBase):
 
     #TODO: What meta data should be stored at file level?
 
+    metadict = {}
+    ancestordict = {}
     for files in self.prodOutputLFNs:
       meta = {}  
 
@@ -80,36 +83,36 @@ class ILDRegisterOutputData(ModuleBase):
             nbevts['NumberOfEvents'] = self.workflow_commons['file_number_of_event_relation'][os.path.basename(files)]
         meta.update(nbevts) 
         
-      if ['CrossSection'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('CrossSection'):
         xsec = {'CrossSection':self.inputdataMeta['CrossSection']}
         meta.update(xsec)
         
-      if ['CrossSectionError'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('CrossSectionError'):
         xsec = {'CrossSectionError':self.inputdataMeta['CrossSectionError']}
         meta.update(xsec)
         
-      if ['GenProcessID'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('GenProcessID'):
         fmeta = {'GenProcessID':self.inputdataMeta['GenProcessID']}
         meta.update(fmeta)
         
-      if ['GenProcessType'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('GenProcessType'):
         fmeta = {'GenProcessType':self.inputdataMeta['GenProcessType']}
         meta.update(fmeta)
         
-      if ['GenProcessName'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('GenProcessName'):
         fmeta = {'GenProcessName':self.inputdataMeta['GenProcessName']}
         meta.update(fmeta)
         
-      if ['Luminosity'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('Luminosity'):
         fmeta = {'Luminosity':self.inputdataMeta['Luminosity']}
         meta.update(fmeta)
         
-      if ['BeamParticle1'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('BeamParticle1'):
         fmeta = {'BeamParticle1':self.inputdataMeta['BeamParticle1'],
                  'BeamParticle2':self.inputdataMeta['BeamParticle2']}
         meta.update(fmeta)
         
-      if ['PolarizationB1'] in self.inputdataMeta:
+      if self.inputdataMeta.has_key('PolarizationB1'):
         fmeta = {'PolarizationB1':self.inputdataMeta['PolarizationB1'],
                  'PolarizationB2':self.inputdataMeta['PolarizationB2']}
         meta.update(fmeta)
@@ -118,22 +121,16 @@ class ILDRegisterOutputData(ModuleBase):
         fmeta = {'ILDConfig' : self.ildconfig}
         meta.update(fmeta)
         
-      if self.enable:
-        res = self.filecatalog.setMetadata(files, meta)
-        if not res['OK']:
-          self.log.error(res['Message'])
-          self.log.error('Could not register metadata ')
-          return res
-      self.log.info("Registered %s with tags %s"%(files, meta))
+      metadict[files] = meta
       
       ###Now, set the ancestors
       if self.InputData:
-        inputdata = self.InputData
-        if self.enable:
-          res = self.filecatalog.addFileAncestors({files : {'Ancestors' : inputdata}})
-          if not res['OK']:
-            self.log.error('Registration of Ancestors for %s failed' % files)
-            return res
+        ancestordict[files] = self.InputData
+
+    if self.enable:
+      res = registerFiles(self.filecatalog, metadict, ancestordict, self.log)
+      if not res['OK']:
+        return res
 
     return S_OK('Output data metadata registered in catalog')
   
@@ -16,7 +16,21 @@ from ILCDIRAC.Workflow.Modules.ModuleBase                 import ModuleBase
 from DIRAC                                                import S_OK, S_ERROR, gLogger
 from ILCDIRAC.Core.Utilities.PrepareLibs                  import removeLibc
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames         import getProdFilename, resolveIFpaths
-import os
+from ILCDIRAC.Core.Utilities.LogParser                    import LogParser
+import os, re
+
+def _lcioSplitOutputFile(match, results):
+  """ A new output file is written: it will be renamed once lcio is done
+  """
+  results['Current'] = match.string.rstrip()
+  if not results['Events'].has_key(results['Current']):
+    results['Files'].append(results['Current'])
+  results['Events'][results['Current']] = 0
+
+def _lcioSplitEvents(match, results):
+  """ Number of events in the current output file
+  """
+  results['Events'][results['Current']] = int(match.string.split()[0])
 
 class LCIOSplit(ModuleBase):
   """ LCIO split module
@@ -151,6 +165,11 @@ exit $?
 
     self.setApplicationStatus( 'LCIOSplit %s step %s' % ( self.applicationVersion, self.STEP_NUMBER ) )
     self.stdError = ''
+    ##The output files are called after the input file, see L{LogParser}
+    baseinputfilename = os.path.basename(runonslcio).split(".slcio")[0]
+    self.logParser = LogParser([(re.escape(baseinputfilename), _lcioSplitOutputFile),
+                                (r'events', _lcioSplitEvents)],
+                               {'Current' : '', 'Files' : [], 'Events' : {}})
 
     self.result = shellCall(
                             0,
@@ -158,6 +177,7 @@ exit $?
                             callbackFunction = self.redirectLogOutput,
                             bufferLimit = 20971520
                             )
+    self.closeLogOutput()
 
         # Check results
 
@@ -168,26 +188,18 @@ exit $?
       self.log.error("Cannot access log file, cannot proceed")
       return S_ERROR("Failed reading the log file")
 
-    logf = file(self.applicationLog,"r")
-    baseinputfilename = os.path.basename(runonslcio).split(".slcio")[0]
     output_file_base_name = ''
     if self.OutputFile:
       output_file_base_name = self.OutputFile.split('.slcio')[0]
     self.log.info("Will rename all files using '%s' as base." % output_file_base_name)
+    ###The log was analysed while lcio was running, the files it wrote can now be renamed
     numberofeventsdict = {}
-    fname = ''
-    for line in logf:
-      line = line.rstrip()
-      if line.count(baseinputfilename):
-        #First, we need to rename those guys
-        current_file = os.path.basename(line).replace(".slcio", "")
-        current_file_extension = current_file.replace(baseinputfilename, "")
-        newfile = output_file_base_name + current_file_extension + ".slcio"
-        os.rename(line, newfile)
-        fname = newfile
-        numberofeventsdict[fname] = 0
-      elif line.count("events"):
-        numberofeventsdict[fname] = int(line.split()[0])
+    for line in self.logParser.results['Files']:
+      current_file = os.path.basename(line).replace(".slcio", "")
+      current_file_extension = current_file.replace(baseinputfilename, "")
+      newfile = output_file_base_name + current_file_extension + ".slcio"
+      os.rename(line, newfile)
+      numberofeventsdict[newfile] = self.logParser.results['Events'][line]
     
     self.log.verbose("numberofeventsdict dict: %s" % numberofeventsdict)   
 
@@ -383,6 +383,7 @@ class MarlinAnalysis(ModuleBase):
     self.setApplicationStatus('%s %s step %s' % (self.applicationName, self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
     res = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)    
+    self.closeLogOutput()
     return res
   
   def GetInputFiles(self):
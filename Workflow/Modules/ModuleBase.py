@@ -22,8 +22,9 @@ from DIRAC.Core.Utilities.File                            import makeGuid
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations  import Operations
 from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder
 from ILCDIRAC.Core.Utilities.InputFilesUtilities          import getNumberOfevents
+from ILCDIRAC.Core.Utilities.LogCapture                   import LogCapture
 
-import os, string, sys, re, types
+import os, string, types, threading
 from random import choice
 
 def GenRandString(length=8, chars = string.letters + string.digits):
@@ -64,6 +65,9 @@ class ModuleBase(object):
     self.ignoremissingInput = False
     self.OutputFile = ''
     self.jobType = ''
+    self.logCapture = None
+    self.logParser = None
+    self.logCaptureLock = threading.Lock()
     self.stdError = ''
     self.debug = False
     self.jobID = None
@@ -424,7 +428,10 @@ class ModuleBase(object):
       
 
     if self.InputData:
-      res = getNumberOfevents(self.InputData)
+      ##The catalog answers are kept for the next steps
+      if not self.workflow_commons.has_key('InputDataMetaCache'):
+        self.workflow_commons['InputDataMetaCache'] = {}
+      res = getNumberOfevents(self.InputData, self.workflow_commons['InputDataMetaCache'])
       self.inputdataMeta.update(res['AdditionalMeta'])
       if res["nbevts"]:
         if self.NumberOfEvents > res['nbevts'] or self.NumberOfEvents == 0:
@@ -444,6 +451,7 @@ class ModuleBase(object):
     """ Catch the resulting application status, and return corresponding workflow status
     """
     message = '%s %s Successful' % (self.applicationName, self.applicationVersion)
+    self.closeLogOutput()
     if status:
       self.log.error( "==================================\n StdError:\n" )
       self.log.error( self.stdError )
@@ -457,32 +465,58 @@ class ModuleBase(object):
     return S_OK(message)    
 
   def redirectLogOutput(self, fd, message):
-    """Catch the output from the application
+    """Catch the output from the application, see L{LogCapture}. Call L{closeLogOutput} 
+    once the application is done, before reading the applicationLog. If logParser is set,
+    the lines are given to it.
     """
-    sys.stdout.flush()
-    if message:
-      if type(self.eventstring) == type(' '):
-        self.eventstring = [self.eventstring]
-      if len(self.eventstring): 
-        if len(self.eventstring[0]):
-          for mystring in self.eventstring:
-            if re.search(mystring, message):
-              print message 
-      else:
-        print message
-      if self.applicationLog:
-        log = open(self.applicationLog, 'a')
-        if self.excludeAllButEventString:
-          if len(self.eventstring): 
-            if len(self.eventstring[0]):  
-              for mystring in self.eventstring:
-                if re.search(mystring, message):
-                  log.write(message+'\n')
-        else:
-          log.write(message+'\n')
-        log.close()
-      else:
+    capture = self.logCapture
+    if not capture or not capture.isFor(self.applicationLog, self.eventstring, self.excludeAllButEventString,
+                                        self.logParser):
+      capture = self.__newLogCapture()
+    capture.write(fd, message)
+
+  def __newLogCapture(self):
+    """ (Re)create the L{LogCapture} when the log file, the event strings or the parser changed
+    """
+    self.logCaptureLock.acquire()
+    try:
+      capture = self.logCapture
+      if capture and capture.isFor(self.applicationLog, self.eventstring, self.excludeAllButEventString,
+                                   self.logParser):
+        return capture
+      if not self.applicationLog:
         self.log.error("Application Log file not defined")
-    if fd == 1:
-      self.stdError += message
+      capture = LogCapture(self.applicationLog, self.eventstring, self.excludeAllButEventString, self.logParser)
+      if self.logCapture:
+        self.logCapture.close()
+        capture.stdError.extend(self.logCapture.stdError)
+      self.logCapture = capture
+    finally:
+      self.logCaptureLock.release()
+    return capture
+
+  def closeLogOutput(self):
+    """ Flush and close the applicationLog, to call once the application is done
+    """
+    if self.logCapture:
+      self.logCapture.close()
+      self.log.verbose("Captured %(Lines)s lines, %(Bytes)s bytes, %(ErrorLines)s on stderr" % 
+                       self.logCapture.getStatistics())
+
+  def _getStdError(self):
+    """ The last lines the application printed on stderr
+    """
+    if self.logCapture:
+      return self.logCapture.getStdError()
+    return ''
+
+  def _setStdError(self, value):
+    """ Reset the standard error, usually to '' before running the application
+    """
+    if self.logCapture:
+      self.logCapture.clearStdError()
+      if value:
+        self.logCapture.stdError.append(value)
+
+  stdError = property(_getStdError, _setStdError)
         
\ No newline at end of file
@@ -204,7 +204,7 @@ class MokkaAnalysis(ModuleBase):
     MokkaDBrandomName =  '/tmp/MokkaDBRoot-' + GenRandString(8)
       
     #sqlwrapper = SQLWrapper(self.dbslice,mySoftwareRoot,"/tmp/MokkaDBRoot")#mySoftwareRoot)
-    sqlwrapper = SQLWrapper(mySoftwareRoot, MokkaDBrandomName)#mySoftwareRoot)
+    sqlwrapper = SQLWrapper(mySoftwareRoot, MokkaDBrandomName, self.applicationVersion)#mySoftwareRoot)
     res = sqlwrapper.setDBpath(myMokkaDir, self.dbSlice)
     if not res['OK']:
       self.log.error("Failed to find the DB slice")
@@ -378,6 +378,7 @@ class MokkaAnalysis(ModuleBase):
     self.setApplicationStatus('Mokka %s step %s' % (self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    self.closeLogOutput()
     #self.result = {'OK':True,'Value':(0,'Disabled Execution','')}
     resultTuple = self.result['Value']
 
@@ -16,7 +16,8 @@ from DIRAC.DataManagementSystem.Client.ReplicaManager        import ReplicaManag
 from DIRAC.Resources.Catalog.FileCatalogClient               import FileCatalogClient
 from DIRAC.Core.DISET.RPCClient                              import RPCClient
 from DIRAC.Core.Utilities.Subprocess                         import shellCall
-from ILCDIRAC.Core.Utilities.WasteCPU                        import WasteCPUCycles
+from ILCDIRAC.Core.Utilities.TransferPacer                   import getSitePacer, disableWatchdogCPUCheck, enableWatchdogCPUCheck
+from ILCDIRAC.Core.Utilities.OverlayCache                    import getOverlayCache, checkFile
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations     import Operations
 
 from DIRAC                                                   import S_OK, S_ERROR, gLogger
@@ -25,7 +26,7 @@ from math import ceil, modf
 
 from decimal import Decimal
 
-import os, time, random, string, subprocess, glob
+import os, time, random, string, subprocess, glob, threading, Queue
 
 def allowedBkg( bkg, energy = None, detector = None, detectormodel = None, machine = 'clic_cdr' ):
   """ Check is supplied bkg is allowed
@@ -66,6 +67,7 @@ class OverlayInput (ModuleBase):
     self.energy = 0
     self.nbofeventsperfile = 100
     self.lfns = []
+    self.nbtotalfiles = 0
     self.nbfilestoget = 0
     self.BkgEvtType = 'gghad'
     self.BXOverlay = 0
@@ -208,6 +210,18 @@ class OverlayInput (ModuleBase):
 #    elif   self.site == "LCG.IN2P3-CC.fr": ##but not this
 #      return self.__getFilesFromLyon(meta) ## nor this
     #else:
+
+    ##Ask the Overlay service for a sample of the files: it keeps an index of the catalog content,
+    ##so that not every job scans the catalog. The extra files are used to replace the failures
+    nbfilestosample = self.ops.getValue("/Overlay/MaxNbFilesToGet", 20) + self.ops.getValue("/Overlay/MaxFailedAllowed", 20)
+    overlaymon = RPCClient('Overlay/Overlay', timeout = 600)
+    res = overlaymon.getRandomFiles(meta, nbfilestosample, self.nbofeventsperfile)
+    if res['OK']:
+      self.nbtotalfiles = res['Value']['TotalFiles']
+      if res['Value']['NbEvts']:
+        self.nbofeventsperfile = min(res['Value']['NbEvts'].values())
+      return S_OK(res['Value']['LFNs'])
+    self.log.warn("Could not get the files from the Overlay service, using the catalog:", res['Message'])
     return self.fc.findFilesByMetadata(meta)
 
   def __getFilesFromLyon(self, meta):
@@ -268,7 +282,7 @@ class OverlayInput (ModuleBase):
     """ Download the files.
     """
     numberofeventstoget = ceil(self.BXOverlay * self.ggtohadint)
-    nbfiles = len(self.lfns)
+    nbfiles = self.nbtotalfiles or len(self.lfns)
     availableevents = nbfiles * self.nbofeventsperfile
     if availableevents < numberofeventstoget:
       return S_ERROR("Number of %s events available is less than requested" % ( self.BkgEvtType ))
@@ -307,39 +321,54 @@ class OverlayInput (ModuleBase):
       f.write('Dont look at cpu')
       f.close()
     overlaymon = RPCClient('Overlay/Overlay', timeout=60)
-    ##Now need to check that there are not that many concurrent jobs getting the overlay at the same time
+    ##Now need to check that there are not that many concurrent jobs getting the overlay at the same time:
+    ##take a ticket in the site queue, and wait on the service until a slot is free
+    maxWaitingTime = self.ops.getValue("/Overlay/MaxWaitingTime", 5 * 3600)
+    deadline = time.time() + maxWaitingTime
     error_count = 0
-    count = 0
+    ticket = None
+    leaseid = 0
+    lastposition = -1
+    lastreport = 0
     while 1:
       if error_count > 10 :
         self.log.error('OverlayDB returned too any errors')
         return S_ERROR('Failed to get number of concurrent overlay jobs')
-      #jobMonitor = RPCClient('WorkloadManagement/JobMonitoring',timeout=60)
-      #res = jobMonitor.getCurrentJobCounters(jobpropdict)
-      #if not res['OK']:
-      #  error_count += 1
-      #  time.sleep(60)
-      #  continue
-      #running = 0
-      #if res['Value'].has_key('Running'):
-      #  running = res['Value']['Running']
-
-      res = overlaymon.canRun(self.site)
+      if time.time() > deadline:
+        if ticket:
+          overlaymon.dequeue(ticket)
+        return S_ERROR("Waited too long: %s h, so marking job as failed" % (maxWaitingTime / 3600))
+
+      if not ticket:
+        res = overlaymon.enqueue(self.site, int(self.jobID or 0))
+        if not res['OK']:
+          error_count += 1
+          time.sleep(60)
+          continue
+        ticket = res['Value']['Ticket']
+        self.log.info("Got ticket %s, position in queue: %s" % (ticket, res['Value']['Position']))
+
+      res = overlaymon.waitForSlot(ticket)
       if not res['OK']:
+        ##The service may have been restarted, take a new ticket
+        self.log.warn("Waiting for a slot failed:", res['Message'])
+        ticket = None
         error_count += 1
         time.sleep(60)
         continue
       error_count = 0
-      #if running < max_concurrent_running:
-      if res['Value']:
+      if res['Value']['LeaseID']:
+        leaseid = res['Value']['LeaseID']
         break
-      else:
-        count += 1
-        if count > 300:
-          return S_ERROR("Waited too long: 5h, so marking job as failed")
-        if count % 10 == 0 :
-          self.setApplicationStatus("Overlay standby number %s" % count)
-        time.sleep(60)
+      position = res['Value']['Position']
+      ##The service is busy and did not keep the call open: come back later
+      if res['Value'].has_key('RetryAfter'):
+        time.sleep(res['Value']['RetryAfter'])
+      ##Do not flood the job state service: report the position at most every 10 minutes
+      if position != lastposition and time.time() - lastreport > 600:
+        self.setApplicationStatus("Overlay standby, position %s in queue" % position)
+        lastposition = position
+        lastreport = time.time()
         
     if os.path.exists('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK'):
       os.remove('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK')
@@ -350,70 +379,17 @@ class OverlayInput (ModuleBase):
 
     os.mkdir("./overlayinput_" + self.BkgEvtType)
     os.chdir("./overlayinput_" + self.BkgEvtType)
-    filesobtained = []
-    usednumbers = []
-    fail = False
-    fail_count = 0
 
-    max_fail_allowed = self.ops.getValue("/Overlay/MaxFailedAllowed", 20)
-    while not len(filesobtained) == totnboffilestoget:
-      if fail_count > max_fail_allowed:
-        fail = True
-        break
-
-      ##Now wait for a random time around 3 minutes
-      ###Actually, waste CPU time !!!
-      self.log.verbose("Waste happily some CPU time (on average 3 minutes)")
-      res = WasteCPUCycles(60 * random.gauss(3, 0.1))
-      if not res['OK']:
-        self.log.error("Could not waste as much CPU time as wanted, but whatever!")
-
-      fileindex = random.randrange(nbfiles)
-      if fileindex not in usednumbers:
-          
-        usednumbers.append(fileindex)
-
-        isDefault = False
-
-        if self.site == 'LCG.CERN.ch':
-          res = self.getCASTORFile(self.lfns[fileindex])
-        elif self.site == 'LCG.IN2P3-CC.fr':
-          res = self.getLyonFile(self.lfns[fileindex])
-        elif self.site == 'LCG.UKI-LT2-IC-HEP.uk':
-          res = self.getImperialFile(self.lfns[fileindex])
-        elif  self.site == 'LCG.RAL-LCG2.uk':
-          res = self.getRALFile(self.lfns[fileindex])
-        else:
-          if not os.path.exists('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK'):
-            f = file('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK', 'w')
-            f.write('Dont look at cpu')
-            f.close()
-          res = self.rm.getFile(self.lfns[fileindex])
-          isDefault = True
-
-        # Tue Jun 28 14:21:03 CEST 2011
-        # Temporarily for Imperial College site until dCache is fixed
-
-        if (not res['OK']) and (not isDefault) and \
-          (self.site in ['LCG.UKI-LT2-IC-HEP.uk', 'LCG.IN2P3-CC.fr', 'LCG.CERN.ch']):
-          res = self.rm.getFile(self.lfns[fileindex])
+    ##Pick the files up front: the first ones are downloaded, the others replace the failures
+    candidates = list(self.lfns)
+    random.shuffle(candidates)
+    if totnboffilestoget > len(candidates):
+      totnboffilestoget = len(candidates)
+    res = self.__downloadFiles(candidates, totnboffilestoget)
+    fail = not res['OK']
+    if fail:
+      self.log.error(res['Message'])
 
-        if not res['OK']:
-          self.log.warn('Could not obtain %s' % self.lfns[fileindex])
-          fail_count += 1
-          continue
-        
-        if res['Value'].has_key('Failed'):
-          if len(res['Value']['Failed']):
-            self.log.warn('Could not obtain %s' % self.lfns[fileindex])
-            fail_count += 1
-            continue
-        filesobtained.append(self.lfns[fileindex])
-      ##If no file could be obtained, need to make sure the job fails  
-      if len(usednumbers) == nbfiles and not len(filesobtained):
-        fail = True
-        break
-      
     #res = self.rm.getFile(filesobtained)
     #failed = len(res['Value']['Failed'])
     #tryagain = []
@@ -438,7 +414,9 @@ class OverlayInput (ModuleBase):
     self.log.info("List of Overlay files:")
     self.log.info(string.join(mylist, "\n"))
     os.chdir(self.curdir)
-    res = overlaymon.jobDone(self.site)
+    ##The pacing and the downloads are over
+    enableWatchdogCPUCheck(self.curdir)
+    res = overlaymon.jobDone(self.site, leaseid)
     if not res['OK']:
       self.log.error("Could not declare the job as finished getting the files")
     if fail:
@@ -447,6 +425,157 @@ class OverlayInput (ModuleBase):
     self.log.info('Got all files needed.')
     return S_OK()
 
+  def __getFile(self, lfn):
+    """ Get one file, using the site specific method if any, and the ReplicaManager otherwise.
+    Returns S_OK if the file was obtained.
+    """
+    isDefault = False
+    if self.site == 'LCG.CERN.ch':
+      res = self.getCASTORFile(lfn)
+    elif self.site == 'LCG.IN2P3-CC.fr':
+      res = self.getLyonFile(lfn)
+    elif self.site == 'LCG.UKI-LT2-IC-HEP.uk':
+      res = self.getImperialFile(lfn)
+    elif  self.site == 'LCG.RAL-LCG2.uk':
+      res = self.getRALFile(lfn)
+    else:
+      disableWatchdogCPUCheck(self.curdir)
+      res = ReplicaManager().getFile(lfn)
+      isDefault = True
+
+    # Tue Jun 28 14:21:03 CEST 2011
+    # Temporarily for Imperial College site until dCache is fixed
+
+    if (not res['OK']) and (not isDefault) and \
+      (self.site in ['LCG.UKI-LT2-IC-HEP.uk', 'LCG.IN2P3-CC.fr', 'LCG.CERN.ch']):
+      res = ReplicaManager().getFile(lfn)
+
+    if not res['OK']:
+      return res
+    if res['Value'].has_key('Failed'):
+      if len(res['Value']['Failed']):
+        return S_ERROR("Failed to get %s" % lfn)
+    return S_OK()
+
+  def __downloadFiles(self, candidates, nbfilestoget):
+    """ Download nbfilestoget files from the candidates list, using a pool of threads whose size
+    is given by /Overlay/Sites/<site>/MaxConcurrentDownloads. Each failed file is replaced by 
+    the next unused candidate.
+    """
+    max_fail_allowed = self.ops.getValue("/Overlay/MaxFailedAllowed", 20)
+    nbthreads = self.ops.getValue("/Overlay/MaxConcurrentDownloads", 4)
+    nbthreads = self.ops.getValue("/Overlay/Sites/%s/MaxConcurrentDownloads" % self.site, nbthreads)
+    nbthreads = max(1, min(nbthreads, nbfilestoget))
+    pacer = getSitePacer(self.site, workdir = self.curdir)
+
+    ##The checksums are needed to use the cache: get them for all the files that may be used
+    cache = getOverlayCache(self.site)
+    checksums = {}
+    checksumtypes = {}
+    if cache:
+      res = self.fc.getFileMetadata(candidates[:nbfilestoget + max_fail_allowed])
+      if not res['OK']:
+        self.log.warn("Could not get the checksums, not using the cache:", res['Message'])
+        cache = None
+      else:
+        for lfn, meta in res['Value']['Successful'].items():
+          checksums[lfn] = meta.get('Checksum', '')
+          checksumtypes[lfn] = meta.get('ChecksumType', 'Adler32')
+
+    toget = Queue.Queue()
+    for lfn in candidates[:nbfilestoget]:
+      toget.put(lfn)
+    lock = threading.Lock()
+    state = {'Next' : nbfilestoget, 'Failed' : 0, 'Obtained' : [], 'Bytes' : 0, 'Hits' : 0, 'Misses' : 0}
+
+    def worker():
+      """ Get files until there is nothing left to get
+      """
+      while True:
+        try:
+          lfn = toget.get_nowait()
+        except Queue.Empty:
+          return
+        localfile = os.path.basename(lfn)
+        if cache:
+          res = cache.get(lfn, checksums.get(lfn, ''), localfile)
+          hit = res['OK'] and res['Value']
+          lock.acquire()
+          try:
+            if hit:
+              state['Hits'] += 1
+              state['Obtained'].append(lfn)
+            else:
+              state['Misses'] += 1
+          finally:
+            lock.release()
+          if hit:
+            continue
+        ##Do not access the storage faster than what the site allows
+        res = pacer.wait()
+        if not res['OK']:
+          self.log.error("Could not pace the transfer:", res['Message'])
+        start = time.time()
+        try:
+          res = self.__getFile(lfn)
+        except Exception, x:
+          res = S_ERROR(str(x))
+        duration = max(time.time() - start, 1e-3)
+        lock.acquire()
+        try:
+          if res['OK'] and os.path.exists(localfile):
+            size = os.path.getsize(localfile)
+            state['Obtained'].append(lfn)
+            state['Bytes'] += size
+            self.log.info("Got %s: %.1f MB in %.1f s (%.2f MB/s)" % (lfn, size / 1048576., duration,
+                                                                      size / 1048576. / duration))
+          else:
+            self.log.warn('Could not obtain %s' % lfn)
+            state['Failed'] += 1
+            if state['Failed'] <= max_fail_allowed and state['Next'] < len(candidates):
+              toget.put(candidates[state['Next']])
+              state['Next'] += 1
+        finally:
+          lock.release()
+        if cache and res['OK'] and os.path.exists(localfile):
+          ##A truncated download must not be given to the other jobs
+          res = checkFile(localfile, checksums.get(lfn, ''), checksumtypes.get(lfn, 'Adler32'))
+          if not res['OK']:
+            self.log.warn("Not caching %s:" % lfn, res['Message'])
+            continue
+          res = cache.put(lfn, checksums.get(lfn, ''), localfile)
+          if not res['OK']:
+            self.log.warn(res['Message'])
+
+    self.log.info("Getting %s files with %s concurrent downloads" % (nbfilestoget, nbthreads))
+    start = time.time()
+    threads = []
+    for dummy in range(nbthreads):
+      thread = threading.Thread(target = worker)
+      thread.setDaemon(True)
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+    self.closeLogOutput()
+    duration = max(time.time() - start, 1e-3)
+    self.log.info("Got %s files, %.1f MB in %.1f s (%.2f MB/s), %s failures" % (len(state['Obtained']),
+                                                                                 state['Bytes'] / 1048576.,
+                                                                                 duration,
+                                                                                 state['Bytes'] / 1048576. / duration,
+                                                                                 state['Failed']))
+    if cache:
+      self.log.info("Overlay cache: %s hits, %s misses" % (state['Hits'], state['Misses']))
+    ##If no file could be obtained, need to make sure the job fails  
+    if not len(state['Obtained']):
+      return S_ERROR("Could not obtain any file")
+    if state['Failed'] > max_fail_allowed:
+      return S_ERROR("Too many failures")
+    if len(state['Obtained']) < nbfilestoget:
+      self.log.warn("Could only get %s files out of %s, all candidates were tried" % (len(state['Obtained']), 
+                                                                                     nbfilestoget))
+    return S_OK(state['Obtained'])
+
   def getCASTORFile(self, lfn):
     """ USe xrdcp or rfcp to get the files from castor
     """
@@ -460,9 +589,11 @@ class OverlayInput (ModuleBase):
 
     basename = os.path.basename(lfile)
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    script = file("overlayinput.sh","w")
+    ##One script per file, as several files are obtained concurrently
+    scriptname = "overlayinput_%s.sh" % os.path.basename(lfile)
+    if os.path.exists(scriptname):
+      os.unlink(scriptname)
+    script = file(scriptname,"w")
     script.write('#!/bin/sh \n')
     script.write('###############################\n')
     script.write('# Dynamically generated scrip #\n')
@@ -480,9 +611,13 @@ fi\n""" % (basename, lfile))
     script.write('declare -x appstatus=$?\n')
     script.write('exit $appstatus\n')
     script.close()
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
-    self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    os.chmod(scriptname, 0755)
+    comm = 'sh -c "./%s"' % scriptname
+    ##Local result: the files are obtained by several threads at once
+    res = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    if not res['OK']:
+      self.log.error("Failed to run %s:" % scriptname, res['Message'])
+      return res
     #comm7=["/usr/bin/rfcp","'rfio://cgenstager.ads.rl.ac.uk:9002?svcClass=ilcTape&path=%s'"%lfile,"file:%s"%basename]
     #try:
     #  res = subprocess.Popen(comm7,stdout=logfile,stderr=subprocess.STDOUT)
@@ -517,9 +652,11 @@ fi\n""" % (basename, lfile))
     #comm = []
     #comm.append("cp $X509_USER_PROXY /tmp/x509up_u%s"%os.getuid())
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    script = file("overlayinput.sh", "w")
+    ##One script per file, as several files are obtained concurrently
+    scriptname = "overlayinput_%s.sh" % os.path.basename(lfile)
+    if os.path.exists(scriptname):
+      os.unlink(scriptname)
+    script = file(scriptname, "w")
     script.write('#!/bin/sh \n')
     script.write('###############################\n')
     script.write('# Dynamically generated scrip #\n')
@@ -535,9 +672,13 @@ fi\n""" % (basename, lfile))
     script.write('declare -x appstatus=$?\n')
     script.write('exit $appstatus\n')
     script.close()
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
-    self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    os.chmod(scriptname, 0755)
+    comm = 'sh -c "./%s"' % scriptname
+    ##Local result: the files are obtained by several threads at once
+    res = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    if not res['OK']:
+      self.log.error("Failed to run %s:" % scriptname, res['Message'])
+      return res
 #    
 #    if os.environ.has_key('X509_USER_PROXY'):
 #      comm2 = ["cp", os.environ['X509_USER_PROXY'],"/tmp/x509up_u%s"%os.getuid()]
@@ -577,15 +718,14 @@ fi\n""" % (basename, lfile))
     else:
       lfile = lfn
     self.log.info("Getting %s" % file)
-    ###Don't check for CPU time as other wise, job can get killed
-    if not os.path.exists('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK'):
-      f = file('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK', 'w')
-      f.write('Dont look at cpu')
-      f.close()
-
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    script = file("overlayinput.sh","w")
+    ###Don't check for CPU time as other wise, job can get killed. The flag goes in the job directory
+    disableWatchdogCPUCheck(self.curdir)
+
+    ##One script per file, as several files are obtained concurrently
+    scriptname = "overlayinput_%s.sh" % os.path.basename(lfile)
+    if os.path.exists(scriptname):
+      os.unlink(scriptname)
+    script = file(scriptname,"w")
     script.write('#!/bin/sh \n')
     script.write('###############################\n')
     script.write('# Dynamically generated scrip #\n')
@@ -599,9 +739,13 @@ fi\n""" % (basename, lfile))
     script.write('declare -x appstatus=$?\n')
     script.write('exit $appstatus\n')
     script.close()
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
-    self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    os.chmod(scriptname, 0755)
+    comm = 'sh -c "./%s"' % scriptname
+    ##Local result: the files are obtained by several threads at once
+    res = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    if not res['OK']:
+      self.log.error("Failed to run %s:" % scriptname, res['Message'])
+      return res
 #    
     #command = "rfcp %s ./"%file
     #comm = []
@@ -643,11 +787,8 @@ fi\n""" % (basename, lfile))
     else:
       lfile = lfn
     self.log.info("Getting %s" % lfile)
-    ###Don't check for CPU time as other wise, job can get killed
-    if not os.path.exists('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK'):
-      f = file('DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK','w')
-      f.write('Dont look at cpu')
-      f.close()
+    ###Don't check for CPU time as other wise, job can get killed. The flag goes in the job directory
+    disableWatchdogCPUCheck(self.curdir)
     
     #command = "rfcp %s ./"%file
     #comm = []
@@ -673,9 +814,11 @@ fi\n""" % (basename, lfile))
 #      print res
     basename = os.path.basename(lfile)
 
-    if os.path.exists("overlayinput.sh"):
-      os.unlink("overlayinput.sh")
-    script = file("overlayinput.sh","w")
+    ##One script per file, as several files are obtained concurrently
+    scriptname = "overlayinput_%s.sh" % os.path.basename(lfile)
+    if os.path.exists(scriptname):
+      os.unlink(scriptname)
+    script = file(scriptname,"w")
     script.write('#!/bin/sh \n')
     script.write('###############################\n')
     script.write('# Dynamically generated scrip #\n')
@@ -684,9 +827,13 @@ fi\n""" % (basename, lfile))
     script.write('declare -x appstatus=$?\n')
     script.write('exit $appstatus\n')
     script.close()
-    os.chmod("overlayinput.sh", 0755)
-    comm = 'sh -c "./overlayinput.sh"'
-    self.result = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    os.chmod(scriptname, 0755)
+    comm = 'sh -c "./%s"' % scriptname
+    ##Local result: the files are obtained by several threads at once
+    res = shellCall(600, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    if not res['OK']:
+      self.log.error("Failed to run %s:" % scriptname, res['Message'])
+      return res
     #comm7=["/usr/bin/rfcp","'rfio://cgenstager.ads.rl.ac.uk:9002?svcClass=ilcTape&path=%s'"%lfile,"file:%s"%basename]
     #try:
     #  res = subprocess.Popen(comm7,stdout=logfile,stderr=subprocess.STDOUT)
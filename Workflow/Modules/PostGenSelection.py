@@ -120,6 +120,7 @@ class PostGenSelection(ModuleBase):
     self.setApplicationStatus('PostGenSelection_Read %s step %s' % (self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit=20971520)
+    self.closeLogOutput()
     resultTuple = self.result['Value']
     status = resultTuple[0]
     if not status == 0:
@@ -157,6 +158,7 @@ class PostGenSelection(ModuleBase):
     self.setApplicationStatus('PostGenSelection_Write %s step %s' % (self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    self.closeLogOutput()
     resultTuple = self.result['Value']
     status = resultTuple[0]
     
@@ -136,6 +136,7 @@ class PythiaAnalysis(ModuleBase):
     self.setApplicationStatus('%s %s step %s' % (self.applicationName, self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    self.closeLogOutput()
     if not self.result['OK']:
       self.log.error('Something wrong during running: %s'% self.result['Message'])
       self.setApplicationStatus('Error during running %s'% self.applicationName)
@@ -13,6 +13,7 @@ __RCSID__ = "$Id$"
 from ILCDIRAC.Workflow.Modules.ModuleBase         import ModuleBase
 from DIRAC.Resources.Catalog.FileCatalogClient    import FileCatalogClient
 from DIRAC.Core.Utilities                         import DEncode
+from ILCDIRAC.Core.Utilities.RegisterMetadata     import registerFiles
 from DIRAC import S_OK, gLogger
 import os
 
@@ -73,6 +74,8 @@ class RegisterOutputData( ModuleBase ):
     
     self.log.verbose("Will try to set the metadata for the following files: \n %s" % "\n".join(self.prodOutputLFNs))
 
+    metadict = {}
+    ancestordict = {}
     for files in self.prodOutputLFNs:
       metafiles = {}
 
@@ -101,22 +104,19 @@ class RegisterOutputData( ModuleBase ):
         xsec = {'CrossSection':self.inputdataMeta['CrossSection']}
         metafiles.update(xsec)
       
-      if self.enable:
-        res = self.filecatalog.setMetadata(files, metafiles)
-        if not res['OK']:
-          self.log.error(res['Message'])
-          self.log.error('Could not register metadata for %s' % files)
-          return res
-        
-      self.log.info("Registered %s with tags %s" % (files, metafiles))
+      metadict[files] = metafiles
       
       ###Now, set the ancestors
       if self.InputData:
-        if self.enable:
-          res = self.filecatalog.addFileAncestors({ files : {'Ancestors' : self.InputData } })
-          if not res['OK']:
-            self.log.error('Registration of Ancestors for %s failed' % files)
-            return res
+        ancestordict[files] = self.InputData
+
+    if not self.enable:
+      return S_OK('Output data metadata registered in catalog')
+
+    ##Register everything at once
+    res = registerFiles(self.filecatalog, metadict, ancestordict, self.log)
+    if not res['OK']:
+      return res
 
     return S_OK('Output data metadata registered in catalog')
   
@@ -13,6 +13,7 @@ __RCSID__ = "$Id: SIDRegisterOutputData.py 44185 2011-10-24 08:17:07Z sposs $"
 
 from ILCDIRAC.Workflow.Modules.ModuleBase                  import ModuleBase
 from DIRAC.Resources.Catalog.FileCatalogClient             import FileCatalogClient
+from ILCDIRAC.Core.Utilities.RegisterMetadata              import registerFiles
 
 from DIRAC import S_OK, gLogger
 import string
@@ -70,6 +71,8 @@ class SIDRegisterOutputData(ModuleBase):
     self.log.verbose("Will try to set the metadata for the following files: \n %s"% string.join(self.prodOutputLFNs, 
                                                                                                 "\n"))
 
+    metadict = {}
+    ancestordict = {}
     for files in self.prodOutputLFNs:
 #      elements = files.split("/")
 #      metaprodid = {}
@@ -114,41 +117,31 @@ class SIDRegisterOutputData(ModuleBase):
       if self.nbofevents:
         nbevts = {}
         nbevts['NumberOfEvents'] = self.nbofevents
-        if self.enable:
-          res = self.filecatalog.setMetadata(files, nbevts)
-          if not res['OK']:
-            self.log.error('Could not register metadata NumberOfEvents, with value %s for %s' % (self.nbofevents, 
-                                                                                                 files))
-            return res
         meta.update(nbevts)
       if self.luminosity:
         lumi = {}
         lumi['Luminosity'] = self.luminosity
-        if self.enable:
-          res = self.filecatalog.setMetadata(files, lumi)
-          if not res['OK']:
-            self.log.error('Could not register metadata Luminosity, with value %s for %s'%(self.luminosity, files))
-            return res
         meta.update(lumi)
 #      meta.update(metaprodid)
       
       
       
-      self.log.info("Registered %s with tags %s"%(files, meta))
+      if meta:
+        metadict[files] = meta
       
       ###Now, set the ancestors
       if self.InputData:
-        inputdata = self.InputData
-        if self.enable:
-          res = self.filecatalog.addFileAncestors({files : {'Ancestors' : inputdata}})
-          if not res['OK']:
-            self.log.error('Registration of Ancestors for %s failed' % files)
-            return res
+        ancestordict[files] = self.InputData
       # FIXME: in next DIRAC release, remove loop and replace key,value below by meta  
       #res = self.filecatalog.setMetadata(os.path.dirname(files),meta)
       #if not res['OK']:
       #  self.log.error('Could not register metadata %s for %s'%(meta, files))
       #  return res
+
+    if self.enable:
+      res = registerFiles(self.filecatalog, metadict, ancestordict, self.log)
+      if not res['OK']:
+        return res
     
     return S_OK('Output data metadata registered in catalog')
   
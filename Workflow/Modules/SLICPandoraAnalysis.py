@@ -244,6 +244,7 @@ class SLICPandoraAnalysis (ModuleBase):
     self.stdError = ''
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput,
                             bufferLimit = 20971520)
+    self.closeLogOutput()
     #self.result = {'OK':True,'Value':(0,'Disabled Execution','')}
     resultTuple = self.result['Value']
     if not os.path.exists(self.applicationLog):
@@ -14,9 +14,16 @@ from DIRAC.Core.Utilities.Subprocess                      import shellCall
 from ILCDIRAC.Core.Utilities.PrepareOptionFiles           import GetNewLDLibs
 from ILCDIRAC.Core.Utilities.FindSteeringFileDir          import getSteeringFileDirName
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames         import getProdFilename
+from ILCDIRAC.Core.Utilities.LogParser                    import LogParser
 
 import os, shutil
 
+##What is looked for in the StdHepCut log, see L{LogParser}
+STDHEPCUT_LOG_RULES = [(r'Events kept', lambda match, results: results.update({'Kept' : int(match.string.split()[-1])})),
+                       (r'Events passing cuts', 
+                        lambda match, results: results.update({'Passing' : int(match.string.split()[-1])})),
+                       (r'Events total', lambda match, results: results.update({'Total' : int(match.string.split()[-1])}))]
+
 class StdHepCut(ModuleBase):
   """ Apply cuts on stdhep files, based on L. Weuste utility.
   """
@@ -129,7 +136,9 @@ class StdHepCut(ModuleBase):
     comm = 'sh -c "./%s"' % (scriptName)    
     self.setApplicationStatus('%s %s step %s' % (self.applicationName, self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
+    self.logParser = LogParser(STDHEPCUT_LOG_RULES)
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit = 20971520)
+    self.closeLogOutput()
     #self.result = {'OK':True,'Value':(0,'Disabled Execution','')}
     resultTuple = self.result['Value']
     if not os.path.exists(self.applicationLog):
@@ -142,19 +151,10 @@ class StdHepCut(ModuleBase):
     # stdError = resultTuple[2]
     self.log.info( "Status after the application execution is %s" % str( status ) )
 
-    nbevtswritten = -1
-    nbevtspassing = 0
-    nbevtsread = 0
-    logf = file(self.applicationLog, 'r')
-    for line in logf:
-      line = line.rstrip()
-      if line.count('Events kept'):
-        nbevtswritten = int(line.split()[-1])
-      if line.count('Events passing cuts'):
-        nbevtspassing = int(line.split()[-1])
-      if line.count('Events total'):
-        nbevtsread = int(line.split()[-1])
-    logf.close()
+    ###The log was analysed while StdHepCut was running
+    nbevtswritten = self.logParser.results.get('Kept', -1)
+    nbevtspassing = self.logParser.results.get('Passing', 0)
+    nbevtsread = self.logParser.results.get('Total', 0)
     if nbevtswritten > 0 and nbevtspassing > 0 and nbevtsread > 0:
       cut_eff = 1. * nbevtspassing / nbevtsread
       self.log.info('Selection cut efficiency : %s%%' % (100 * cut_eff))
@@ -16,9 +16,29 @@ from DIRAC                                                import S_OK, S_ERROR,
 from ILCDIRAC.Core.Utilities.resolvePathsAndNames         import getProdFilename, resolveIFpaths
 from ILCDIRAC.Core.Utilities.PrepareOptionFiles           import GetNewLDLibs
 from ILCDIRAC.Core.Utilities.CombinedSoftwareInstallation import getSoftwareFolder
+from ILCDIRAC.Core.Utilities.LogParser                    import LogParser
 
 import os
 
+def _stdhepSplitOutputFile(match, results):
+  """ A new output file is opened
+  """
+  results['Current'] = match.string.split()[-1].rstrip().rstrip("\0")
+  results['Events'][results['Current']] = 0
+
+def _stdhepSplitRecords(match, results):
+  """ Number of records written in the current output file
+  """
+  if match.string.count('Output Begin Run'):
+    return
+  val = match.string.split("=")[1].rstrip().lstrip()
+  if val != '0':
+    results['Events'][results['Current']] = int(val)
+
+##What is looked for in the StdHepSplit log, see L{LogParser}
+STDHEPSPLIT_LOG_RULES = [(r'Open output file', _stdhepSplitOutputFile),
+                         (r'Record', _stdhepSplitRecords)]
+
 class StdHepSplit(ModuleBase):
   """ StdHep split module, split StdHep files using A. Miyamoto's HepSplit utility
   """
@@ -161,6 +181,7 @@ exit $?
 
     self.setApplicationStatus( 'StdHepSplit %s step %s' % ( self.applicationVersion, self.STEP_NUMBER ) )
     self.stdError = ''
+    self.logParser = LogParser(STDHEPSPLIT_LOG_RULES, {'Current' : '', 'Events' : {}})
 
     self.result = shellCall(
                             0,
@@ -168,6 +189,7 @@ exit $?
                             callbackFunction = self.redirectLogOutput,
                             bufferLimit = 20971520
                             )
+    self.closeLogOutput()
 
         # Check results
 
@@ -178,19 +200,8 @@ exit $?
       self.log.error("Cannot access log file, cannot proceed")
       return S_ERROR("Failed reading the log file")
 
-    logf = file(self.applicationLog,"r")
-    numberofeventsdict = {}
-    fname = ''
-    for line in logf:
-      line = line.rstrip()
-      if line.count('Open output file'):
-        fname = line.split()[-1].rstrip().rstrip("\0")
-        numberofeventsdict[fname] = 0
-      elif line.count("Record") and not line.count('Output Begin Run') :
-        #print line
-        val = line.split("=")[1].rstrip().lstrip()
-        if val != '0':
-          numberofeventsdict[fname] = int(val)
+    ###The log was analysed while StdHepSplit was running
+    numberofeventsdict = self.logParser.results['Events']
     
     self.log.verbose("numberofeventsdict dict: %s" % numberofeventsdict)   
 
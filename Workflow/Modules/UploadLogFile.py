@@ -18,11 +18,12 @@ from DIRAC.Core.Utilities.Subprocess                       import shellCall
 
 from ILCDIRAC.Workflow.Modules.ModuleBase                 import ModuleBase
 from ILCDIRAC.Core.Utilities.ProductionData               import getLogPath
+from ILCDIRAC.Core.Utilities.LogPacker                    import packLogFiles, getLogCompression
 
 from DIRAC import S_OK, S_ERROR, gLogger, gConfig
 import DIRAC
 
-import os, shutil, glob, string, random, tarfile
+import os, glob, string, random
 
 class UploadLogFile(ModuleBase):
   """ Handle log file uploads in the production jobs
@@ -44,6 +45,8 @@ class UploadLogFile(ModuleBase):
     self.logSE = self.ops.getValue('/LogStorage/LogSE', 'LogSE')
     self.root = gConfig.getValue('/LocalSite/Root', os.getcwd())
     self.logSizeLimit = self.ops.getValue('/LogFiles/SizeLimit', 20 * 1024 * 1024)
+    self.logCompression = getLogCompression(self.ops.getValue('/LogFiles/Compression', 'gz'))
+    self.logArchive = ''
     self.logExtensions = []
     self.failoverSEs = gConfig.getValue('/Resources/StorageElementGroups/Tier1-Failover', [])    
     self.diracLogo = self.ops.getValue('/SAM/LogoURL', 
@@ -132,7 +135,7 @@ class UploadLogFile(ModuleBase):
     self.log.info('Job root is found to be %s' % (self.root))
     self.log.info('PRODUCTION_ID = %s, JOB_ID = %s '  % (self.PRODUCTION_ID, self.JOB_ID))
     self.logdir = os.path.realpath('./job/log/%s/%s' % (self.PRODUCTION_ID, self.JOB_ID))
-    self.log.info('Selected log files will be temporarily stored in %s' % self.logdir)
+    self.log.info('Selected log files will be packed in %s' % self.logdir)
 
     res = self.finalize()
     self.workflow_commons['Request'] = self.request
@@ -157,14 +160,14 @@ class UploadLogFile(ModuleBase):
                                                                              string.join(selectedFiles, '\n')))
 
     #########################################
-    # Create a temporary directory containing these files
-    self.log.info('Populating a temporary directory for selected files.')
-    res = self.populateLogDirectory(selectedFiles)
+    # Pack these files in a single archive
+    self.log.info('Packing the selected files.')
+    res = self.packLogDirectory(selectedFiles)
     if not res['OK']:
-      self.log.error('Completely failed to populate temporary log file directory.', res['Message'])
-      self.setApplicationStatus('Failed To Populate Log Dir')
+      self.log.error('Completely failed to pack the log files.', res['Message'])
+      self.setApplicationStatus('Failed To Pack Logs')
       return S_OK()#because if the logs are lost, it's not the end of the world.
-    self.log.info('%s populated with log files.' % self.logdir)
+    self.log.info('%s created with the log files.' % self.logArchive)
 
     #########################################
     # Create a tailored index page
@@ -199,7 +202,7 @@ class UploadLogFile(ModuleBase):
         #storageElement = StorageElement(self.logSE)
         #pfn = storageElement.getPfnForLfn(self.logFilePath)['Value']
         #logURL = getPfnForProtocol(res['Value'],'http')['Value']
-        logURL = '%s' % self.logFilePath
+        logURL = '%s/%s' % (self.logFilePath, os.path.basename(self.logArchive))
         self.setJobParameter('Log LFN', logURL)
         self.log.info('Logs for this job may be retrieved with dirac-ilc-get-prod-log -F %s' % logURL)
         return S_OK()
@@ -209,30 +212,9 @@ class UploadLogFile(ModuleBase):
     self.log.error('Completely failed to upload log files to %s, will attempt upload to failover SE' % self.logSE, 
                    res['Message'])
 
-    tarFileDir = os.path.dirname(self.logdir)
-    self.logLFNPath = '%s.gz' % self.logLFNPath
-    tarFileName = os.path.basename(self.logLFNPath)
-    start = os.getcwd()
-    os.chdir(self.logdir)
-    logTarFiles = os.listdir(self.logdir)
-    #comm = 'tar czvf %s %s' % (tarFileName,string.join(logTarFiles,' '))
-    tfile = tarfile.open(tarFileName, "w:gz")
-    for item in logTarFiles:
-      tfile.add(item)
-    tfile.close()
-    #res = shellCall(0,comm)
-    if not os.path.exists(tarFileName):
-      res = S_ERROR("File was not created")
-    os.chdir(start)
-    if not res['OK']:
-      self.log.error('Failed to create tar file from directory','%s %s' % (self.logdir, res['Message']))
-      self.setApplicationStatus('Failed To Create Log Tar Dir')
-      return S_OK()#because if the logs are lost, it's not the end of the world.
-    
-    #if res['Value'][0]: #i.e. non-zero status
-    #  self.log.error('Failed to create tar file from directory','%s %s' % (self.logdir,res['Value']))
-    #  self.setApplicationStatus('Failed To Create Log Tar Dir')
-    #  return S_OK()#because if the logs are lost, it's not the end of the world.
+    ##The archive is already there, only its name changes
+    self.logLFNPath = '%s.%s' % (self.logLFNPath, self.logCompression)
+    tarFileName = os.path.basename(self.logArchive)
 
     ############################################################
     #Instantiate the failover transfer client with the global request object
@@ -243,7 +225,7 @@ class UploadLogFile(ModuleBase):
     random.shuffle(self.failoverSEs)
     self.log.info("Attempting to store file %s to the following SE(s):\n%s" % (tarFileName, 
                                                                                string.join(self.failoverSEs, ', ')))
-    result = failoverTransfer.transferAndRegisterFile(tarFileName, '%s/%s' % (tarFileDir, tarFileName), self.logLFNPath, 
+    result = failoverTransfer.transferAndRegisterFile(tarFileName, self.logArchive, self.logLFNPath, 
                                                       self.failoverSEs, fileGUID=None, 
                                                       fileCatalog = ['FileCatalog', 'LcgFileCatalog'])
     if not result['OK']:
@@ -270,7 +252,7 @@ class UploadLogFile(ModuleBase):
 
   #############################################################################
   def determineRelevantFiles(self):
-    """ The files which are below a configurable size will be stored in the logs.
+    """ The files with the configured extensions will be stored in the logs.
         This will typically pick up everything in the working directory minus the output data files.
     """
     logFileExtensions = ['*.txt', '*.log', '*.out', '*.output', '*.xml', '*.sh', '*.info', '*.err','*.root']
@@ -291,25 +273,15 @@ class UploadLogFile(ModuleBase):
           self.log.debug('Found locally existing log file: %s' % check)
           candidateFiles.append(check)
 
-    selectedFiles = []
-    try:
-      for candidate in candidateFiles:
-        fileSize = os.stat(candidate)[6]
-        if fileSize < self.logSizeLimit:
-          selectedFiles.append(candidate)
-        else:
-          self.log.error('Log file found to be greater than maximum of %s bytes' % self.logSizeLimit, candidate)
-      return S_OK(selectedFiles)
-    except Exception, x:
-      self.log.exception('Exception while determining files to save.', '', str(x))
-      return S_ERROR('Could not determine log files')
+    ##The files above the size limit are truncated when packed, see packLogDirectory
+    return S_OK(candidateFiles)
 
   #############################################################################
-  def populateLogDirectory(self, selectedFiles):
-    """ A temporary directory is created for all the selected files.
-        These files are then copied into this directory before being uploaded
+  def packLogDirectory(self, selectedFiles):
+    """ The selected files are streamed in a compressed archive, alone in the log directory, 
+        which is then uploaded. Files bigger than /LogFiles/SizeLimit are truncated.
     """
-    # Create the temporary directory
+    # Create the directory
     try:
       if not os.path.exists(self.logdir):
         os.makedirs(self.logdir)
@@ -322,23 +294,19 @@ class UploadLogFile(ModuleBase):
       os.chmod(self.logdir, 0755)
     except Exception, x:
       self.log.error('Could not set logdir permissions to 0755:', '%s (%s)' % ( self.logdir, str(x) ) )
-    # Populate the temporary directory
-    try:
-      for myfile in selectedFiles:
-        destinationFile = '%s/%s' % (self.logdir, os.path.basename(myfile))
-        shutil.copy(myfile, destinationFile)
-    except Exception, x:
-      self.log.exception('Exception while trying to copy file.', myfile, str(x))
-      self.log.info('File %s will be skipped and can be considered lost.' % myfile)
 
-    # Now verify the contents of our target log dir
-    successfulFiles = os.listdir(self.logdir)
-    if len(successfulFiles) == 0:
-      self.log.info('Failed to copy any files to the target directory.')
-      return S_ERROR()
-    else:
-      self.log.info('Prepared %s files in the temporary directory.' % self.logdir)
-      return S_OK()
+    self.logArchive = '%s/%s.%s' % (self.logdir, os.path.basename(self.logLFNPath), self.logCompression)
+    res = packLogFiles(selectedFiles, self.logArchive, self.logCompression, self.logSizeLimit)
+    if not res['OK']:
+      return res
+    packed = len(selectedFiles) - len(res['Value']['Skipped'])
+    if not packed:
+      self.log.info('Failed to pack any file.')
+      return S_ERROR('No log file to pack')
+    self.log.info('Packed %s files (%s truncated) in %s, %s bytes' % (packed, len(res['Value']['Truncated']),
+                                                                      self.logArchive,
+                                                                      os.path.getsize(self.logArchive)))
+    return S_OK()
     
   #############################################################################
   def createLogUploadRequest(self, targetSE, logFileLFN):
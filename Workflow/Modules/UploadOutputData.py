@@ -21,7 +21,7 @@ from DIRAC.ConfigurationSystem.Client.Helpers.Operations     import Operations
 from DIRAC import S_OK, S_ERROR, gLogger, gConfig
 import DIRAC
 
-import string, os, random, time
+import string, os, random, time, threading, Queue
 
 class UploadOutputData(ModuleBase):
   """ As name suggest: upload output data. For Production only: See L{UserJobFinalization} for User job upload.
@@ -46,6 +46,7 @@ class UploadOutputData(ModuleBase):
     self.PRODUCTION_ID = ""
     self.prodOutputLFNs = []
     self.experiment = "CLIC"
+    self.failedRequest = ''
 
   #############################################################################
   def applicationSpecificInputs(self):
@@ -253,56 +254,52 @@ class UploadOutputData(ModuleBase):
     fopen.write('%s' % time.asctime())
     fopen.close()
     
-    #Instantiate the failover transfer client with the global request object
-    failoverTransfer = FailoverTransfer(self.request)
-
     catalogs = ['FileCatalog', 'LcgFileCatalog']
 
-
-    #One by one upload the files with failover if necessary
+    def transfer(failoverTransfer, fileName, metadata):
+      """ Upload to the resolved SEs
+      """
+      self.log.info("Attempting to store file %s to the following SE(s):\n%s" % (fileName, 
+                                                                                 string.join(metadata['resolvedSE'], 
+                                                                                             ', ')))
+      return failoverTransfer.transferAndRegisterFile(fileName, metadata['localpath'], 
+                                                      metadata['lfn'], metadata['resolvedSE'], 
+                                                      fileGUID = metadata['guid'], fileCatalog = catalogs)
+
+    def transferFailover(failoverTransfer, fileName, metadata):
+      """ Upload to a failover SE, with a request to move it to the target SE
+      """
+      return failoverTransfer.transferAndRegisterFileFailover(fileName, metadata['localpath'],
+                                                              metadata['lfn'], metadata['targetSE'], 
+                                                              metadata['resolvedSE'],
+                                                              fileGUID = metadata['guid'], fileCatalog = catalogs)
+
+    #Upload the files in parallel, with failover if necessary
     failover = {}
     if not self.failoverTest:
-      for fileName, metadata in final.items():
-        self.log.info("Attempting to store file %s to the following SE(s):\n%s" % (fileName, 
-                                                                                   string.join(metadata['resolvedSE'], 
-                                                                                               ', ')))
-        result = failoverTransfer.transferAndRegisterFile(fileName, metadata['localpath'], 
-                                                          metadata['lfn'], metadata['resolvedSE'], 
-                                                          fileGUID = metadata['guid'], fileCatalog = catalogs)
-        if not result['OK']:
-          self.log.error('Could not transfer and register %s with metadata:\n %s' % (fileName, metadata))
-          failover[fileName] = metadata
-        else:
-          lfn = metadata['lfn']
+      failover = self.__transferFiles(final, transfer)
     else:
       failover = final
 
     self.failoverSEs = self.ops.getValue("Production/%s/FailOverSE" % self.experiment, self.failoverSEs)  
 
     cleanUp = False
-    for fileName, metadata in failover.items():
+    if failover:
       self.log.info('Setting default catalog for failover transfer to FileCatalog')
-      random.shuffle(self.failoverSEs)
-      targetSE = metadata['resolvedSE'][0]
-      metadata['resolvedSE'] = self.failoverSEs
-      result = failoverTransfer.transferAndRegisterFileFailover(fileName, metadata['localpath'],
-                                                                metadata['lfn'], targetSE, metadata['resolvedSE'],
-                                                                fileGUID = metadata['guid'], fileCatalog = catalogs)
-      if not result['OK']:
-        self.log.error('Could not transfer and register %s with metadata:\n %s' % (fileName, metadata))
+      for fileName, metadata in failover.items():
+        random.shuffle(self.failoverSEs)
+        metadata['targetSE'] = metadata['resolvedSE'][0]
+        metadata['resolvedSE'] = list(self.failoverSEs)
+      ##no point continuing if one completely fails
+      if self.__transferFiles(failover, transferFailover, stopOnFailure = True):
         cleanUp = True
-        break #no point continuing if one completely fails
 
     os.remove("DISABLE_WATCHDOG_CPU_WALLCLOCK_CHECK") #cleanup the mess
 
-    #Now after all operations, retrieve potentially modified request object
-    result = failoverTransfer.getRequestObject()
-    if not result['OK']:
-      self.log.error(result)
+    if self.failedRequest:
+      self.log.error(self.failedRequest)
       return S_ERROR('Could not retrieve modified request')
 
-    self.request = result['Value']
-
     #If some or all of the files failed to be saved to failover
     if cleanUp:
       lfns = []
@@ -337,6 +334,83 @@ class UploadOutputData(ModuleBase):
     self.workflow_commons['Request'] = self.request
     return S_OK('Output data uploaded')
 
+  #############################################################################
+  def __transferFiles(self, files, transfer, stopOnFailure = False):
+    """ Call transfer(failoverTransfer, fileName, metadata) for all the files, using a pool of threads
+    whose size is given by Production/MaxUploadThreads. At most Production/MaxUploadsPerSE files are 
+    sent to the same SE at the same time. Each thread uses its own request object, they are added to 
+    self.request once all the threads are done. Returns the files that could not be transferred.
+    """
+    nbthreads = self.ops.getValue("Production/MaxUploadThreads", 4)
+    nbthreads = max(1, min(nbthreads, len(files)))
+    maxperse = max(1, self.ops.getValue("Production/MaxUploadsPerSE", 2))
+    semaphores = {}
+    toupload = Queue.Queue()
+    for fileName, metadata in files.items():
+      targetSE = metadata['resolvedSE'] and metadata['resolvedSE'][0] or ''
+      semaphores.setdefault(targetSE, threading.Semaphore(maxperse))
+      toupload.put((fileName, metadata, semaphores[targetSE]))
+    lock = threading.Lock()
+    state = {'Failed' : {}, 'Abort' : False, 'Requests' : []}
+
+    def worker():
+      """ Transfer files until there is nothing left, or a transfer failed when stopOnFailure
+      """
+      failoverTransfer = FailoverTransfer(RequestContainer())
+      while not state['Abort']:
+        try:
+          fileName, metadata, semaphore = toupload.get_nowait()
+        except Queue.Empty:
+          break
+        semaphore.acquire()
+        start = time.time()
+        try:
+          try:
+            result = transfer(failoverTransfer, fileName, metadata)
+          except Exception, x:
+            result = S_ERROR(str(x))
+        finally:
+          semaphore.release()
+        lock.acquire()
+        try:
+          if not result['OK']:
+            self.log.error('Could not transfer and register %s with metadata:\n %s' % (fileName, metadata))
+            state['Failed'][fileName] = metadata
+            if stopOnFailure:
+              state['Abort'] = True
+          else:
+            self.log.info("Stored %s in %.1f s" % (fileName, time.time() - start))
+        finally:
+          lock.release()
+      result = failoverTransfer.getRequestObject()
+      lock.acquire()
+      try:
+        if result['OK']:
+          state['Requests'].append(result['Value'])
+        else:
+          self.failedRequest = result['Message']
+      finally:
+        lock.release()
+
+    self.log.info("Uploading %s files with %s threads, at most %s per SE" % (len(files), nbthreads, maxperse))
+    start = time.time()
+    threads = []
+    for dummy in range(nbthreads):
+      thread = threading.Thread(target = worker)
+      thread.setDaemon(True)
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+    self.log.info("Upload done in %.1f s, %s failures" % (time.time() - start, len(state['Failed'])))
+
+    ##Only now that the threads are done the requests can be merged
+    for request in state['Requests']:
+      result = self.request.update(request)
+      if not result['OK']:
+        self.failedRequest = result['Message']
+    return state['Failed']
+
   #############################################################################
   def __cleanUp(self, lfnList):
     """ Clean up uploaded data for the LFNs in the list
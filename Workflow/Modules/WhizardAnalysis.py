@@ -25,11 +25,25 @@ from ILCDIRAC.Core.Utilities.resolvePathsAndNames          import getProdFilenam
 from ILCDIRAC.Core.Utilities.PrepareLibs                   import removeLibc
 from ILCDIRAC.Core.Utilities.GeneratorModels               import GeneratorModels
 from ILCDIRAC.Core.Utilities.WhizardOptions                import WhizardOptions
+from ILCDIRAC.Core.Utilities.LogParser                     import LogParser
 
 from DIRAC import gLogger, S_OK, S_ERROR
 
 import os, shutil, glob
 
+def _whizardFatal(match, results):
+  """ Keep the error, nothing after it matters
+  """
+  results['Message'] = match.string
+  return True
+
+##What is looked for in the Whizard log, see L{LogParser}
+WHIZARD_LOG_RULES = [(r'! Event sample corresponds to luminosity', 
+                      lambda match, results: results.update({'Luminosity' : match.string.split()[-1]})),
+                     (r'\*\*\* Fatal error:|PYSTOP|No matrix element available|Floating point exception', 
+                      _whizardFatal),
+                     (r'Event generation finished\.', lambda match, results: results.update({'Success' : True}))]
+
 class WhizardAnalysis(ModuleBase):
   """
   Specific Module to run a Whizard job.
@@ -423,7 +437,9 @@ class WhizardAnalysis(ModuleBase):
     comm = 'sh -c "./%s"' % (scriptName)    
     self.setApplicationStatus('Whizard %s step %s' %(self.applicationVersion, self.STEP_NUMBER))
     self.stdError = ''
+    self.logParser = LogParser(WHIZARD_LOG_RULES)
     self.result = shellCall(0, comm, callbackFunction = self.redirectLogOutput, bufferLimit=209715200)
+    self.closeLogOutput()
     #self.result = {'OK':True,'Value':(0,'Disabled Execution','')}
     if not self.result['OK']:
       self.log.error("Failed with error %s" % self.result['Message'])
@@ -432,36 +448,10 @@ class WhizardAnalysis(ModuleBase):
       self.setApplicationStatus('%s failed terribly, you are doomed!' % (self.applicationName))
       if not self.ignoreapperrors:
         return S_ERROR('%s did not produce the expected log' % (self.applicationName))
-    lumi = ''
-    message = ""
-    success = False
-    ###Analyse log file
-    logfile = file(self.applicationLog)
-    for line in logfile:
-      if line.count('! Event sample corresponds to luminosity'):
-        elems = line.split()
-        lumi = elems[-1]
-      if line.count("*** Fatal error:"):
-        status = 1
-        message = line
-        break
-      elif line.count("PYSTOP"):
-        status = 1
-        message = line
-        break
-      elif line.count("No matrix element available"):
-        status = 1
-        message = line
-        break
-      elif line.count("Floating point exception"):
-        status = 1
-        message = line
-        break
-      elif line.count("Event generation finished."):
-        success = True
-      else:
-        status = 0
-    if success:
+    ###The log was analysed while Whizard was running
+    lumi = self.logParser.results.get('Luminosity', '')
+    message = self.logParser.results.get('Message', '')
+    if self.logParser.results.get('Success', False):
       status = 0
     else:
       status = 1
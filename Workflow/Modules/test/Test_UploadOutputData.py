@@ -0,0 +1,181 @@
+'''
+Tests of the parallel upload of L{UploadOutputData}, against storage elements that are local
+directories.
+
+@author: agent
+@since: Oct 18, 2026
+'''
+__RCSID__ = "$Id$"
+
+from ILCDIRAC.Workflow.Modules                              import UploadOutputData as UploadModule
+from DIRAC                                                   import S_OK, S_ERROR
+import unittest, tempfile, shutil, threading, time, os
+
+class FakeRequest(object):
+  """ Stands for the RequestContainer: a list of operations
+  """
+  def __init__(self):
+    self.operations = []
+
+  def update(self, request):
+    """ Add the operations of the other request
+    """
+    self.operations.extend(request.operations)
+    return S_OK()
+
+class FakeStorage(object):
+  """ Storage elements as directories, recording how many uploads each one gets at the same time
+  """
+  def __init__(self, path, failing = ()):
+    self.path = path
+    self.failing = failing
+    self.lock = threading.Lock()
+    self.active = {}
+    self.maxActive = {}
+    self.calls = []
+
+  def put(self, localpath, lfn, se):
+    """ Copy the file in the directory of the SE, slowly
+    """
+    self.lock.acquire()
+    try:
+      self.calls.append(lfn)
+      self.active[se] = self.active.get(se, 0) + 1
+      self.maxActive[se] = max(self.maxActive.get(se, 0), self.active[se])
+    finally:
+      self.lock.release()
+    try:
+      time.sleep(0.2)
+      if se in self.failing:
+        return S_ERROR("%s is not available" % se)
+      destination = os.path.join(self.path, se, lfn.lstrip("/"))
+      if not os.path.isdir(os.path.dirname(destination)):
+        os.makedirs(os.path.dirname(destination))
+      shutil.copy(localpath, destination)
+      return S_OK()
+    finally:
+      self.lock.acquire()
+      self.active[se] -= 1
+      self.lock.release()
+
+class FakeOps(object):
+  """ Stands for Operations, with the given options
+  """
+  def __init__(self, options):
+    self.options = options
+
+  def getValue(self, option, default = None):
+    """ The value of the option, default if not set
+    """
+    return self.options.get(option, default)
+
+class UploadOutputDataTestCase(unittest.TestCase):
+  """ Base class of the tests: the module uploads to a FakeStorage through a fake FailoverTransfer
+  """
+  def setUp(self):
+    self.area = tempfile.mkdtemp()
+    self.storage = FakeStorage(os.path.join(self.area, 'SE'))
+    storage = self.storage
+
+    class FakeFailoverTransfer(object):
+      """ Stands for FailoverTransfer: each transfer is recorded in the request it was given
+      """
+      def __init__(self, request):
+        self.request = request
+
+      def transferAndRegisterFile(self, fileName, localPath, lfn, destinationSEList, fileGUID = None, 
+                                  fileCatalog = None):
+        """ Upload to the first SE, registering in the request what was done
+        """
+        res = storage.put(localPath, lfn, destinationSEList[0])
+        self.request.operations.append((res['OK'] and 'register' or 'failed', lfn))
+        return res
+
+      def getRequestObject(self):
+        """ The request filled by this object
+        """
+        return S_OK(self.request)
+
+    self.failoverTransfer = UploadModule.FailoverTransfer
+    self.requestContainer = UploadModule.RequestContainer
+    UploadModule.FailoverTransfer = FakeFailoverTransfer
+    UploadModule.RequestContainer = FakeRequest
+    self.module = UploadModule.UploadOutputData()
+    self.module.ops = FakeOps({'Production/MaxUploadThreads' : 8, 'Production/MaxUploadsPerSE' : 2})
+    self.module.request = FakeRequest()
+
+  def tearDown(self):
+    UploadModule.FailoverTransfer = self.failoverTransfer
+    UploadModule.RequestContainer = self.requestContainer
+    shutil.rmtree(self.area, True)
+
+  def makeFiles(self, ses):
+    """ One output file per SE in ses, returns the files as given to __transferFiles
+    """
+    files = {}
+    for index, se in enumerate(ses):
+      fileName = "output_%s.slcio" % index
+      localpath = os.path.join(self.area, fileName)
+      localfile = open(localpath, 'w')
+      localfile.write(fileName)
+      localfile.close()
+      files[fileName] = {'localpath' : localpath, 'lfn' : '/ilc/prod/test/%s' % fileName, 
+                         'resolvedSE' : [se], 'guid' : ''}
+    return files
+
+  def transfer(self, failoverTransfer, fileName, metadata):
+    """ What UploadOutputData.execute gives to __transferFiles
+    """
+    return failoverTransfer.transferAndRegisterFile(fileName, metadata['localpath'], metadata['lfn'],
+                                                    metadata['resolvedSE'], fileGUID = metadata['guid'])
+
+  def transferFiles(self, files, stopOnFailure = False):
+    """ Call the private __transferFiles
+    """
+    return self.module._UploadOutputData__transferFiles(files, self.transfer, stopOnFailure)
+
+class TransferFilesTest(UploadOutputDataTestCase):
+  """ Parallel upload of the files
+  """
+  def test_allUploaded(self):
+    """ All the files are stored, with no more than MaxUploadsPerSE at a time on each SE
+    """
+    files = self.makeFiles(['SE-A'] * 6 + ['SE-B'] * 6)
+    failed = self.transferFiles(files)
+    self.assertEqual(failed, {})
+    for metadata in files.values():
+      stored = os.path.join(self.storage.path, metadata['resolvedSE'][0], metadata['lfn'].lstrip("/"))
+      self.assertTrue(os.path.exists(stored))
+    self.assertEqual(self.storage.maxActive, {'SE-A' : 2, 'SE-B' : 2})
+
+  def test_requestsMerged(self):
+    """ The operations recorded by all the threads end up in the request of the module, once each
+    """
+    files = self.makeFiles(['SE-A', 'SE-B', 'SE-C'] * 3)
+    self.storage.failing = ('SE-C',)
+    failed = self.transferFiles(files)
+    self.assertEqual(sorted(failed.keys()), sorted([name for name, metadata in files.items() 
+                                                    if metadata['resolvedSE'] == ['SE-C']]))
+    expected = [(metadata['resolvedSE'] == ['SE-C'] and 'failed' or 'register', metadata['lfn']) 
+                for metadata in files.values()]
+    self.assertEqual(sorted(self.module.request.operations), sorted(expected))
+    self.assertEqual(self.module.failedRequest, '')
+
+  def test_stopOnFailure(self):
+    """ After a failure, the files not started yet are not transferred
+    """
+    self.module.ops = FakeOps({'Production/MaxUploadThreads' : 1})
+    files = self.makeFiles(['SE-C'] * 4)
+    self.storage.failing = ('SE-C',)
+    failed = self.transferFiles(files, stopOnFailure = True)
+    self.assertEqual(len(failed), 1)
+    self.assertEqual(len(self.storage.calls), 1)
+    ##Without it, everything is tried
+    self.storage.calls = []
+    failed = self.transferFiles(files)
+    self.assertEqual(len(failed), 4)
+    self.assertEqual(len(self.storage.calls), 4)
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase(TransferFilesTest)
+  testResult = unittest.TextTestRunner(verbosity = 2).run(suite)